@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Merge the variant calls of multiple callers into a consensus table
+
+Calls are given as '<caller>=<VCF file>', or '<caller>=<directory>'.  With
+directories, the call files of every sample are paired by name across the
+callers (e.g. 'gatk/sample.vcf.gz', and 'muse/sample.vcf'), and a table
+is written per sample: '<output>/<sample>.parquet'.
+
+"""
+
+import logging
+from argparse import ArgumentParser
+from pathlib import Path
+
+from genomegenie.cli import RawArgDefaultFormatter, logger_config
+from genomegenie.merge import merge_calls, pair_calls
+
+
+def caller_path(arg):
+    caller, sep, path = arg.partition("=")
+    if not sep or not caller or not path:
+        raise ValueError(f"expected '<caller>=<path>', got {arg!r}")
+    return caller, path
+
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawArgDefaultFormatter)
+parser.add_argument(
+    "calls", nargs="+", type=caller_path, help="Calls as '<caller>=<path>'"
+)
+parser.add_argument(
+    "-o", "--output", required=True, help="Output file, or directory (per sample)"
+)
+parser.add_argument(
+    "-m",
+    "--min-callers",
+    default=1,
+    type=int,
+    help="Keep variants called by at least this many callers",
+)
+parser.add_argument(
+    "-p",
+    "--passed-only",
+    action="store_true",
+    help="Only consider calls that pass all filters",
+)
+loglvls = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+parser.add_argument("--log-level", default="INFO", choices=loglvls)
+parser.add_argument("-l", "--log-file")
+
+
+if __name__ == "__main__":
+    opts = parser.parse_args()
+
+    logger = logging.getLogger("genomegenie")
+    fmt = "{levelname}:{asctime}:{name}:{lineno}: {message}"
+    logger = logger_config(logger, fmt, opts.log_level, opts.log_file)
+
+    calls = dict(opts.calls)
+    if all(Path(i).is_dir() for i in calls.values()):
+        output = Path(opts.output)
+        output.mkdir(parents=True, exist_ok=True)
+        for sample, paired in pair_calls(calls).items():
+            if len(paired) < len(calls):
+                missing = ", ".join(sorted(set(calls) - set(paired)))
+                logger.warning(f"{sample}: no calls from {missing}")
+            path = output / f"{sample}.parquet"
+            merge_calls(paired, path, opts.min_callers, opts.passed_only)
+    else:
+        merge_calls(calls, opts.output, opts.min_callers, opts.passed_only)
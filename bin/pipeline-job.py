@@ -3,25 +3,61 @@
 """Pipeline script"""
 
 import logging
+import os
 from argparse import ArgumentParser
 
+import pyarrow.parquet as pq
 from dask.distributed import Client, LocalCluster
 
+from genomegenie.batch.accounting import recommend
 from genomegenie.batch.jobs import Pipeline
+from genomegenie.batch.state import JobStore
 from genomegenie.batch.factory import template_dir
-from genomegenie.utils import results, contents, job_status, read_config
-from genomegenie.cli import RawArgDefaultFormatter, logger_config
+from genomegenie.batch import timeline
+from genomegenie.utils import results, results_table, read_config, LogIndex
+from genomegenie.cli import RawArgDefaultFormatter, StatusView, logger_config
 
 
 parser = ArgumentParser(description=__doc__, formatter_class=RawArgDefaultFormatter)
-parser.add_argument("options", help="JSON option file")
+parser.add_argument(
+    "options", help="JSON option file, or a compiled plan ('.parquet')"
+)
 loglvls = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
 parser.add_argument("--log-level", default="INFO", choices=loglvls)
 parser.add_argument("-l", "--log-file")
 parser.add_argument("-d", "--debug", action="store_true")
+parser.add_argument(
+    "-b",
+    "--backend",
+    default="sge",
+    choices=["sge", "local"],
+    help="Batch system, 'local' runs jobs on this machine",
+)
 parser.add_argument(
     "-t", "--template-dir", default=template_dir(), help="Template directory"
 )
+parser.add_argument(
+    "-c",
+    "--compile",
+    metavar="PLAN",
+    help="Compile the options into a job plan (parquet), and exit; pass the "
+    "plan instead of the options to run it",
+)
+parser.add_argument(
+    "-s", "--state", help="Job state database, finished jobs are not rerun"
+)
+parser.add_argument(
+    "--script-dir", help="Keep job scripts in this directory, named by their hash"
+)
+parser.add_argument(
+    "-u",
+    "--usage",
+    help="Write job resource usage to this file (parquet), and log resource "
+    "requests per task based on the usage",
+)
+parser.add_argument(
+    "--watch", action="store_true", help="Show live job status while running"
+)
 parser.add_argument(
     "-w",
     "--wait",
@@ -34,12 +70,6 @@ parser.add_argument(
 if __name__ == "__main__":
     opts = parser.parse_args()
 
-    jobopts = read_config(opts.options)
-    # prepend input dir to sample filenames
-    for infiles in jobopts["inputs"]:
-        for key, value in infiles.items():
-            infiles[key] = f"{jobopts['inputdir']}/{value}"
-
     debug = opts.debug
     loglevel = "DEBUG" if debug else opts.log_level
 
@@ -52,28 +82,70 @@ if __name__ == "__main__":
     fmt = "{levelname}:{asctime}:{name}:{lineno}: {message}"
     logger = logger_config(logger, fmt, loglevel, logfile)
 
-    cluster = LocalCluster(n_workers=4, processes=True, memory_limit="1GB")
+    if opts.options.endswith(".parquet"):  # resolved options & job scripts
+        pipeline = Pipeline.from_plan(opts.options)
+    else:
+        jobopts = read_config(opts.options)
+        # prepend input dir to sample filenames
+        for infiles in jobopts["inputs"]:
+            for key, value in infiles.items():
+                infiles[key] = f"{jobopts['inputdir']}/{value}"
+        pipeline = Pipeline(jobopts, backend=opts.backend)
+        pipeline.tmpl_dir = opts.template_dir
+        if opts.compile:
+            pipeline.compile(opts.compile)
+            raise SystemExit(0)
+    backend = pipeline.backend
+    jobopts = pipeline.options
+
+    if backend == "local":  # threads, so that all jobs share one pool
+        nthreads = len(os.sched_getaffinity(0))
+        cluster = LocalCluster(
+            n_workers=1, threads_per_worker=nthreads, processes=False
+        )
+    else:
+        cluster = LocalCluster(n_workers=4, processes=True, memory_limit="1GB")
     client = Client(cluster)
 
-    pipeline = Pipeline(jobopts)
     pipeline.debug = debug
-    pipeline.tmpl_dir = opts.template_dir
-
-    staged = pipeline.stage(
-        pipeline.graph, pipeline.process, pipeline.submit, monitor_t=opts.wait
-    )
-    res = staged.compute()
+    if opts.state:
+        pipeline.store = JobStore(opts.state)
+    pipeline.script_dir = opts.script_dir
+
+    staged = pipeline.prepare(monitor_t=opts.wait)
+    future, events = pipeline.monitor(staged, client)
+    if opts.watch:
+        view = StatusView()
+        for event in events:
+            view.update(event)
+            logger.info(f"{event.status} {event.task} ({event.jobid}): {view}")
+    res = future.result()
+    logger.info(f"Time to first submit: {pipeline.time_to_first_submit(res)}s")
     df = results(res, cols=["script"] if debug else ["jobid", "out", "err", "script"])
 
     if not debug:  # get logs, find job status
-        logs = df.jobid.apply(contents, args=(jobopts["sge"]["log_directory"],))
-        status = logs.apply(job_status)
-        df = df.assign(log=logs, success=status)
-        summary = df["success", "jobid"].groupby("success").count()
+        index = LogIndex(jobopts[backend]["log_directory"])
+        logs = [index.get(jobid) for jobid in df.jobid]
+        df = df.assign(log=logs, success=index.status(df.jobid))
+        if pipeline.store is not None:
+            found = df.success.notnull()
+            pipeline.store.update_status(df.jobid[found], df.success[found])
+        summary = df[["success", "jobid"]].groupby("success").count()
         logger.info("Pipeline summary:\n" + summary.to_string())
 
+    if opts.usage:
+        usage = pipeline.usage(res)
+        usage.to_parquet(opts.usage)
+        logger.info(f"Wrote job resource usage to {opts.usage!r}")
+        logger.info("Suggested resource requests:\n" + recommend(usage).to_string())
+
     df.to_parquet("pipeline-scripts.parquet")
-    logger.info("Wrote scripts and logs to 'pipeline-scripts.parquet'")
+    logger.info("Wrote scripts and log files to 'pipeline-scripts.parquet'")
+    pq.write_table(results_table(res, timeline.columns), "pipeline-timings.parquet")
+    logger.info(
+        "Wrote job timings to 'pipeline-timings.parquet', "
+        "analyse with pipeline-timeline.py"
+    )
     logger.debug("Summary:\n" + df.to_string())
 
     # shutdown cluster
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Pipeline timing analysis: critical path, slack, and makespan
+
+Reads the job timings written by the pipeline script, and writes a
+timeline that can be opened in chrome://tracing or https://ui.perfetto.dev
+
+"""
+
+import logging
+from argparse import ArgumentParser
+
+import pandas as pd
+
+from genomegenie.batch.timeline import (
+    chrome_trace,
+    critical_path,
+    makespan,
+    schedule,
+    task_durations,
+)
+from genomegenie.cli import RawArgDefaultFormatter, logger_config
+from genomegenie.utils import read_config
+
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawArgDefaultFormatter)
+parser.add_argument("options", help="JSON option file, with the pipeline graph")
+parser.add_argument("timings", help="Job timings (parquet)")
+loglvls = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+parser.add_argument("--log-level", default="INFO", choices=loglvls)
+parser.add_argument("-l", "--log-file")
+parser.add_argument(
+    "-s",
+    "--start",
+    default="submitted",
+    choices=["submitted", "started"],
+    help="Task start, 'started' excludes the time jobs wait in the queue",
+)
+parser.add_argument(
+    "-j",
+    "--parallelism",
+    type=int,
+    action="append",
+    help="Estimate the makespan with at most this many concurrent jobs "
+    "(repeat for several estimates)",
+)
+parser.add_argument("-o", "--output", default="pipeline-trace.json", help="Timeline")
+
+
+if __name__ == "__main__":
+    opts = parser.parse_args()
+
+    logger = logging.getLogger("genomegenie")
+    fmt = "{levelname}:{asctime}:{name}:{lineno}: {message}"
+    logger = logger_config(logger, fmt, opts.log_level, opts.log_file)
+
+    graph = read_config(opts.options)["pipeline"]
+    df = pd.read_parquet(opts.timings)
+
+    sched = schedule(graph, task_durations(df, opts.start))
+    logger.info("Schedule (seconds):\n" + sched.to_string())
+    logger.info("Critical path: " + " -> ".join(critical_path(sched)))
+    logger.info(f"Makespan: {sched.earliest_finish.max():.0f}s")
+    for parallelism in [None] + (opts.parallelism or []):
+        estimate = makespan(graph, df, parallelism)
+        limit = parallelism or "no limit"
+        logger.info(f"Estimated makespan ({limit}): {estimate:.0f}s")
+
+    chrome_trace(df, opts.output, sched)
+    logger.info(f"Wrote timeline to {opts.output!r}")
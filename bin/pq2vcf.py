@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Export converted variants (Parquet) to a bgzipped, and indexed VCF file
+
+The header is read from the header table written by the conversion
+('<dataset>/_header.parquet').  A region is given as '<chrom>', or
+'<chrom>:<start>-<end>' with 1-based inclusive coordinates, like tabix.
+
+"""
+
+import logging
+import time
+from argparse import ArgumentParser
+
+from genomegenie.cli import RawArgDefaultFormatter, logger_config
+from genomegenie.export import to_vcf
+
+
+def region(arg):
+    """'<chrom>:<start>-<end>' -> (chrom, start - 1, end)"""
+    chrom, sep, span = arg.rpartition(":")
+    if not sep:
+        return (arg,)
+    start, _, end = span.partition("-")
+    return (chrom, int(start) - 1, int(end) if end else None)
+
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawArgDefaultFormatter)
+parser.add_argument("source", help="Parquet file, or dataset directory")
+parser.add_argument("output", help="Output VCF file (e.g. 'variants.vcf.gz')")
+parser.add_argument("-r", "--region", type=region, help="Region to export")
+parser.add_argument("-s", "--samples", nargs="+", help="Samples (default: all)")
+parser.add_argument(
+    "-j", "--threads", type=int, help="Compression threads (default: all CPUs)"
+)
+loglvls = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+parser.add_argument("--log-level", default="INFO", choices=loglvls)
+parser.add_argument("-l", "--log-file")
+
+
+if __name__ == "__main__":
+    opts = parser.parse_args()
+
+    logger = logging.getLogger("genomegenie")
+    fmt = "{levelname}:{asctime}:{name}:{lineno}: {message}"
+    logger = logger_config(logger, fmt, opts.log_level, opts.log_file)
+
+    t0 = time.perf_counter()
+    path = to_vcf(
+        opts.source,
+        opts.output,
+        region=opts.region,
+        samples=opts.samples,
+        threads=opts.threads,
+    )
+    logger.info(f"Parquet => VCF: {path} in {time.perf_counter() - t0:.3f}s")
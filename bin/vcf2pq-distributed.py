@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+# coding=utf-8
+"""Convert a VCF file to Parquet on a dask cluster
+
+The VCF file is split in regions, and the workers convert, and write the
+regions to '<outdir>/<chrom>/<start>.parquet'.  Without a scheduler, a
+local cluster is started; to use more nodes, start a scheduler, and workers
+as batch jobs, e.g. on SGE:
+
+  dask-scheduler --scheduler-file scheduler.json &
+  qsub -t 1-50 -b y dask-worker --scheduler-file scheduler.json --nthreads 1
+
+and pass the scheduler file.  The VCF file, and the output directory should
+be on a filesystem shared by the workers.
+
+Unindexed (bgzipped) files, or files with very dense regions can be split
+in chunks of records at BGZF block boundaries instead, which are written to
+'<outdir>/chunk-<k>.parquet'.
+
+"""
+
+import logging
+import time
+from argparse import ArgumentParser
+
+from dask.distributed import Client, LocalCluster
+from dask.utils import parse_bytes
+
+from genomegenie.cli import RawArgDefaultFormatter, logger_config
+from genomegenie.convert import vcf2parquet
+from genomegenie.index import build_index
+from genomegenie.transpose import to_sample_major
+
+
+parser = ArgumentParser(description=__doc__, formatter_class=RawArgDefaultFormatter)
+parser.add_argument("vcf", help="VCF file (bgzipped)")
+parser.add_argument("outdir", help="Output directory")
+loglvls = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
+parser.add_argument("--log-level", default="INFO", choices=loglvls)
+parser.add_argument("-l", "--log-file")
+parser.add_argument(
+    "-s", "--size", default=200_000, type=int, help="Region size in bases"
+)
+parser.add_argument(
+    "-b",
+    "--chunk-size",
+    type=parse_bytes,
+    help="Split in chunks of compressed bytes (e.g. 16MB) instead of regions, "
+    "the default for unindexed files",
+)
+parser.add_argument(
+    "-c", "--contigs", nargs="+", help="Contigs to convert (default: all)"
+)
+parser.add_argument(
+    "--sample-major",
+    metavar="STORE",
+    help="Also write a sample-major genotype store, for per sample queries",
+)
+parser.add_argument(
+    "--encoding",
+    default="int8",
+    choices=["int8", "bits"],
+    help="Genotype encoding of the sample-major store",
+)
+parser.add_argument(
+    "-i",
+    "--index",
+    action="store_true",
+    help="Index the output by ID, and position ('<outdir>/_index')",
+)
+group = parser.add_mutually_exclusive_group()
+group.add_argument("--scheduler", help="Scheduler address")
+group.add_argument("--scheduler-file", help="Scheduler file")
+group.add_argument(
+    "-n", "--nworkers", default=4, type=int, help="Workers of the local cluster"
+)
+
+
+if __name__ == "__main__":
+    opts = parser.parse_args()
+
+    logger = logging.getLogger("genomegenie")
+    fmt = "{levelname}:{asctime}:{name}:{lineno}: {message}"
+    logger = logger_config(logger, fmt, opts.log_level, opts.log_file)
+
+    cluster = None
+    if opts.scheduler or opts.scheduler_file:
+        client = Client(opts.scheduler, scheduler_file=opts.scheduler_file)
+    else:
+        # one thread per worker: pysam holds the GIL while parsing
+        cluster = LocalCluster(n_workers=opts.nworkers, threads_per_worker=1)
+        client = Client(cluster)
+
+    t0 = time.perf_counter()
+    res = vcf2parquet(
+        opts.vcf, opts.outdir, client, opts.size, opts.contigs, opts.chunk_size
+    )
+    elapsed = time.perf_counter() - t0
+    nrows = sum(n for _, n in res)
+    logger.info(f"VCF => Parquet: {nrows} rows in {elapsed:.3f}s")
+
+    if opts.index and res:
+        t0 = time.perf_counter()
+        index = build_index(opts.outdir)
+        logger.info(f"Index: {index} in {time.perf_counter() - t0:.3f}s")
+
+    if opts.sample_major and res:
+        t0 = time.perf_counter()
+        files = [path for path, _ in res]
+        store = to_sample_major(files, opts.sample_major, encoding=opts.encoding)
+        elapsed = time.perf_counter() - t0
+        logger.info(f"Sample-major store: {store} in {elapsed:.3f}s")
+
+    client.close()
+    if cluster is not None:
+        cluster.close()
@@ -28,14 +28,16 @@
         "output": "/packages/suvayu-testing/outputs/gatk",
         "db": "/packages/suvayu-testing/genomedb/af-only-gnomad.raw.sites.b37.vcf.gz",
         "exome_bed": "/packages/suvayu-testing/exome_bed/TruSeq_exome_targeted_regions.hg19.bed",
-        "nprocs": 4
+        "nprocs": 4,
+        "targets": ["{{ normal_bam | path_transform(output) | bam2pon }}"]
     },
     "pon_consolidate": {
         "inputs": "all",
         "normals_list": "/packages/suvayu-testing/outputs/gatk/normals.txt",
         "output": "/packages/suvayu-testing/outputs/gatk",
         "db": "/packages/suvayu-testing/genomedb/af-only-gnomad.raw.sites.b37.vcf.gz",
-        "pon": "/packages/suvayu-testing/outputs/gatk/pon.vcf.gz"
+        "pon": "/packages/suvayu-testing/outputs/gatk/pon.vcf.gz",
+        "targets": ["{{ pon }}"]
     },
     "gatk": {
         "ref_fasta": "/packages/suvayu-testing/refseq/NCBI37_WO_DECOY.fa",
@@ -43,13 +45,16 @@
         "db": "/packages/suvayu-testing/genomedb/af-only-gnomad.raw.sites.b37.vcf.gz",
         "pon": "/packages/suvayu-testing/outputs/gatk/pon.vcf.gz",
         "exome_bed": "/packages/suvayu-testing/exome_bed/TruSeq_exome_targeted_regions.hg19.bed",
-        "nprocs": 4
+        "nprocs": 4,
+        "sources": ["{{ normal_bam }}", "{{ tumor_bam }}", "{{ pon }}"],
+        "targets": ["{{ normal_bam | path_transform(output, 'vcf.gz') }}"]
     },
     "muse": {
         "ref_fasta": "/packages/suvayu-testing/refseq/NCBI37_WO_DECOY.fa",
         "output": "/packages/suvayu-testing/outputs/muse",
         "db": "/packages/suvayu-testing/dbsnp/dbsnp_138.hg19.vcf.gz",
-        "exome_bed": "/packages/suvayu-testing/exome_bed/TruSeq_exome_targeted_regions.hg19.bed"
+        "exome_bed": "/packages/suvayu-testing/exome_bed/TruSeq_exome_targeted_regions.hg19.bed",
+        "targets": ["{{ normal_bam | path_transform(output) | bam2vcf }}"]
     },
     "variants": {
         "inputs": [
@@ -57,7 +62,8 @@
                 "gatk": "/packages/suvayu-testing/outputs/gatk",
                 "muse": "/packages/suvayu-testing/outputs/muse"
             }
-        ]
+        ],
+        "output": "/packages/suvayu-testing/outputs/variants"
     },
     "sge": {
         "queue": "all.q",
@@ -1 +1,21 @@
-from genomegenie.io import *
+import sys
+
+# the I/O functions need pyarrow, and pysam; load them on first use, so that
+# e.g. template rendering does not pay for them (PEP 562, Python >= 3.7)
+_io_names = ["to_arrow", "to_arrow1", "to_parquet", "read_region", "RegionCache"]
+
+if sys.version_info < (3, 7):
+    from genomegenie.io import *
+else:
+
+    def __getattr__(name):
+        # NOTE: only the I/O names, `from genomegenie import <submodule>`
+        # also looks up attributes on the package
+        if name not in _io_names:
+            raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+        from genomegenie import io
+
+        return getattr(io, name)
+
+    def __dir__():
+        return sorted(list(globals()) + _io_names)
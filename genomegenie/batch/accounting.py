@@ -0,0 +1,185 @@
+# coding=utf-8
+"""Job resource accounting
+
+Every job requests the same resources as set in the backend options (e.g.
+`memory` and `walltime` under "sge"), which usually over-reserves, and
+lengthens queue waits.  The resources used by finished jobs are read from
+the scheduler accounting (`qacct -j <job id>` on SGE), and the usage
+observed per task can be turned into tighter resource requests for later
+runs (see `recommend`).
+
+"""
+
+import logging
+import math
+import re
+import shlex
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# resource usage columns, memory in bytes, time in seconds
+columns = ["maxvmem", "wallclock", "cpu"]
+
+# SGE reports memory with binary prefixes: e.g. 1.953G, 12.340M
+_units = {"": 1, "B": 1, "K": 2 ** 10, "M": 2 ** 20, "G": 2 ** 30, "T": 2 ** 40}
+
+_number = re.compile(r"(?P<value>[0-9.]+)(?P<unit>[A-Za-z]?)")
+
+
+def _parse_value(text, units=None):
+    match = _number.match(text.strip())
+    if match is None:
+        return None
+    value = float(match.group("value"))
+    if units is not None:
+        value *= units[match.group("unit").upper()]
+    return value
+
+
+def parse_qacct(text):
+    """Parse the output of `qacct -j`
+
+    Returns a dictionary of job ids, and the resources used by the job:
+    maxvmem (bytes), wallclock and cpu (seconds), and slots.  When a job is
+    listed more than once (e.g. a job id that was reused), the last entry
+    is kept.
+
+    >>> out = '''
+    ... ==============================================================
+    ... jobnumber    1234
+    ... slots        4
+    ... ru_wallclock 120s
+    ... cpu          400.500s
+    ... maxvmem      1.500G
+    ... '''
+    >>> parse_qacct(out)["1234"]["maxvmem"] == 1.5 * 2 ** 30
+    True
+
+    """
+    usage = {}
+    for block in re.split(r"^=+\s*$", text, flags=re.MULTILINE):
+        fields = dict(
+            line.split(None, 1) for line in block.splitlines() if len(line.split()) > 1
+        )
+        if "jobnumber" not in fields:
+            continue
+        usage[fields["jobnumber"].strip()] = {
+            "maxvmem": _parse_value(fields.get("maxvmem", ""), _units),
+            "wallclock": _parse_value(fields.get("ru_wallclock", "")),
+            "cpu": _parse_value(fields.get("cpu", "")),
+            "slots": _parse_value(fields.get("slots", "")),
+        }
+    return usage
+
+
+def usage(jobids, command="qacct -j", nthreads=8):
+    """Read the resources used by finished jobs from the scheduler
+
+    Job ids of packed jobs ('<job id>.<index>') are looked up as the job
+    that ran them, so all jobs in a pack report the usage of the pack
+    (`genomegenie.batch.jobs.Pipeline.usage` shares it between them).
+    Jobs that cannot be found (e.g. the accounting is not written yet) have
+    missing values.
+
+    jobids   -- iterable of job ids
+    command  -- accounting command, the job id is appended to it
+    nthreads -- number of concurrent accounting commands
+
+    Returns a `pandas.DataFrame` with the columns: jobid, maxvmem, wallclock,
+    cpu, and slots
+
+    """
+    import pandas as pd
+
+    jobids = [str(i) for i in jobids]
+
+    def _usage(jobid):
+        proc = subprocess.run(
+            shlex.split(command) + [jobid],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if proc.returncode != 0:
+            logger.warning(f"No accounting for job {jobid}: {proc.stderr.decode()}")
+            return {}
+        return parse_qacct(proc.stdout.decode()).get(jobid, {})
+
+    unique = sorted(set(i.split(".")[0] for i in jobids))
+    with ThreadPoolExecutor(nthreads) as pool:
+        found = dict(zip(unique, pool.map(_usage, unique)))
+    rows = [dict(found[i.split(".")[0]], jobid=i) for i in jobids]
+    return pd.DataFrame(rows, columns=["jobid"] + columns + ["slots"])
+
+
+def _walltime(seconds):
+    seconds = int(math.ceil(seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def recommend(df, quantile=0.95, headroom=1.2, min_memory=1e8, min_walltime=600):
+    """Propose resource requests per task, from the observed resource usage
+
+    The requests cover the `quantile` of the jobs of a task, with some
+    `headroom`.  The number of cores is the effective parallelism of the job
+    (cpu time / wallclock time).
+
+    df           -- resource usage with the columns: task, maxvmem, wallclock,
+                    and cpu (see `Pipeline.usage`)
+    quantile     -- fraction of jobs that should fit in the requests
+    headroom     -- factor to scale the requests with
+    min_memory   -- minimum memory request in bytes
+    min_walltime -- minimum walltime request in seconds
+
+    Returns a `pandas.DataFrame` indexed by task, with the columns: njobs,
+    memory, walltime (in the format of the backend options), and nprocs
+
+    """
+    import pandas as pd
+
+    df = df.dropna(subset=columns)
+    df = df.assign(cores=df.cpu / df.wallclock.where(df.wallclock > 0))
+    grouped = df.groupby("task")
+    stats = grouped[["maxvmem", "wallclock", "cores"]].quantile(quantile)
+    memory = (stats.maxvmem * headroom).clip(lower=min_memory)
+    walltime = (stats.wallclock * headroom).clip(lower=min_walltime)
+    return pd.DataFrame(
+        {
+            "njobs": grouped.size(),
+            # round up to 0.1 GB
+            "memory": [f"{math.ceil(i / 1e8) / 10:.1f} GB" for i in memory],
+            "walltime": [_walltime(i) for i in walltime],
+            "nprocs": [
+                1 if pd.isna(i) else max(1, int(math.ceil(i))) for i in stats.cores
+            ],
+        },
+        index=stats.index,
+    )
+
+
+def as_options(recommended, backend="sge"):
+    """Convert resource recommendations to task options
+
+    The memory and walltime requests are set as task specific backend
+    options, which override the global backend options of the pipeline.
+
+    >>> import pandas as pd
+    >>> df = pd.DataFrame(
+    ...     {"memory": ["2.5 GB"], "walltime": ["01:00:00"], "nprocs": [2]},
+    ...     index=pd.Index(["gatk"], name="task"),
+    ... )
+    >>> as_options(df)
+    {'gatk': {'nprocs': 2, 'sge': {'memory': '2.5 GB', 'walltime': '01:00:00'}}}
+
+    """
+    return dict(
+        (
+            task,
+            {
+                "nprocs": int(row.nprocs),
+                backend: {"memory": row.memory, "walltime": row.walltime},
+            },
+        )
+        for task, row in recommended.iterrows()
+    )
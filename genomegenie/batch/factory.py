@@ -7,11 +7,13 @@
 """
 
 import logging
+from functools import lru_cache
 from pathlib import Path
 from importlib import import_module
 
 from jinja2 import (
     meta,
+    nodes,
     FileSystemLoader,
     Environment,
     TemplateError,
@@ -29,10 +31,13 @@ def template_dir():
     return str(Path(__file__).parent / "templates")
 
 
-def compile_template(template, tmpl_dirs, debug=False, **options):
-    """Generate command string from Jinja2 template and options"""
-    loader = FileSystemLoader(searchpath=tmpl_dirs)
+def _environment(template, debug=False, **kwargs):
+    """Create a Jinja2 environment with the custom filters
+
+    `template` is only used to name the logger when `debug` is `True`; any
+    other keyword arguments are passed on to `jinja2.Environment`.
 
+    """
     if debug == False:
         undefined_t = Undefined
     elif debug == True or not issubclass(debug, Undefined):
@@ -47,7 +52,7 @@ def compile_template(template, tmpl_dirs, debug=False, **options):
         undefined_t = debug
 
     env = Environment(
-        loader=loader, trim_blocks=True, lstrip_blocks=True, undefined=undefined_t
+        trim_blocks=True, lstrip_blocks=True, undefined=undefined_t, **kwargs
     )
 
     # add custom filters to env
@@ -55,6 +60,24 @@ def compile_template(template, tmpl_dirs, debug=False, **options):
     env.filters.update(
         (k, getattr(filters, k)) for k in dir(filters) if not k.startswith("_")
     )
+    return env
+
+
+@lru_cache(maxsize=64)
+def _file_environment(template, tmpl_dirs, debug):
+    # NOTE: environments are reused, so that compiled templates are cached
+    # (the cache is invalidated when a template file changes)
+    return _environment(template, debug, loader=FileSystemLoader(tmpl_dirs))
+
+
+def compile_template(template, tmpl_dirs, debug=False, **options):
+    """Generate command string from Jinja2 template and options"""
+    if isinstance(tmpl_dirs, (list, tuple)):  # hashable, for the cache
+        tmpl_dirs = tuple(str(i) for i in tmpl_dirs)
+    else:
+        tmpl_dirs = str(tmpl_dirs)
+    # with logging undefined, the logger is named after the template
+    env = _file_environment(template if debug == True else None, tmpl_dirs, debug)
 
     try:
         template = env.get_template(template)
@@ -65,18 +88,126 @@ def compile_template(template, tmpl_dirs, debug=False, **options):
     return ""
 
 
+@lru_cache(maxsize=None)
+def _string_environment(debug):
+    return _environment("<string>", debug)
+
+
+@lru_cache(maxsize=256)
+def _string_template(template_str, debug):
+    # NOTE: strings are often rendered repeatedly, e.g. the same output path
+    # template for every sample, so compiled templates are reused
+    return _string_environment(debug).from_string(template_str)
+
+
+def render_string(template_str, debug=False, **options):
+    """Render a template string with options, custom filters are available
+
+    >>> render_string("{{ bam | bam2vcf }}", bam="/path/to/sample.bam")
+    '/path/to/sample.vcf'
+
+    """
+    if "{" not in template_str:  # nothing to render, skip the overhead
+        return template_str
+    try:
+        return _string_template(template_str, debug).render(options)
+    except TemplateError:
+        logger.error(f"Failed to render '{template_str}'", exc_info=True)
+
+    return ""
+
+
 def template_vars(template):
     """Find the variables in a template"""
-    with open("/".join([template_dir(), template]), "r") as template:
-        return template_vars_impl(template.read())
+    return set(template_index().variables(template))
 
 
-def template_vars_impl(template_str):
+@lru_cache(maxsize=None)
+def _filter_names():
+    filters = import_module(".filters", "genomegenie.batch")
+    return frozenset(k for k in dir(filters) if not k.startswith("_"))
+
+
+def _parse(template_str):
     # see: https://stackoverflow.com/a/8284419/289784
-    env = Environment(trim_blocks=True, lstrip_blocks=True)
-    tmpl_ast = env.parse(template_str)
-    options = meta.find_undeclared_variables(tmpl_ast)
+    # NOTE: custom filters are needed, newer Jinja2 versions compile the AST
+    return _environment("<introspection>").parse(template_str)
 
-    filters = import_module(".filters", "genomegenie.batch")
-    consume(map(options.discard, [k for k in dir(filters) if not k.startswith("_")]))
+
+def template_vars_impl(template_str):
+    options = meta.find_undeclared_variables(_parse(template_str))
+    consume(map(options.discard, _filter_names()))
     return options
+
+
+def optional_vars_impl(template_str):
+    """Find variables that are tested with `is defined` or `is undefined`"""
+    return set(
+        test.node.name
+        for test in _parse(template_str).find_all(nodes.Test)
+        if test.name in ("defined", "undefined") and isinstance(test.node, nodes.Name)
+    )
+
+
+class TemplateIndex(object):
+    """Index of template variables
+
+    The variables of a template are found by parsing the template once, and
+    cached until the template file is modified.  Variables that are tested
+    with `is defined`/`is undefined` in a template are considered optional,
+    the rest are mandatory.
+
+    tmpl_dir -- template directory
+
+    >>> index = TemplateIndex(template_dir())
+    >>> sorted(index.mandatory("freebayes"))
+    ['normal_bam', 'output', 'ref_fasta']
+    >>> sorted(index.common(["gatk", "muse"]))
+    ['db', 'exome_bed', 'normal_bam', 'output', 'ref_fasta', 'tumor_bam']
+
+    """
+
+    def __init__(self, tmpl_dir):
+        self.tmpl_dir = Path(tmpl_dir)
+        self._cache = {}  # template -> (mtime, variables, optional variables)
+
+    def _entry(self, template):
+        path = self.tmpl_dir / template
+        mtime = path.stat().st_mtime_ns
+        entry = self._cache.get(template)
+        if entry is None or entry[0] != mtime:
+            template_str = path.read_text()
+            entry = (
+                mtime,
+                frozenset(template_vars_impl(template_str)),
+                frozenset(optional_vars_impl(template_str)),
+            )
+            self._cache[template] = entry
+        return entry
+
+    def variables(self, template):
+        """All undeclared variables in a template"""
+        return self._entry(template)[1]
+
+    def optional(self, template):
+        """Optional variables in a template"""
+        return self._entry(template)[2]
+
+    def mandatory(self, template):
+        """Mandatory variables in a template"""
+        _, variables, optional = self._entry(template)
+        return variables - optional
+
+    def common(self, templates):
+        """Variables common to all templates"""
+        return frozenset.intersection(*[self.variables(i) for i in templates])
+
+
+@lru_cache(maxsize=None)
+def template_index(tmpl_dir=None):
+    """Return the (shared) template index for a template directory
+
+    tmpl_dir -- template directory (default: `template_dir()`)
+
+    """
+    return TemplateIndex(tmpl_dir if tmpl_dir is not None else template_dir())
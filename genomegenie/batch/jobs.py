@@ -7,47 +7,187 @@
 """
 
 
+import hashlib
+import json
 import logging
+import queue
+import random
 import shlex
 import subprocess
 import time
 import re
-import numpy as np
-import pandas as pd
+from ast import literal_eval
 from uuid import uuid4
+from collections import namedtuple
 from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 from contextlib import contextmanager
 from functools import reduce
+from pathlib import Path
 from textwrap import dedent
-import pdb
 
+# NOTE: pandas, pyarrow, glom, and distributed are imported where they are
+# used, so that rendering job scripts does not load them
 import dask
-from distributed.utils import parse_bytes, tmpfile
-from glom import glom, Coalesce
+from dask.utils import parse_bytes, tmpfile
 
-from genomegenie.utils import add_class_property
-from genomegenie.batch.factory import compile_template, template_dir
+from genomegenie.utils import (
+    add_class_property,
+    contents,
+    fingerprint,
+    flatten,
+    freeze,
+    job_status,
+    records,
+    thaw,
+)
+from genomegenie.batch.factory import compile_template, render_string, template_dir
+from genomegenie.batch.state import up_to_date
+from genomegenie.batch.local import executor
+from genomegenie.batch.throttle import SubmitGovernor
+from genomegenie.batch import accounting
 
 logger = logging.getLogger(__name__)
 
 
+JobEvent = namedtuple("JobEvent", ["status", "task", "name", "jobid", "time"])
+JobEvent.__doc__ = """Job status change
+
+status -- one of `Pipeline.events`
+task   -- task (template) name
+name   -- job name
+jobid  -- batch job id (`None` for skipped jobs)
+time   -- time of the event (seconds since epoch)
+"""
+
+
+def _sinks(graph):
+    """Tasks in a pipeline graph that finish last"""
+    if isinstance(graph, str):
+        return [graph]
+    elif isinstance(graph, tuple):
+        return [task for el in graph for task in _sinks(el)]
+    elif isinstance(graph, list):
+        return _sinks(graph[-1])
+    else:
+        raise TypeError(
+            f"Unknown type in pipeline: {type(graph)}\n"
+            "Allowed types: 'str', 'tuple', or 'list'"
+        )
+
+
+def _order(deps):
+    """Tasks in topological order
+
+    deps -- mapping of tasks, and the tasks they wait for (see
+            `dependencies`)
+
+    Raises `ValueError` if the dependencies have a cycle (e.g. a task that
+    waits for itself).
+
+    """
+    order, done = [], set()
+    while len(order) < len(deps):
+        ready = [
+            task
+            for task, upstream in deps.items()
+            if task not in done and done.issuperset(upstream)
+        ]
+        if not ready:
+            left = sorted(set(deps) - done)
+            raise ValueError(f"Circular dependency between the tasks: {left}")
+        order.extend(ready)
+        done.update(ready)
+    return order
+
+
+def dependencies(graph, upstream=()):
+    """Find the tasks each task in a pipeline graph waits for
+
+    Only direct dependencies are returned, i.e. the tasks that finish last
+    in the preceding element of a sequence.  A task that occurs more than
+    once waits for the tasks of all its occurrences (but not for itself).
+
+    >>> deps = dependencies([("foo", ["bar", "baz"]), "whaat"])
+    >>> deps == {"foo": [], "bar": [], "baz": ["bar"], "whaat": ["foo", "baz"]}
+    True
+    >>> dependencies([("foo", ["bar", "foo"]), "foo"])
+    {'foo': ['bar'], 'bar': []}
+
+    """
+    if isinstance(graph, str):
+        return {graph: [i for i in upstream if i != graph]}
+    deps = {}
+
+    def _merge(el, upstream):
+        for task, tasks in dependencies(el, upstream).items():
+            merged = deps.setdefault(task, [])
+            merged.extend(i for i in tasks if i not in merged)
+
+    if isinstance(graph, tuple):
+        for el in graph:
+            _merge(el, upstream)
+    elif isinstance(graph, list):
+        for el in graph:
+            _merge(el, upstream)
+            upstream = _sinks(el)
+    else:
+        raise TypeError(
+            f"Unknown type in pipeline: {type(graph)}\n"
+            "Allowed types: 'str', 'tuple', or 'list'"
+        )
+    return deps
+
+
 class Pipeline(object):
     """Data processing pipeline
 
     pipeline graph: [1, [2.1, 2.2], 3, [4.1, [4.2, 5.1]], 6, 7]
 
+    options        -- pipeline options, the options for the backend are
+                      under the key of the same name
+    backend        -- batch system template; "local" runs the jobs on the
+                      current machine in a resource aware pool, this needs a
+                      threaded scheduler (e.g. `LocalCluster(processes=False)`)
+                      so that all jobs share one pool
+    submit_command -- batch job submission command
+
+    Job submissions are throttled if the options include a "throttle"
+    dictionary, with the keyword arguments for `SubmitGovernor`; e.g. to
+    keep at most 500 jobs in the queue, and submit at most 2 jobs a second:
+    `{"throttle": {"max_jobs": 500, "rate": 2}}`.
+
+    The options are frozen (see `genomegenie.utils.freeze`), so they cannot
+    be modified in place; assign a modified copy instead, e.g.:
+    `pipeline.options = pipeline.options.override(module=["foo"])`.
+
     """
 
     job_id_regexp = r"(?P<job_id>\d+)"
 
+    # "unknown": job left the queue, but its status could not be determined
+    events = ("skipped", "submitted", "running", "finished", "failed", "unknown")
+
     def __init__(self, options, backend="sge", submit_command="qsub -terse"):
-        self.graph = options["pipeline"]
-        self.inputs = options["inputs"]
-        self.options = options
+        self.options = options  # frozen, so not copied (see `freeze`)
+        self.graph = self.options["pipeline"]
+        self.inputs = self.options["inputs"]
         self.tmpl_dir = template_dir()
         self.backend = backend
         self.submit_command = submit_command
         self.debug = False
+        self.store = None  # optional JobStore, to skip finished jobs
+        self.script_dir = None  # optional directory to keep job scripts
+        self.topic = f"pipeline-{uuid4()}"  # job events are published here
+        self.t_staged = None  # start of staging (see `Pipeline.prepare`)
+        self.metrics = {}
+        self.plan = None  # jobs by task, from a compiled plan
+        throttle = options.get("throttle", None)
+        self.governor = SubmitGovernor(**throttle) if throttle else None
+
+    def __getstate__(self):
+        # jobs are created while staging, workers do not need the plan
+        return dict(self.__dict__, plan=None)
 
     def __repr__(self):
         res = f"""
@@ -112,7 +252,16 @@ class Pipeline(object):
         return (out, err)
 
     @classmethod
-    def stage(self, graph, process=None, submit=None, monitor_t=600, *args):
+    def stage(
+        self,
+        graph,
+        process=None,
+        submit=None,
+        monitor_t=600,
+        *args,
+        seen=None,
+        staged=None,
+    ):
         """Walk a pipeline graph and stage tasks.
 
         `graph` is the pipeline graph.
@@ -120,75 +269,90 @@ class Pipeline(object):
         `process` is a `Callable` used to generate the batch job templates
         (list of `BatchJob` instances) by applying on a graph element.  The
         generated job templates are then fed to the `Callable` `submit` which
-        is wrapped by `dask.delayed`.  `args` are extra positional arguments
-        that are passed on to submit.  Typically these are dummies used to
-        enforce job dependencies; although nothing prevents a custom submit
-        function to make use of these in other ways.
+        is wrapped by `dask.delayed`.  Besides the job, submit receives the
+        delayed submissions of the upstream tasks (see `dependencies`), to
+        enforce job dependencies, and `args`, extra positional arguments;
+        nothing prevents a custom submit function to make use of these in
+        other ways.
 
         The batch jobs are monitored every `monitor_t` seconds; passing 0 turns
         the monitoring off.  This is useful during testing, or when you know
         your pipeline is embarrassingly parallel (no dependent jobs).
 
         In the absence of `process` and `submit`, `Pipeline.process` and
-        `Pipeline.submit` are used.
+        `Pipeline.submit` are used.  When a job state store is set on the
+        pipeline (`Pipeline.store`), `Pipeline.submit` consults it, and skips
+        jobs that finished successfully in an earlier run; so resubmitting a
+        pipeline only reruns failed or missing jobs.  Jobs with up to date
+        outputs are also skipped (see `genomegenie.batch.state.up_to_date`).
+
+        Every task is staged once, after its upstream tasks; a task that
+        occurs more than once waits for the upstream tasks of every
+        occurrence.  A circular dependency raises a `ValueError`.  Identical
+        jobs (same `BatchJob.digest`) are submitted only once per pipeline:
+        later occurrences reuse the delayed submission of the first, so all
+        dependents wait on the same batch job.  `seen` maps job digests to
+        delayed submissions, and `staged` maps tasks to their delayed
+        submissions; they are shared across the recursive calls.
 
         """
 
         process = process if process is not None else self.process
         submit = submit if submit is not None else self.submit
+        seen = seen if seen is not None else {}
+
+        def _submit(job, *args):
+            key = getattr(job, "digest", None)
+            if key is None:  # custom process, not a BatchJob
+                return submit(job, monitor_t, *args)
+            if key not in seen:
+                seen[key] = submit(job, monitor_t, *args)
+            else:
+                logger.debug(f"{job._template}: duplicate job {key[:12]}, reused")
+            return seen[key]
+
+        if staged is None:  # top of the graph
+            deps = dependencies(graph)
+            staged = {}
+            for task in _order(deps):
+                upstream = [staged[i] for i in deps[task]]
+                staged[task] = [_submit(job, *upstream, *args) for job in process(task)]
 
         ## NOTE: remarks for the developer
-        # stage(..) implements a recursive algorithm to walk the pipeline
-        # graph.  The delayed job submission logic resides in the first
-        # if-block, which is activated when the graph is a tuple.  Essentially
-        # all elements are reduced to a tuple recursively, before this block
-        # creates and submits the job.  It is easy to understand once you
-        # realise an single entry (a string), is a 1-tuple (e.g. `("ajob",)`).
-        # So the recursive logic simply splits by, list, tuple, or string,
-        # until a graph element can be represented as a tuple of strings,
-        # before creating a delayed job submission function and returning it.
+        # The job submissions are created above, a task at a time in
+        # topological order, so every job waits for all its upstream tasks,
+        # wherever they occur in the graph.  stage(..) then walks the
+        # pipeline graph recursively, only to arrange the submissions in the
+        # nested layout of the graph (the layout of the results): a tuple
+        # holds the jobs of its tasks, a list holds its elements, and a
+        # single entry (a string) in a list is a 1-tuple (e.g. `("ajob",)`).
 
         # set of parallel tasks:
         # e.g.: ("foo", "bar", "baz"), ("foo", "bar", ["baz1", "baz2"])
         if isinstance(graph, tuple):
-            # tasks = [
-            #     [submit(job, monitor_t, *args) for job in process(task)]
-            #     if isinstance(task, str)
-            #     else self.stage(task, process, submit, monitor_t, *args)
-            #     for task in graph
-            # ]
-            tasks = []
-            for task in graph:
-                jobs = (
-                    [submit(job, monitor_t, *args) for job in process(task)]
-                    if isinstance(task, str)
-                    else self.stage(task, process, submit, monitor_t, *args)
+            tasks = [
+                staged[task]
+                if isinstance(task, str)
+                else self.stage(
+                    task, process, submit, monitor_t, seen=seen, staged=staged
                 )
-                tasks.append(jobs)
+                for task in graph
+            ]
             return dask.delayed(tasks, nout=len(graph))
         # set of sequential tasks: may include nested set of parallel tasks
         # e.g.: ["foo1", "foo2", "foo3"], ["foo", ("bar1", "bar2"), "baz"]
         elif isinstance(graph, list):
             tasks = [
                 self.stage(
-                    (graph[0],) if isinstance(graph[0], str) else graph[0],
+                    (task,) if isinstance(task, str) else task,
                     process,
                     submit,
                     monitor_t,
-                    *args,
+                    seen=seen,
+                    staged=staged,
                 )
+                for task in graph
             ]
-            for task in graph[1:]:
-                tasks.append(
-                    self.stage(
-                        (task,) if isinstance(task, str) else task,
-                        process,
-                        submit,
-                        monitor_t,
-                        tasks[-1],
-                        *args,
-                    )
-                )
             return dask.delayed(tasks)
         else:
             raise TypeError(
@@ -198,40 +362,311 @@ class Pipeline(object):
 
     def process(self, task):
         """Return list of jobs"""
+        if self.plan is not None:
+            return self.plan.get(task, [])
+        opts = self._task_opts(task)
+        jobs = [
+            BatchJob(task, self._job_opts(infile, opts), self.tmpl_dir, self.backend)
+            for infile in self._job_inputs(opts)
+        ]
+        return self._pack(jobs, opts)
+
+    def _task_opts(self, task):
         # NOTE: use dictionary unpacking to optionally overwrite global modules
         # with task specific modules
-        opts = {
+        return {
             "module": self.options["module"],
             **self.options[task],
-            self.backend: self.options[self.backend],
+            # task specific backend options, e.g. resource requests
+            self.backend: {
+                **self.options[self.backend],
+                **self.options[task].get(self.backend, {}),
+            },
         }
+
+    def _job_inputs(self, opts):
+        """Return the input files for each job of a task (`None`: no inputs)"""
         if opts.get("inputs", None) == "ignore":
-            jobs = [BatchJob(task, opts, self.tmpl_dir, self.backend)]
+            return [None]
         elif opts.get("inputs", None) == "all":  # e.g. panel of normal
             keys = reduce(
                 lambda i, j: i.union(set(j)), [i.keys() for i in self.inputs], set()
             )
+            from glom import glom, Coalesce
+
             inputs = glom(
                 self.inputs, dict((key, [Coalesce(key, default="")]) for key in keys)
             )
             for key in keys:  # filter out "no files" (shows as empty string above)
                 inputs[key] = [i for i in filter(None, inputs[key])]
-            jobs = [BatchJob(task, dict(**inputs, **opts), self.tmpl_dir, self.backend)]
+            return [inputs]
         else:
-            inputs = opts.get("inputs", self.inputs)  # allow overriding inputs per job
-            jobs = [
-                BatchJob(task, dict(**infile, **opts), self.tmpl_dir, self.backend)
-                for infile in inputs
+            return opts.get("inputs", self.inputs)  # allow overriding inputs per job
+
+    @staticmethod
+    def _job_opts(infile, opts):
+        """Merge input files with task options
+
+        Unless the task options declare the job inputs (`sources`), the input
+        files are used.
+
+        """
+        if infile is None:
+            return opts
+        return {"sources": [i for i in flatten(infile.values())], **infile, **opts}
+
+    def _pack(self, jobs, opts):
+        """Bundle jobs if requested by the task options (see `PackedJob`)"""
+        pack = opts.get("pack", None)
+        if not pack:
+            return jobs
+        return [
+            PackedJob(jobs[i : i + pack], opts, self.tmpl_dir, self.backend)
+            for i in range(0, len(jobs), pack)
+        ]
+
+    def job_table(self, graph=None):
+        """Flatten a pipeline graph into a table of jobs
+
+        This is the first step of staging a pipeline in bulk (see
+        `Pipeline.prepare`); no job script is rendered.
+
+        graph -- pipeline graph (default: `Pipeline.graph`)
+
+        Returns a `pandas.DataFrame` with a row per job, and the columns:
+        task, job (index of the job in the task), inputs (input files of the
+        job), and depends (tasks the job waits for).
+
+        """
+        graph = graph if graph is not None else self.graph
+        rows = [
+            (task, i, infile, upstream)
+            for task, upstream in dependencies(graph).items()
+            for i, infile in enumerate(self._job_inputs(self._task_opts(task)))
+        ]
+        import pandas as pd
+
+        return pd.DataFrame(rows, columns=["task", "job", "inputs", "depends"])
+
+    def render(self, table, nworkers=None, processes=False):
+        """Render the job scripts of a job table in bulk
+
+        table     -- job table (see `Pipeline.job_table`)
+        nworkers  -- number of concurrent workers
+        processes -- use a process pool instead of a thread pool
+
+        Returns a dictionary of task names, and the list of jobs
+
+        """
+        pool_t = ProcessPoolExecutor if processes else ThreadPoolExecutor
+        opts = dict((task, self._task_opts(task)) for task in table.task.unique())
+        jobopts = [
+            self._job_opts(infile, opts[task])
+            for task, infile in zip(table.task, table.inputs)
+        ]
+        with pool_t(nworkers) as pool:
+            rendered = pool.map(
+                BatchJob,
+                table.task,
+                jobopts,
+                [self.tmpl_dir] * len(table),
+                [self.backend] * len(table),
+            )
+            jobs = dict((task, []) for task in opts)
+            for task, job in zip(table.task, rendered):
+                jobs[task].append(job)
+        return dict((task, self._pack(jobs[task], opts[task])) for task in jobs)
+
+    def prepare(self, graph=None, monitor_t=600, nworkers=None, processes=False):
+        """Stage a pipeline in bulk: all job scripts are rendered upfront
+
+        Unlike `Pipeline.stage`, which renders job scripts one task at a time
+        while walking the pipeline graph, the graph is first flattened into a
+        job table (`Pipeline.job_table`), then all job scripts are rendered
+        concurrently (`Pipeline.render`), and finally the graph is staged.
+
+        graph     -- pipeline graph (default: `Pipeline.graph`)
+        monitor_t -- job monitoring interval (see `Pipeline.stage`)
+        nworkers  -- number of concurrent workers to render job scripts
+        processes -- use a process pool to render job scripts
+
+        When the pipeline is loaded from a compiled plan (see
+        `Pipeline.from_plan`), the jobs from the plan are staged directly.
+
+        Returns the staged pipeline; the time taken for each step is noted
+        in `Pipeline.metrics`.
+
+        """
+        graph = graph if graph is not None else self.graph
+        self.t_staged = time.time()
+        if self.plan is None:
+            table = self.job_table(graph)
+            t_table = time.time()
+            jobs = self.render(table, nworkers, processes)
+            njobs = len(table)
+        else:  # compiled plan, nothing to render
+            t_table = time.time()
+            jobs = self.plan
+            njobs = sum(
+                len(job.jobs) if isinstance(job, PackedJob) else 1
+                for task in jobs.values()
+                for job in task
+            )
+        t_render = time.time()
+        staged = self.stage(graph, jobs.__getitem__, self.submit, monitor_t)
+        t_end = time.time()
+        self.metrics.update(
+            njobs=njobs,
+            job_table=t_table - self.t_staged,
+            render=t_render - t_table,
+            stage=t_end - t_render,
+        )
+        logger.info(
+            "Staged %d jobs in %.2fs (rendering: %.2fs)",
+            njobs,
+            t_end - self.t_staged,
+            t_render - t_table,
+        )
+        return staged
+
+    def time_to_first_submit(self, res):
+        """Time in seconds from `Pipeline.prepare` to the first job submission
+
+        res -- results of the pipeline
+
+        """
+        submitted = [i["submitted"] for i in records(res) if i.get("submitted")]
+        if self.t_staged is None or not submitted:
+            return None
+        self.metrics["time_to_first_submit"] = min(submitted) - self.t_staged
+        return self.metrics["time_to_first_submit"]
+
+    def compile(self, path, graph=None, nworkers=None):
+        """Resolve the pipeline into a job plan, and write it to a Parquet file
+
+        The options are resolved, and the job scripts are rendered once; the
+        plan has a row per job, with its script, resource requests, inputs
+        and outputs, and the tasks it depends on.  Jobs bundled in a packed
+        job (see `PackedJob`) share the pack columns.  The pipeline graph, the
+        backend, and the backend options are kept in the file metadata.  Use
+        `Pipeline.from_plan` to load the plan.
+
+        path     -- output file
+        graph    -- pipeline graph (default: `Pipeline.graph`)
+        nworkers -- number of concurrent workers to render job scripts
+
+        """
+        graph = graph if graph is not None else self.graph
+        jobs = self.render(self.job_table(graph), nworkers)
+        rows = []
+        for task, upstream in dependencies(graph).items():
+            for pack, job in enumerate(jobs.get(task, [])):
+                if isinstance(job, PackedJob):
+                    packed = dict(
+                        (f"pack_{key}", val) for key, val in job.record().items()
+                    )
+                    rows.extend(
+                        dict(i.record(), depends=upstream, pack=pack, **packed)
+                        for i in job.jobs
+                    )
+                else:
+                    rows.append(dict(job.record(), depends=upstream))
+        columns = (
+            list(BatchJob._record_fields)
+            + ["depends", "pack"]
+            + [f"pack_{key}" for key in PackedJob._record_fields]
+        )
+        import pandas as pd
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        table = pa.Table.from_pandas(
+            pd.DataFrame(rows, columns=columns), preserve_index=False
+        )
+        options = dict(
+            (key, thaw(self.options[key]))
+            for key in (self.backend, "throttle")
+            if key in self.options
+        )
+        meta = {
+            "pipeline": repr(graph),
+            "backend": self.backend,
+            "options": options,
+        }
+        metadata = dict(table.schema.metadata or {})
+        metadata[b"genomegenie.plan"] = json.dumps(meta).encode()
+        pq.write_table(table.replace_schema_metadata(metadata), path)
+        logger.info("Compiled %d jobs into %s", len(rows), path)
+
+    @classmethod
+    def from_plan(cls, path, submit_command="qsub -terse"):
+        """Load a pipeline from a compiled plan (see `Pipeline.compile`)
+
+        No options are resolved, and no job script is rendered; the jobs are
+        recreated from the plan as is.
+
+        path           -- compiled plan
+        submit_command -- batch job submission command
+
+        """
+        import pandas as pd
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(path)
+        meta = json.loads(table.schema.metadata[b"genomegenie.plan"])
+        graph = literal_eval(meta["pipeline"])
+        options = dict(meta["options"], pipeline=graph, inputs=[])
+        pipeline = cls(options, meta["backend"], submit_command)
+
+        plan = dict((task, []) for task in dependencies(graph))
+        packs = {}
+        for rec in table.to_pandas().to_dict("records"):
+            job = BatchJob.from_record(rec)
+            if pd.isna(rec["pack"]):
+                plan[job._template].append(job)
+                continue
+            key = (job._template, rec["pack"])
+            if key not in packs:
+                packs[key] = (
+                    dict((k[5:], v) for k, v in rec.items() if k.startswith("pack_")),
+                    [],
+                )
+                plan[job._template].append(key)
+            packs[key][1].append(job)
+        for task, jobs in plan.items():
+            plan[task] = [
+                PackedJob.from_record(packs[i][0], packs[i][1])
+                if isinstance(i, tuple)
+                else i
+                for i in jobs
             ]
-        return jobs
+        pipeline.plan = plan
+        return pipeline
 
     @contextmanager
     def job_file(self, script):
         """ Write job submission script to a temporary file
 
+        If `Pipeline.script_dir` is set, the script is kept in that directory
+        instead, named by the hash of its contents: '<sha256>.sh'.  So an
+        identical script is written only once, and is reused across runs.
+
         script -- script contents
 
         """
+        if self.script_dir is not None:
+            digest = hashlib.sha256(script.encode()).hexdigest()
+            fn = Path(self.script_dir) / f"{digest}.sh"
+            if not fn.exists():
+                fn.parent.mkdir(parents=True, exist_ok=True)
+                # write & rename, so that a concurrent reader never sees a
+                # partial script
+                tmp = fn.with_suffix(f".{uuid4().hex}.tmp")
+                tmp.write_text(script)
+                tmp.replace(fn)
+                logger.debug(f"writing job script: {fn}\n{script}")
+            yield str(fn)
+            return
         with tmpfile(extension="sh") as fn:
             with open(fn, "w") as f:
                 logger.debug(f"writing job script: {fn}\n{script}")
@@ -240,7 +675,15 @@ class Pipeline(object):
 
     @dask.delayed
     def submit(self, job, monitor_t, *args):
-        """Submit and wait"""
+        """Submit and wait
+
+        A packed job (`PackedJob`) returns a list of results, one per job.
+
+        """
+        res = self._submit(job, monitor_t)
+        return job.unpack(res) if isinstance(job, PackedJob) else res
+
+    def _submit(self, job, monitor_t):
         notify = "Starting job %s of type: %s"
         logmsg = """
         jobid: {jobid}
@@ -254,28 +697,265 @@ class Pipeline(object):
         script:
         {script}
         """
-        res = dict(script=job.script)
+        res = dict(
+            task=job._template,
+            name=job.name,
+            script=job.script,
+            submitted=None,
+            started=None,
+            ended=None,
+            status=None,
+        )
+
+        if not self.debug and self._finished_before(job):
+            res.update(out="", err="", jobid=self._previous_jobid(job))
+            logger.info(
+                "Skipping job %s of type: %s, finished previously",
+                res["jobid"],
+                job._template,
+            )
+            self._emit("skipped", job, res)
+            return res
+
+        if not self.debug and self._up_to_date(job):
+            res.update(out="", err="", jobid=None)
+            logger.info("Skipping job of type: %s, outputs up to date", job._template)
+            self._emit("skipped", job, res)
+            return res
 
         if self.debug:
             res.update(out="", err="", jobid=0)
-            time.sleep(3 * np.random.rand())
+            self._emit("submitted", job, res)
+            self._emit("running", job, res)
+            time.sleep(3 * random.random())
             logger.info(notify, res['jobid'], job._template)
             logger.debug(dedent(logmsg).format(**res))
+            self._emit("finished", job, res)
             return res
 
+        if self.backend == "local":
+            return self._run_local(job, res)
+
         with self.job_file(job.script) as fn:
-            res["out"], res["err"] = self._call(shlex.split(self.submit_command) + [fn])
+            cmd = shlex.split(self.submit_command) + [fn]
+            if self.governor is None:
+                res["out"], res["err"] = self._call(cmd)
+            else:
+                res["out"], res["err"] = self.governor.submit(lambda: self._call(cmd))
             res["jobid"] = self._job_id_from_submit_output(res["out"])
             logger.info(notify, res['jobid'], job._template)
             logger.debug(dedent(logmsg).format(**res))
+            self._record(job, res["jobid"], "submitted")
+            self._emit("submitted", job, res)
             err = False
             while monitor_t and not err:  # not err => running
                 out, err = self._call(
                     shlex.split(f"qstat -j {res['jobid']}"), raise_on_err=False
                 )
+                # usage is reported only once a job starts running
+                if res["started"] is None and "usage" in out:
+                    self._emit("running", job, res)
                 time.sleep(monitor_t)
+            if monitor_t:
+                status = self._job_status(job, res["jobid"])
+                self._record(job, res["jobid"], status)
+                self._emit(status or "unknown", job, res)
+        return res
+
+    def _run_local(self, job, res):
+        """Run a job on the local machine, and wait for it to finish"""
+
+        def _start(jobid):
+            res["jobid"] = jobid
+            logger.info("Starting job %s of type: %s", jobid, job._template)
+            self._record(job, jobid, "submitted")
+            self._emit("running", job, res)
+
+        res.update(out="", err="", jobid=None)
+        with self.job_file(job.script) as fn:
+            self._emit("submitted", job, res)
+            executor().run(
+                fn,
+                job.name,
+                job.log_directory,
+                job.nprocs,
+                job.memory,
+                on_start=_start,
+                on_exit=res.update,
+            )
+        status = self._job_status(job, res["jobid"])
+        self._record(job, res["jobid"], status)
+        self._emit(status or "unknown", job, res)
         return res
 
+    def usage(self, res, command="qacct -j"):
+        """Resources used by the jobs of a finished pipeline
+
+        On the local backend, the usage is noted when a job exits; otherwise
+        it is read from the scheduler accounting with `command` (see
+        `genomegenie.batch.accounting.usage`).  Only jobs that ran to the end
+        are included (a final status, see `Pipeline.events`), also the ones
+        that finished before monitoring noticed they started; skipped jobs
+        are excluded.
+
+        The usage of a packed job (see `PackedJob`) is shared by its jobs:
+        the memory by the jobs that run at the same time, the cpu time by
+        all its jobs, and the wall time as if the jobs took turns evenly.
+
+        res     -- results of the pipeline
+        command -- accounting command
+
+        Returns a `pandas.DataFrame` with the columns: task, jobid, maxvmem
+        (bytes), wallclock and cpu (seconds); use
+        `genomegenie.batch.accounting.recommend` to propose resource requests.
+
+        """
+        import pandas as pd
+
+        cols = ["task", "jobid"] + accounting.columns
+        final = ("finished", "failed", "unknown")
+        found = [
+            i
+            for i in records(res)
+            if i.get("jobid", None) is not None and i.get("status", None) in final
+        ]
+        df = pd.DataFrame(
+            [dict((key, i.get(key, None)) for key in cols) for i in found],
+            columns=cols,
+        )
+        if not (self.debug or self.backend == "local"):
+            used = accounting.usage(df.jobid, command)
+            df = pd.concat([df[["task", "jobid"]], used[accounting.columns]], axis=1)
+        npacked = pd.Series([i.get("npacked", 1) for i in found], dtype=float)
+        concurrency = pd.Series([i.get("concurrency", 1) for i in found], dtype=float)
+        shares = {
+            "maxvmem": concurrency,
+            "wallclock": npacked / concurrency,
+            "cpu": npacked,
+        }
+        for col, share in shares.items():
+            df[col] = pd.to_numeric(df[col]) / share
+        return df
+
+    def _emit(self, status, job, res):
+        """Emit a job event, and note the time, and the status in the job result
+
+        Events are logged to `Pipeline.topic` on the worker, when running on
+        a `dask.distributed` cluster (see `Pipeline.monitor`).
+
+        """
+        event = JobEvent(status, job._template, job.name, res["jobid"], time.time())
+        key = {"submitted": "submitted", "running": "started"}.get(status, "ended")
+        res[key], res["status"] = event.time, status
+        logger.debug(f"{event}")
+        try:
+            from distributed import get_worker
+
+            get_worker().log_event(self.topic, list(event))
+        except Exception:  # e.g. not on a cluster; never fail a job over events
+            logger.debug(f"Could not publish event: {event}", exc_info=True)
+
+    def monitor(self, staged, client=None, poll=1):
+        """Compute a staged pipeline, and stream job events as they happen
+
+        staged -- staged pipeline, as returned by `Pipeline.stage`
+        client -- `distributed.Client` (default: current client)
+        poll   -- time in seconds to wait for an event, before checking if
+                  the pipeline has finished
+
+        Returns the future of the pipeline, and an iterator of `JobEvent`s
+        that ends when the pipeline finishes; see `Pipeline.events` for the
+        possible event statuses.
+
+        >>> future, events = pipeline.monitor(staged)  # doctest: +SKIP
+        >>> for event in events:  # doctest: +SKIP
+        ...     print(event)
+        >>> res = future.result()  # doctest: +SKIP
+
+        """
+        from distributed import default_client
+
+        client = client if client is not None else default_client()
+        # subscribe before computing, so that no event is missed; the handler
+        # is called on the client event loop with (timestamp, event)
+        events = queue.Queue()
+        client.subscribe_topic(self.topic, lambda msg: events.put(msg[1]))
+        future = client.compute(staged)
+
+        def _events():
+            try:
+                while True:
+                    done = future.done()  # check first, so no event is missed
+                    try:
+                        while True:
+                            yield JobEvent(*events.get(timeout=poll))
+                    except queue.Empty:
+                        if done:
+                            break
+            finally:
+                client.unsubscribe_topic(self.topic)
+
+        return future, _events()
+
+    def _finished_before(self, job):
+        """Whether the job state store has a successful run of `job`, or of
+        all the jobs of a packed job"""
+        jobs = job.jobs if isinstance(job, PackedJob) else [job]
+        return self.store is not None and all(
+            self.store.succeeded(i.digest, i.fingerprints()) for i in jobs
+        )
+
+    def _up_to_date(self, job):
+        """Whether the outputs of a job, or all jobs of a packed job are up to
+        date (see `genomegenie.batch.state.up_to_date`)"""
+        jobs = job.jobs if isinstance(job, PackedJob) else [job]
+        return all(up_to_date(i, self.store) for i in jobs)
+
+    def _previous_jobid(self, job):
+        """Job id of the successful run of a job in the job state store
+
+        The jobs of a packed job are recorded with their own job ids (see
+        `PackedJob.unpack`); the job id of the pack is known only if they
+        all ran in the same pack, otherwise it is `None`.
+
+        """
+        if not isinstance(job, PackedJob):
+            return self.store.get(job.digest)["jobid"]
+        jobids = [self.store.get(i.digest)["jobid"] for i in job.jobs]
+        pack = jobids[0].rsplit(".", 1)[0]
+        same = jobids == [f"{pack}.{i}" for i in range(1, len(jobids) + 1)]
+        return pack if same else None
+
+    def _record(self, job, jobid, status):
+        """Record job status in the job state store (if present)
+
+        The jobs of a packed job are recorded one by one, with their own job
+        ids, and their final status from their own logs (when available).
+
+        """
+        if self.store is None or status is None:
+            return
+        if isinstance(job, PackedJob):
+            for i, packed in enumerate(job.jobs, start=1):
+                packed_id = f"{jobid}.{i}"
+                packed_status = status
+                if status in ("finished", "failed"):
+                    packed_status = self._job_status(packed, packed_id) or status
+                self._record(packed, packed_id, packed_status)
+            return
+        self.store.record(
+            job.digest, job._template, jobid, status, job.outputs, job.fingerprints()
+        )
+
+    def _job_status(self, job, jobid):
+        """Read job status from the job log, `None` if it cannot be determined"""
+        try:
+            log = contents(jobid, job.log_directory)
+            return "finished" if job_status(log) else "failed"
+        except (AssertionError, AttributeError, IndexError, KeyError, OSError):
+            logger.warning(f"Could not determine status of job {jobid}")
+            return None
+
     def _job_id_from_submit_output(self, out):
         """(copied as is from JobQueueCluster)"""
         match = re.search(self.job_id_regexp, out)
@@ -299,8 +979,8 @@ class Pipeline(object):
         return job_id
 
 
-add_class_property(Pipeline, "graph")
-add_class_property(Pipeline, "options")
+add_class_property(Pipeline, "graph", convert=thaw)
+add_class_property(Pipeline, "options", convert=freeze)
 add_class_property(Pipeline, "tmpl_dir")
 add_class_property(Pipeline, "debug")
 
@@ -328,22 +1008,45 @@ class BatchJob(object):
                time spec: hh:mm:ss
                memory spec: 100MB, 4 GB, etc
 
-    backend  -- batch system template
+               Jobs of a task may be bundled into fewer batch jobs with the
+               "pack" task option (see `PackedJob`).
+
+               Task options may declare the files a job reads and writes as
+               lists of template strings, "sources" and "targets".  They are
+               used to check if a job is up to date.  Inputs are fingerprinted
+               using "fingerprint" ("stat" by default, or "hash"; see
+               `genomegenie.utils.fingerprint`).
+
+    backend  -- batch system template; "local" runs jobs on the local
+                machine (see `genomegenie.batch.local`)
 
     """
 
     def __init__(self, template, options, tmpl_dir, backend="sge", debug=False):
-        # pdb.set_trace()
         self._template = template  # for __repr__
+        self.sources = [
+            render_string(i, debug, **options) for i in options.get("sources", [])
+        ]
+        self.targets = [
+            render_string(i, debug, **options) for i in options.get("targets", [])
+        ]
+        self.fingerprint = options.get("fingerprint", "stat")
+        output = options.get("output", None)
+        self.outputs = self.targets or ([output] if isinstance(output, str) else [])
         self.setup = compile_template(
             "module", tmpl_dir, debug, package=" ".join(options["module"])
         )
         self.job_cmd = compile_template(template, tmpl_dir, debug, **options)
+        # content addressed: identical jobs have identical names
+        self.name = f"{template}-{self.digest[:12]}"
+        self.nprocs = options.get("nprocs", 1)
+        self.memory = parse_bytes(options[backend]["memory"])
+        self.log_directory = options[backend].get("log_directory", ".")
         jobopts = {
             **options[backend],
-            "memory": "{}".format(parse_bytes(options[backend]["memory"])),
-            "name": f"{template}-{uuid4()}",
-            "nprocs": options.get("nprocs", 1),
+            "memory": "{}".format(self.memory),
+            "name": self.name,
+            "nprocs": self.nprocs,
         }
         # TODO: check walltime and cputime format
         # TODO: check if queue is valid
@@ -357,6 +1060,60 @@ class BatchJob(object):
             job_cmd=self.job_cmd,
         )
 
+    @property
+    def digest(self):
+        """Digest identifying the work done by the job
+
+        The digest is calculated from the template name, and the rendered
+        setup and job command; the job header is excluded as it contains a
+        unique job name, and resource requests do not change the outcome of
+        a job.
+
+        """
+        content = "\n".join([self._template, self.setup, self.job_cmd])
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def fingerprints(self):
+        """Fingerprints of the job inputs (see `genomegenie.utils.fingerprint`)"""
+        return dict((i, fingerprint(i, self.fingerprint)) for i in self.sources)
+
+    # attributes saved in a compiled plan (see `Pipeline.compile`)
+    _record_fields = (
+        "task",
+        "name",
+        "setup",
+        "job_cmd",
+        "job_header",
+        "script",
+        "nprocs",
+        "memory",
+        "log_directory",
+        "sources",
+        "targets",
+        "outputs",
+        "fingerprint",
+    )
+
+    def record(self):
+        """Job as a dictionary of `BatchJob._record_fields`"""
+        res = dict((key, getattr(self, key, None)) for key in self._record_fields)
+        res["task"] = self._template
+        return res
+
+    @classmethod
+    def from_record(cls, rec):
+        """Recreate a job from a record (see `BatchJob.record`), as is"""
+        job = cls.__new__(cls)
+        for key in cls._record_fields:
+            val = rec[key]
+            if key in ("sources", "targets", "outputs"):
+                val = list(val)  # e.g. arrays from a Parquet file
+            elif key in ("nprocs", "memory"):
+                val = int(val)
+            setattr(job, key, val)
+        job._template = job.__dict__.pop("task")
+        return job
+
     def __repr__(self):
         res = f"""
         BatchJob({self._template}) at {id(self)}
@@ -365,3 +1122,109 @@ class BatchJob(object):
         {self.script}
         """
         return dedent(res)
+
+
+class PackedJob(BatchJob):
+    """Several batch jobs of a task bundled into one batch job
+
+    Short jobs can spend more time waiting in the queue than running.  A
+    packed job runs a bundle of jobs from the same task in one job script,
+    concurrently; as many as fit in the requested cores.  Every job writes
+    its own log file: '<log_directory>/<job name>.o<job id>.<index>', and its
+    job status line is suffixed with the index (starting at 1); so job status
+    can be found per job.
+
+    The memory requested is the largest memory requirement of the jobs,
+    times the number of jobs that run concurrently.
+
+    jobs    -- list of `BatchJob`s to bundle, all from the same task
+    options -- task options; "pack_nprocs" (default: "nprocs") is the number
+               of cores requested for the packed job
+    """
+
+    def __init__(self, jobs, options, tmpl_dir, backend="sge", debug=False):
+        self._set_jobs(jobs)
+        first = jobs[0]
+        self.name = f"{self._template}-pack-{self.digest[:12]}"
+        self.nprocs = options.get("pack_nprocs", first.nprocs)
+        self.memory = self._memory()
+        jobopts = {
+            **options[backend],
+            "memory": "{}".format(self.memory),
+            "name": self.name,
+            "nprocs": self.nprocs,
+        }
+        self.job_header = compile_template(backend, tmpl_dir, debug, **jobopts)
+        self.script = compile_template(
+            "packscript",
+            tmpl_dir,
+            debug,
+            job_header=self.job_header,
+            setup=self.setup,
+            jobs=jobs,
+            concurrency=self.concurrency,
+            log_directory=self.log_directory,
+        )
+
+    def _set_jobs(self, jobs):
+        self.jobs = jobs
+        first = jobs[0]
+        self._template = first._template
+        self.sources = [i for job in jobs for i in job.sources]
+        self.targets = [i for job in jobs for i in job.targets]
+        self.outputs = [i for job in jobs for i in job.outputs]
+        self.fingerprint = first.fingerprint
+        self.setup = first.setup
+        self.log_directory = first.log_directory
+
+    @property
+    def concurrency(self):
+        """Number of jobs that run at the same time"""
+        return max(1, min(self.nprocs // self.jobs[0].nprocs, len(self.jobs)))
+
+    def _memory(self):
+        return max(job.memory for job in self.jobs) * self.concurrency
+
+    _record_fields = ("name", "job_header", "script", "nprocs")
+
+    def record(self):
+        """Packed job as a dictionary of `PackedJob._record_fields`"""
+        return dict((key, getattr(self, key)) for key in self._record_fields)
+
+    @classmethod
+    def from_record(cls, rec, jobs):
+        """Recreate a packed job from a record, and its jobs"""
+        job = cls.__new__(cls)
+        job._set_jobs(jobs)
+        for key in cls._record_fields:
+            setattr(job, key, rec[key])
+        job.nprocs = int(job.nprocs)  # nullable column in a plan
+        job.memory = job._memory()
+        return job
+
+    @property
+    def digest(self):
+        """Digest identifying the work done by the job (see `BatchJob.digest`)"""
+        content = "\n".join(job.digest for job in self.jobs)
+        return hashlib.sha256(content.encode()).hexdigest()
+
+    def unpack(self, res):
+        """Split the result of a packed job into results of individual jobs
+
+        The results note the number of jobs in the pack (npacked), and how
+        many ran at the same time (concurrency), to share the resource usage
+        of the pack (see `Pipeline.usage`).
+
+        """
+        jobid = res["jobid"]
+        return [
+            dict(
+                res,
+                jobid=None if jobid is None else f"{jobid}.{i}",
+                name=job.name,
+                script=job.script,
+                npacked=len(self.jobs),
+                concurrency=self.concurrency,
+            )
+            for i, job in enumerate(self.jobs, start=1)
+        ]
@@ -0,0 +1,143 @@
+# coding=utf-8
+"""Run batch jobs on the local machine
+
+The local backend runs the rendered job scripts on the current machine
+instead of submitting them to a batch scheduler.  Jobs are packed onto the
+available cores and memory using the resources they request (`nprocs` and
+`memory`), a job waits until enough resources are free.
+
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from functools import lru_cache
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+def _ncores():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on all platforms
+        return os.cpu_count()
+
+
+def _total_memory():
+    return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+
+
+class LocalExecutor(object):
+    """Run job scripts locally without oversubscribing the machine
+
+    Jobs requesting more than the total resources are capped at the total,
+    so that they run (alone) instead of waiting forever.  The executor is
+    thread safe, but resources are not shared between processes; use
+    `executor()` to get the executor shared by a process.
+
+    nprocs -- number of cores to use (default: all available)
+    memory -- memory in bytes to use (default: total physical memory)
+
+    """
+
+    def __init__(self, nprocs=None, memory=None):
+        self.nprocs = nprocs if nprocs is not None else _ncores()
+        self.memory = memory if memory is not None else _total_memory()
+        self._free = {"nprocs": self.nprocs, "memory": self.memory}
+        self._cond = threading.Condition()
+
+    def __repr__(self):
+        return f"LocalExecutor(nprocs={self.nprocs}, memory={self.memory})"
+
+    @contextmanager
+    def reserve(self, nprocs, memory):
+        """Block until the resources are available, and hold them"""
+        need = {"nprocs": min(nprocs, self.nprocs), "memory": min(memory, self.memory)}
+        with self._cond:
+            self._cond.wait_for(
+                lambda: all(self._free[key] >= val for key, val in need.items())
+            )
+            for key, val in need.items():
+                self._free[key] -= val
+        try:
+            yield
+        finally:
+            with self._cond:
+                for key, val in need.items():
+                    self._free[key] += val
+                self._cond.notify_all()
+
+    def run(
+        self,
+        script,
+        name,
+        log_directory,
+        nprocs=1,
+        memory=0,
+        on_start=None,
+        on_exit=None,
+    ):
+        """Run a job script once resources are available, and wait for it
+
+        Like a batch scheduler, the job id (the process id) is available to
+        the script as `$JOB_ID`, and the output is written to the log file
+        '<log_directory>/<name>.o<job id>'.
+
+        script        -- path to the job script
+        name          -- job name
+        log_directory -- log directory
+        nprocs        -- number of cores requested
+        memory        -- memory requested in bytes
+        on_start      -- optional callable, called with the job id when the
+                         job starts
+        on_exit       -- optional callable, called with the resources used by
+                         the job when it exits: a dictionary with maxvmem
+                         (peak resident memory in bytes), wallclock, and cpu
+                         (in seconds), like the scheduler accounting (see
+                         `genomegenie.batch.accounting`)
+
+        Returns the job id, and the exit code of the job.
+
+        """
+        logprefix = str(Path(log_directory) / name)
+        with self.reserve(nprocs, memory):
+            # the shell becomes the job (exec), so its pid is the job id
+            proc = subprocess.Popen(
+                [
+                    "bash",
+                    "-c",
+                    'export JOB_ID=$$; exec bash "$1" > "$0.o$$" 2>&1',
+                    logprefix,
+                    script,
+                ],
+                env=dict(os.environ, OMP_NUM_THREADS=str(nprocs)),
+            )
+            jobid = str(proc.pid)
+            logger.debug(f"running job {jobid}: {script}")
+            if on_start is not None:
+                on_start(jobid)
+            t_start = time.monotonic()
+            # wait4 instead of Popen.wait, for the resource usage
+            _, status, rusage = os.wait4(proc.pid, 0)
+            proc.returncode = (
+                os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            )
+            if on_exit is not None:
+                on_exit(
+                    {
+                        "maxvmem": rusage.ru_maxrss * 1024,  # KiB on Linux
+                        "wallclock": time.monotonic() - t_start,
+                        "cpu": rusage.ru_utime + rusage.ru_stime,
+                    }
+                )
+            return jobid, proc.returncode
+
+
+@lru_cache(maxsize=None)
+def executor():
+    """Return the executor shared by all pipelines in a process"""
+    return LocalExecutor()
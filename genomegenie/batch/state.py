@@ -0,0 +1,198 @@
+# coding=utf-8
+"""Persistent job state
+
+Jobs are keyed by a digest of their rendered script (see `BatchJob.digest`),
+so a job is recognised across pipeline runs as long as the work it does does
+not change.  The state is kept in a local SQLite database, which makes it
+possible to resume a pipeline that failed part way through: jobs that
+finished successfully are skipped, and only failed or missing jobs are
+submitted again.
+
+Independent of the store, jobs that declare the files they read and write
+(`sources` and `targets` task options) can be checked with `up_to_date`,
+similar to `make`.
+
+"""
+
+import json
+import logging
+import sqlite3
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class JobStore(object):
+    """Job state store backed by a SQLite database
+
+    For every job, the store records the task (template) name, the batch job
+    id, the job status, the output paths, and the fingerprints of the input
+    files at submission.  Valid statuses are listed in
+    `JobStore.statuses`.
+
+    path -- path to the SQLite database file, created if it does not exist
+
+    >>> store = JobStore(":memory:")
+    >>> store.path
+    ':memory:'
+
+    """
+
+    statuses = ("submitted", "finished", "failed")
+
+    _columns = [
+        ("digest", "TEXT PRIMARY KEY"),
+        ("task", "TEXT"),
+        ("jobid", "TEXT"),
+        ("status", "TEXT"),
+        ("outputs", "TEXT"),
+        ("fingerprints", "TEXT"),
+        ("updated", "REAL"),
+    ]
+
+    def __init__(self, path):
+        # NOTE: only the path is kept (and not the connection), so that a
+        # store can be pickled along with the pipeline to dask workers
+        self.path = str(path)
+        columns = ", ".join(f"{name} {type_}" for name, type_ in self._columns)
+        with self._connect() as conn:
+            conn.execute(f"CREATE TABLE IF NOT EXISTS jobs ({columns})")
+            self._migrate(conn)
+
+    def _migrate(self, conn):
+        """Add the columns missing in a store created by an older version"""
+        present = set(row["name"] for row in conn.execute("PRAGMA table_info(jobs)"))
+        for name, type_ in self._columns:
+            if name not in present:
+                logger.info(f"{self.path}: adding column '{name}' to the job store")
+                conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {type_}")
+
+    def __repr__(self):
+        return f"JobStore({self.path!r})"
+
+    @property
+    def _names(self):
+        return [name for name, _ in self._columns]
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=60)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:  # commit on success, rollback on error
+                yield conn
+        finally:
+            conn.close()
+
+    @staticmethod
+    def _to_dict(row):
+        res = dict(row)
+        res["outputs"] = json.loads(res["outputs"])
+        # NOTE: NULL in stores migrated from before fingerprints were recorded
+        res["fingerprints"] = json.loads(res["fingerprints"] or "null")
+        return res
+
+    def get(self, digest):
+        """Return the job record for `digest` as a dictionary, or `None`"""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT * FROM jobs WHERE digest = ?", (digest,)
+            ).fetchone()
+        return None if row is None else self._to_dict(row)
+
+    def record(self, digest, task, jobid, status, outputs=(), fingerprints=None):
+        """Insert or replace the job record for `digest`"""
+        if status not in self.statuses:
+            raise ValueError(f"Unknown job status: {status}")
+        with self._connect() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO jobs ({', '.join(self._names)}) "
+                f"VALUES ({', '.join('?' * len(self._names))})",
+                (
+                    digest,
+                    task,
+                    str(jobid),
+                    status,
+                    json.dumps(list(outputs)),
+                    json.dumps(fingerprints),
+                    time.time(),
+                ),
+            )
+
+    def update_status(self, jobids, statuses):
+        """Update job statuses by batch job id
+
+        This is useful to update the store after the job logs have been
+        parsed, e.g. with `genomegenie.utils.job_status`.
+
+        jobids   -- iterable of job ids
+        statuses -- iterable of statuses; non-string values are interpreted as
+                    the return value of `job_status` (finished or failed)
+
+        """
+        rows = [
+            (
+                status
+                if isinstance(status, str)
+                else ("finished" if status else "failed"),
+                time.time(),
+                str(jobid),
+            )
+            for jobid, status in zip(jobids, statuses)
+        ]
+        with self._connect() as conn:
+            conn.executemany(
+                "UPDATE jobs SET status = ?, updated = ? WHERE jobid = ?", rows
+            )
+
+    def succeeded(self, digest, fingerprints=None):
+        """Whether a job with `digest` has finished successfully before
+
+        If `fingerprints` of the job inputs are provided, and the store has
+        the fingerprints from the successful run, they should also match.
+
+        """
+        rec = self.get(digest)
+        if rec is None or rec["status"] != "finished":
+            return False
+        if fingerprints is None or rec["fingerprints"] is None:
+            return True
+        return rec["fingerprints"] == fingerprints
+
+    def records(self):
+        """Return all job records as a list of dictionaries"""
+        with self._connect() as conn:
+            rows = conn.execute("SELECT * FROM jobs ORDER BY updated").fetchall()
+        return [self._to_dict(row) for row in rows]
+
+
+def up_to_date(job, store=None):
+    """Check if the outputs of a job are up to date, like `make`
+
+    A job is up to date when it declares its outputs (`BatchJob.targets`), all
+    of them exist, and its inputs (`BatchJob.sources`) have not changed.  If
+    the job state store has the input fingerprints from an earlier successful
+    run of the job, they are compared to the current fingerprints (see
+    `genomegenie.utils.fingerprint`); otherwise, like `make`, the outputs
+    should be newer than the inputs.
+
+    job   -- `BatchJob` instance
+    store -- optional `JobStore` instance
+
+    """
+    if not job.targets or not all(Path(i).exists() for i in job.targets):
+        return False
+
+    fps = job.fingerprints()
+    if None in fps.values():  # missing inputs, let the job fail
+        return False
+
+    rec = store.get(job.digest) if store is not None else None
+    if rec is not None and rec["fingerprints"] is not None:
+        return rec["status"] == "finished" and rec["fingerprints"] == fps
+
+    oldest = min(Path(i).stat().st_mtime for i in job.targets)
+    newest = max((Path(i).stat().st_mtime for i in job.sources), default=oldest)
+    return oldest >= newest
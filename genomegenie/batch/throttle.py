@@ -0,0 +1,199 @@
+# coding=utf-8
+"""Throttle job submissions to a batch scheduler
+
+Batch schedulers often limit the number of jobs a user may have in the
+queue, and reject submissions beyond that limit.  A large pipeline can hit
+such limits easily, as all independent jobs are submitted at once.
+
+"""
+
+import fcntl
+import getpass
+import hashlib
+import json
+import logging
+import re
+import shlex
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+logger = logging.getLogger(__name__)
+
+
+class SubmitGovernor(object):
+    """Throttle job submissions
+
+    Submissions are limited in two ways: the number of jobs in the queue
+    (queued or running), and the submission rate (with a token bucket).
+    When a submission is rejected because the scheduler limits the number
+    of jobs, it is retried with an exponential backoff.
+
+    The state (the token bucket, the queue depth, and the jobs submitted
+    since the queue was checked) is kept in a file, locked on every update.
+    So it is shared by all governors of a user with the same limits, also
+    copies in other processes, like the ones dask pickles for every task.
+
+    max_jobs      -- maximum number of jobs in the queue (`None`: no limit)
+    rate          -- maximum submission rate, per second (`None`: no limit)
+    burst         -- number of jobs that may be submitted at once
+    retries       -- number of retries when a submission is rejected
+    backoff       -- wait before the first retry in seconds, doubled after
+                     every retry upto `max_backoff`
+    max_backoff   -- maximum wait between retries in seconds
+    queue_command -- command that lists the jobs in the queue, one per line
+                     starting with the job id
+    refresh       -- time in seconds the queue depth is cached for
+    state_dir     -- directory of the state file, it should be on a shared
+                     file system if jobs are submitted from several hosts
+                     (default: the temporary directory)
+
+    >>> governor = SubmitGovernor(max_jobs=100, rate=2)
+    >>> out, err = governor.submit(lambda: ("1234", ""))  # doctest: +SKIP
+
+    """
+
+    # error messages when the scheduler rejects a job because of the number
+    # of jobs in the queue (SGE, PBS/Torque, and Slurm)
+    rejected = re.compile(
+        r"max_u_jobs|max_jobs|jobs are allowed per user"
+        r"|maximal number of \d+ jobs per (user|cluster)"
+        r"|maximum number of jobs|too many jobs|MaxSubmitJob|job submit limit",
+        re.IGNORECASE,
+    )
+
+    def __init__(
+        self,
+        max_jobs=None,
+        rate=None,
+        burst=1,
+        retries=10,
+        backoff=30,
+        max_backoff=600,
+        queue_command="qstat",
+        refresh=30,
+        state_dir=None,
+    ):
+        self.max_jobs = max_jobs
+        self.rate = rate
+        self.burst = burst
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.queue_command = queue_command
+        self.refresh = refresh
+        self.state_dir = state_dir
+
+    def __repr__(self):
+        return f"SubmitGovernor(max_jobs={self.max_jobs}, rate={self.rate})"
+
+    @property
+    def state_file(self):
+        """File with the state shared by governors with the same limits"""
+        key = [getpass.getuser(), self.max_jobs, self.rate, self.queue_command]
+        digest = hashlib.sha1(json.dumps(key).encode()).hexdigest()[:16]
+        state_dir = self.state_dir or tempfile.gettempdir()
+        return Path(state_dir) / f"genomegenie-throttle-{digest}.json"
+
+    @contextmanager
+    def _state(self):
+        """Lock the shared state, and save the changes
+
+        NOTE: `flock` locks are held by an open file, so they also exclude
+        threads of the same process.  Times are wall clock times, as they
+        are compared between processes.
+
+        """
+        with open(self.state_file, "a+") as state_file:
+            fcntl.flock(state_file, fcntl.LOCK_EX)
+            state_file.seek(0)
+            text = state_file.read()
+            if text:
+                state = json.loads(text)
+            else:
+                state = {"tokens": self.burst, "t_tokens": time.time()}
+                state.update(depth=0, t_depth=None, pending=0)
+            yield state
+            state_file.seek(0)
+            state_file.truncate()
+            json.dump(state, state_file)
+
+    def queue_depth(self):
+        """Number of jobs in the queue, including recent submissions"""
+        with self._state() as state:
+            return self._queue_depth(state)
+
+    def _queue_depth(self, state):
+        now = time.time()
+        if state["t_depth"] is None or now - state["t_depth"] > self.refresh:
+            proc = subprocess.run(
+                shlex.split(self.queue_command),
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+            )
+            lines = proc.stdout.decode().splitlines()
+            state["depth"] = sum(1 for line in lines if re.match(r"\s*\d+", line))
+            state["t_depth"], state["pending"] = now, 0
+        return state["depth"] + state["pending"]
+
+    def _take_token(self, state):
+        """Take a token from the bucket, returns wait time if there is none"""
+        if self.rate is None:
+            return 0
+        now = time.time()
+        elapsed = max(now - state["t_tokens"], 0)
+        state["tokens"] = min(self.burst, state["tokens"] + elapsed * self.rate)
+        state["t_tokens"] = now
+        if state["tokens"] >= 1:
+            state["tokens"] -= 1
+            return 0
+        return (1 - state["tokens"]) / self.rate
+
+    def acquire(self, poll=None):
+        """Block until a job may be submitted
+
+        poll -- time to wait in seconds when the queue is full (default:
+                `refresh`)
+
+        """
+        poll = poll if poll is not None else self.refresh
+        while True:
+            with self._state() as state:
+                full = (
+                    self.max_jobs is not None
+                    and self._queue_depth(state) >= self.max_jobs
+                )
+                wait = poll if full else self._take_token(state)
+                if not wait:
+                    state["pending"] += 1
+                    return
+            time.sleep(wait)
+
+    def submit(self, submit):
+        """Submit a job with a callable, retry when rejected by the scheduler
+
+        submit -- callable that submits a job; it is expected to raise a
+                  `RuntimeError` with the scheduler message on failure (see
+                  `Pipeline._call`)
+
+        Returns the return value of `submit`
+
+        """
+        backoff = self.backoff
+        for attempt in range(self.retries + 1):
+            self.acquire()
+            try:
+                return submit()
+            except RuntimeError as err:
+                if attempt == self.retries or not self.rejected.search(str(err)):
+                    raise
+                logger.warning(
+                    f"Submission rejected (attempt {attempt + 1}), "
+                    f"retrying in {backoff}s:\n{err}"
+                )
+                with self._state() as state:
+                    state["pending"] = max(state["pending"] - 1, 0)
+                time.sleep(backoff)
+                backoff = min(2 * backoff, self.max_backoff)
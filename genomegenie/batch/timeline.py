@@ -0,0 +1,239 @@
+# coding=utf-8
+"""Analyse the job timings of a pipeline
+
+The nested pipeline graph does not show where the wall time goes.  Using
+the job timings recorded in the pipeline results (`submitted`, `started`,
+and `ended`; see `Pipeline.submit`), this module finds the critical path
+through the pipeline graph and the slack of every task (`schedule`),
+estimates the makespan of the pipeline at a given parallelism
+(`makespan`), and writes a timeline that can be opened in a trace viewer,
+e.g. chrome://tracing or https://ui.perfetto.dev (`chrome_trace`).
+
+"""
+
+import heapq
+import json
+from itertools import count
+
+import pandas as pd
+
+from genomegenie.batch.jobs import _order, dependencies
+
+# job timing columns in the pipeline results
+columns = ["task", "name", "jobid", "submitted", "started", "ended"]
+
+
+def _successors(deps):
+    succ = dict((task, []) for task in deps)
+    for task, upstream in deps.items():
+        for i in upstream:
+            succ[i].append(task)
+    return succ
+
+
+def task_durations(df, start="submitted"):
+    """Wall time of each task: from the first job start to the last job end
+
+    df    -- job timings, with the columns: task, `start`, and ended
+    start -- "submitted" to include the time spent waiting in the queue, or
+             "started" for only the run time
+
+    Returns a `pandas.Series` indexed by task; skipped jobs are ignored.
+
+    """
+    df = df.dropna(subset=[start, "ended"])
+    grouped = df.groupby("task")
+    return grouped.ended.max() - grouped[start].min()
+
+
+def schedule(graph, durations):
+    """Critical path analysis of a pipeline graph
+
+    A task starts when all its upstream tasks finish (see
+    `genomegenie.batch.jobs.dependencies`).  Tasks without a duration take no
+    time.
+
+    graph     -- pipeline graph
+    durations -- mapping of task names, and their durations (see
+                 `task_durations`)
+
+    Returns a `pandas.DataFrame` indexed by task in topological order, with
+    the columns: duration, earliest_start, earliest_finish, latest_start,
+    latest_finish, slack (how much a task may be delayed without delaying
+    the pipeline), and critical (whether the task is on the critical path)
+
+    >>> df = schedule([("foo", ["bar", "baz"]), "whaat"],
+    ...     {"foo": 5, "bar": 1, "baz": 2, "whaat": 1})
+    >>> df.slack.to_dict()
+    {'foo': 0, 'bar': 2, 'baz': 2, 'whaat': 0}
+    >>> critical_path(df)
+    ['foo', 'whaat']
+
+    """
+    deps = dependencies(graph)
+    succ = _successors(deps)
+    order = _order(deps)
+    duration = dict((task, durations.get(task, 0)) for task in order)
+
+    es, ef = {}, {}
+    for task in order:
+        es[task] = max((ef[i] for i in deps[task]), default=0)
+        ef[task] = es[task] + duration[task]
+    total = max(ef.values(), default=0)
+
+    ls, lf = {}, {}
+    for task in reversed(order):
+        lf[task] = min((ls[i] for i in succ[task]), default=total)
+        ls[task] = lf[task] - duration[task]
+
+    df = pd.DataFrame(
+        {
+            "duration": duration,
+            "earliest_start": es,
+            "earliest_finish": ef,
+            "latest_start": ls,
+            "latest_finish": lf,
+        },
+        index=order,
+    )
+    df["slack"] = df.latest_start - df.earliest_start
+    df["critical"] = df.slack.abs() < 1e-9
+    return df
+
+
+def critical_path(sched):
+    """Tasks on the critical path in order, from a schedule (see `schedule`)"""
+    critical = sched[sched.critical]
+    return list(critical.sort_values(["earliest_start", "earliest_finish"]).index)
+
+
+def makespan(graph, df, parallelism=None):
+    """Estimate the makespan of a pipeline, running at most `parallelism` jobs
+
+    The jobs are scheduled in a simulation using their run times, and the
+    task dependencies of the pipeline graph; jobs of tasks with the longest
+    path to the end of the pipeline run first.  Queue waits are not
+    included, so this is the makespan on a dedicated set of `parallelism`
+    slots.
+
+    graph       -- pipeline graph
+    df          -- job timings, with the columns: task, started, and ended
+    parallelism -- maximum number of concurrent jobs (`None`: no limit)
+
+    Returns the makespan in seconds
+
+    >>> df = pd.DataFrame({"task": ["foo", "foo", "bar"],
+    ...     "started": [0, 0, 0], "ended": [2, 2, 3]})
+    >>> makespan(["foo", "bar"], df), makespan(["foo", "bar"], df, 1)
+    (5, 7)
+
+    """
+    deps = dependencies(graph)
+    succ = _successors(deps)
+    df = df.dropna(subset=["started", "ended"])
+    runtimes = dict((task, []) for task in deps)
+    for task, runtime in zip(df.task, df.ended - df.started):
+        if task in runtimes:
+            runtimes[task].append(runtime)
+
+    # priority: longest path from the start of a task to the end
+    level = {}
+    for task in reversed(_order(deps)):
+        longest = max(runtimes[task], default=0)
+        level[task] = longest + max((level[i] for i in succ[task]), default=0)
+
+    seq = count()  # tie breaker, keeps the heaps stable
+    ready, running, remaining, done = [], [], {}, set()
+
+    def _release(task, now):
+        remaining[task] = len(runtimes[task])
+        for runtime in runtimes[task]:
+            # longest jobs first
+            heapq.heappush(ready, (-level[task], -runtime, next(seq), runtime, task))
+        if not runtimes[task]:  # nothing to run
+            _finish(task, now)
+
+    def _finish(task, now):
+        done.add(task)
+        for i in succ[task]:
+            if i not in remaining and done.issuperset(deps[i]):
+                _release(i, now)
+
+    now = 0
+    for task, upstream in deps.items():
+        if not upstream and task not in remaining:
+            _release(task, now)
+    while ready or running:
+        while ready and (parallelism is None or len(running) < parallelism):
+            *_, runtime, task = heapq.heappop(ready)
+            heapq.heappush(running, (now + runtime, next(seq), task))
+        now, _, task = heapq.heappop(running)
+        remaining[task] -= 1
+        if remaining[task] == 0:
+            _finish(task, now)
+    return now
+
+
+def _lanes(df):
+    """Assign jobs to lanes, so that jobs in a lane do not overlap"""
+    ends, lanes = [], []
+    for begin, end in zip(df.begin, df.ended):
+        for lane, last in enumerate(ends):
+            if last <= begin:
+                ends[lane] = end
+                break
+        else:
+            lane = len(ends)
+            ends.append(end)
+        lanes.append(lane)
+    return lanes
+
+
+def chrome_trace(df, path, sched=None):
+    """Write the job timeline in the Chrome trace event format
+
+    Every job is drawn as a bar on a lane, split in the time spent waiting
+    in the queue, and running.  If a schedule is provided (see `schedule`),
+    the jobs are annotated with the slack of their task, and whether it is
+    on the critical path.
+
+    df    -- job timings (see `columns`)
+    path  -- output JSON file
+    sched -- optional schedule from `schedule`
+
+    """
+    df = df.dropna(subset=["ended"])
+    df = df.assign(begin=df.submitted.fillna(df.started).fillna(df.ended))
+    df = df.sort_values("begin")
+    t0 = df.begin.min()
+
+    def _us(seconds):
+        return int(round((seconds - t0) * 1e6))
+
+    events = []
+    for lane, row in zip(_lanes(df), df.itertuples()):
+        args = {"task": row.task, "jobid": str(row.jobid)}
+        if sched is not None and row.task in sched.index:
+            args.update(
+                slack=float(sched.slack[row.task]),
+                critical=bool(sched.critical[row.task]),
+            )
+        started = row.started if pd.notnull(row.started) else row.begin
+        spans = [("queued", row.begin, started), (row.task, started, row.ended)]
+        for name, begin, end in spans:
+            if end <= begin and name == "queued":
+                continue
+            events.append(
+                {
+                    "name": name,
+                    "cat": row.task,
+                    "ph": "X",
+                    "ts": _us(begin),
+                    "dur": _us(end) - _us(begin),
+                    "pid": 1,
+                    "tid": lane,
+                    "args": dict(args, name=row.name),
+                }
+            )
+    with open(path, "w") as out:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, out)
@@ -6,14 +6,23 @@
 
 """
 
-from copy import deepcopy
-
-from genomegenie.utils import raise_if_not, consume
-from genomegenie.batch.factory import template_vars
+from genomegenie.utils import raise_if_not, flatten
+from genomegenie.batch.factory import template_index
 
 
 __TOOLS__ = ["gatk", "muse", "strelka", "freebayes"]
 
+# toolchains that support a run type
+__RUN_TYPES__ = {
+    "somatic": ["gatk", "muse", "strelka"],
+    "germline": ["gatk", "freebayes", "strelka"],
+}
+
+
+def mandatory(run_type, tmpl_dir=None):
+    """Mandatory options for a run type: common to all supporting toolchains"""
+    return template_index(tmpl_dir).common(__RUN_TYPES__[run_type])
+
 
 def validate(opts):
     """Raises ValueError if options are invalid/incomplete"""
@@ -22,29 +31,40 @@ def validate(opts):
 
     raise_if_not([opts["tool"]], __TOOLS__, "Unsupported toolchain")
 
-    _opts = dict((tool, template_vars(tool)) for tool in __TOOLS__)
-    mandatory_somatic = set(deepcopy(_opts["gatk"]))
-    consume(
-        map(
-            mandatory_somatic.intersection_update,
-            [_opts[t] for t in ["gatk", "muse", "strelka"]],
-        )
-    )
-    mandatory_germline = set(deepcopy(_opts["gatk"]))
-    consume(
-        map(
-            mandatory_germline.intersection_update,
-            [_opts[t] for t in ["gatk", "freebayes", "strelka"]],
+    if opts["run_type"] in __RUN_TYPES__:
+        raise_if_not(
+            mandatory(opts["run_type"]), opts[opts["tool"]], "Missing mandatory option"
         )
-    )
+    return
+
+
+def validate_pipeline(options, tmpl_dir=None):
+    """Raises ValueError if any task in a pipeline is missing mandatory options
 
-    # print(mandatory_germline)
-    # print(mandatory_somatic)
+    All tasks in the pipeline graph are checked in one go, and the error lists
+    the missing options of every task.  Options for a task may come from the
+    task options, or from the input files (see `Pipeline.process`).
 
-    if "somatic" == opts["run_type"]:
-        raise_if_not(mandatory_somatic, opts[opts["tool"]], "Missing mandatory option")
-    elif "germline" == opts["run_type"]:
-        raise_if_not(mandatory_germline, opts[opts["tool"]], "Missing mandatory option")
-    else:
-        pass
+    options  -- pipeline options
+    tmpl_dir -- template directory (default: `template_dir()`)
+
+    """
+    index = template_index(tmpl_dir)
+    missing = {}
+    for task in set(flatten(options["pipeline"])):
+        opts = options.get(task, {})
+        inputs = opts.get("inputs", options["inputs"])
+        if inputs == "ignore":
+            inputs = []
+        elif inputs == "all":
+            inputs = options["inputs"]
+        provided = set(opts).union(*[set(infile) for infile in inputs])
+        absent = index.mandatory(task) - provided
+        if absent:
+            missing[task] = sorted(absent)
+    if missing:
+        raise ValueError(
+            "Missing mandatory option: "
+            + "; ".join(f"{task}: {', '.join(keys)}" for task, keys in missing.items())
+        )
     return
@@ -0,0 +1,228 @@
+# coding=utf-8
+"""BGZF files: parallel compression, and record aligned chunks
+
+BGZF (see the SAM/BAM specification) is a series of gzip members, blocks
+of at most 64 KiB uncompressed data, with the compressed size of the block
+in an extra header field.  A position in a BGZF file is a virtual offset,
+as in htslib: `coffset << 16 | uoffset`, where `coffset` is the offset of
+a block in the file, and `uoffset` the offset in the uncompressed block.
+
+Blocks are independent, so they can be compressed in parallel
+(`BgzfWriter`), and a file can be split in chunks that are decompressed,
+and parsed independently (`chunks`, and `read_chunk`).  Splitting does not
+need an index: the first block after an offset is found by searching for a
+block header, and the chunk starts at the first line that starts in that
+block.  So a chunk holds whole lines (records), and every line is in
+exactly one chunk.
+
+>>> bounds = chunks("calls.vcf.gz", size=2 ** 24)  # doctest: +SKIP
+>>> read_chunk("calls.vcf.gz", bounds[0])[:60]  # doctest: +SKIP
+
+"""
+
+import os
+import re
+import struct
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# uncompressed bytes per block, so that a block always fits in 64 KiB
+_block_size = 0xFF00
+_bgzf_eof = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+
+# block header: gzip magic, FLG.FEXTRA, XLEN = 6, and the 'BC' subfield
+_header = re.compile(b"\x1f\x8b\x08\x04.{6}\x06\x00BC\x02\x00", re.DOTALL)
+_header_size = 18
+
+
+def bgzf_block(data):
+    """Compress data (at most 64 KiB - 256 bytes) as a BGZF block"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, -15)
+    cdata = compressor.compress(data) + compressor.flush()
+    header = struct.pack(
+        "<4BI2BH2BHH", 31, 139, 8, 4, 0, 0, 255, 6, 66, 67, 2, len(cdata) + 25
+    )
+    trailer = struct.pack("<2I", zlib.crc32(data) & 0xFFFFFFFF, len(data))
+    return header + cdata + trailer
+
+
+class BgzfWriter(object):
+    """Write a BGZF file, compressing blocks in parallel
+
+    Data is buffered until there is a block for every thread (times a few,
+    to amortise the overhead), then the blocks are compressed by a thread
+    pool, as zlib releases the GIL, and written in order.
+
+    path    -- output file name
+    threads -- compression threads (default: number of CPUs)
+
+    """
+
+    def __init__(self, path, threads=None):
+        self.threads = threads or os.cpu_count() or 1
+        self._out = open(path, "wb")
+        self._pool = ThreadPoolExecutor(self.threads)
+        self._pending = bytearray()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _flush(self, final=False):
+        nblocks = len(self._pending) // _block_size
+        if final and len(self._pending) % _block_size:
+            nblocks += 1
+        blocks = [
+            bytes(self._pending[i * _block_size : (i + 1) * _block_size])
+            for i in range(nblocks)
+        ]
+        del self._pending[: nblocks * _block_size]
+        for block in self._pool.map(bgzf_block, blocks):
+            self._out.write(block)
+
+    def write(self, data):
+        self._pending += data
+        if len(self._pending) >= 4 * self.threads * _block_size:
+            self._flush()
+
+    def close(self):
+        if self._out.closed:
+            return
+        try:
+            self._flush(final=True)
+            self._out.write(_bgzf_eof)
+        finally:
+            self._pool.shutdown()
+            self._out.close()
+
+
+def _size(header):
+    """Size of a block from its header, `None` if it is not a block header"""
+    if len(header) < _header_size or not _header.match(header):
+        return None
+    return int.from_bytes(header[16:18], "little") + 1
+
+
+def read_block(f):
+    """Read the block at the position of a file
+
+    Returns the compressed size, and the data; the size is 0 at the end of
+    the file.
+
+    """
+    header = f.read(_header_size)
+    if not header:
+        return 0, b""
+    size = _size(header)
+    if size is None:
+        offset = f.tell() - len(header)
+        raise ValueError(f"{f.name}: no BGZF block at offset {offset}")
+    cdata = f.read(size - _header_size)
+    return size, zlib.decompress(cdata[:-8], -15)
+
+
+def _find_block(f, offset):
+    """Offset of the first block at, or after an offset (`None` at the end)"""
+    f.seek(offset)
+    # a block is at most 64 KiB, so there is a header in the next 64 KiB
+    buf = f.read(2 ** 16 + _header_size)
+    for match in _header.finditer(buf):
+        start = offset + match.start()
+        # the pattern can occur in compressed data, but then it is unlikely
+        # to be followed by another header, or the end of the file
+        f.seek(start + _size(buf[match.start() :]))
+        following = f.read(_header_size)
+        if not following or _size(following) is not None:
+            return start
+    return None
+
+
+def _line_start(f, offset):
+    """Virtual offset of the first line that starts in the blocks after an
+    offset, i.e. after the first newline (`None` if there is none)"""
+    f.seek(offset)
+    while True:
+        size, data = read_block(f)
+        if size == 0:
+            return None
+        i = data.find(b"\n")
+        if 0 <= i < len(data) - 1:
+            return offset << 16 | (i + 1)
+        offset += size
+        if i >= 0:  # the line starts in the next block
+            return offset << 16
+
+
+def _header_end(f):
+    """Virtual offset of the first line that does not start with '#'"""
+    f.seek(0)
+    offset, newline = 0, True
+    while True:
+        size, data = read_block(f)
+        if size == 0:
+            return None
+        i = 0
+        while i < len(data):
+            if newline and data[i : i + 1] != b"#":
+                return offset << 16 | i
+            j = data.find(b"\n", i)
+            newline = j >= 0
+            if not newline:
+                break
+            i = j + 1
+        offset += size
+
+
+def chunks(fname, size=2 ** 24):
+    """Split a bgzipped VCF file in chunks of whole records
+
+    fname -- bgzipped VCF file, an index is not needed
+    size  -- approximate chunk size in compressed bytes
+
+    Returns a list of (start, end) virtual offsets, in file order; the end
+    of the last chunk is `None` (the end of the file).  The header is not
+    part of any chunk.
+
+    """
+    with open(fname, "rb") as f:
+        start = _header_end(f)
+        if start is None:
+            return []
+        fsize = os.fstat(f.fileno()).st_size
+        bounds = [start]
+        for offset in range(size, fsize, size):
+            block = _find_block(f, offset)
+            if block is None:
+                break
+            bound = _line_start(f, block)
+            if bound is None:
+                break
+            if bound > bounds[-1]:
+                bounds.append(bound)
+    return list(zip(bounds, bounds[1:] + [None]))
+
+
+def read_chunk(fname, chunk):
+    """Read, and decompress a chunk of a BGZF file (see `chunks`)
+
+    fname -- BGZF file name
+    chunk -- (start, end) virtual offsets, end is `None` for the end of file
+
+    Returns the uncompressed bytes
+
+    """
+    start, end = chunk
+    offset, ustart = start >> 16, start & 0xFFFF
+    cend, uend = (end >> 16, end & 0xFFFF) if end is not None else (None, 0)
+    parts = []
+    with open(fname, "rb") as f:
+        f.seek(offset)
+        while cend is None or offset <= cend:
+            size, data = read_block(f)
+            if size == 0:
+                break
+            parts.append(data[:uend] if offset == cend else data)
+            offset += size
+    return b"".join(parts)[ustart:]
@@ -3,6 +3,7 @@
 
 
 import logging
+from collections import deque
 from argparse import ArgumentDefaultsHelpFormatter, RawDescriptionHelpFormatter
 
 
@@ -25,3 +26,59 @@ def logger_config(logger, fmt, loglevel, filename=None):
         logger.addHandler(logfile)
     logger.setLevel(loglevel)
     return logger
+
+
+class StatusView(object):
+    """Summarise a stream of pipeline job events
+
+    Keeps track of jobs by status, the queue depth (submitted, but not yet
+    running), and the throughput (jobs done per minute over the last `window`
+    seconds).  Feed it `genomegenie.batch.jobs.JobEvent`s with `update(..)`,
+    and print it to get a one line summary.
+
+    >>> from collections import namedtuple
+    >>> Event = namedtuple("Event", ["status", "task", "name", "jobid", "time"])
+    >>> view = StatusView()
+    >>> for status, name, t in [
+    ...     ("submitted", "a", 0), ("submitted", "b", 0), ("running", "a", 60),
+    ...     ("finished", "a", 120)
+    ... ]:
+    ...     view.update(Event(status, "gatk", name, 1, t))
+    >>> print(view)
+    queued: 1, running: 0, finished: 1, failed: 0, skipped: 0, throughput: 0.5/min
+
+    """
+
+    def __init__(self, window=600):
+        self.window = window
+        self.jobs = {}  # job name -> last status
+        self.start, self.now = None, None
+        self.done = deque()  # end times of jobs within the window
+
+    def update(self, event):
+        if self.start is None:
+            self.start = event.time
+        self.now = event.time
+        self.jobs[event.name] = event.status
+        if event.status in ("finished", "failed", "unknown"):
+            self.done.append(event.time)
+        while self.done and self.done[0] < self.now - self.window:
+            self.done.popleft()
+
+    def count(self, *statuses):
+        return sum(1 for status in self.jobs.values() if status in statuses)
+
+    @property
+    def throughput(self):
+        """Jobs done per minute"""
+        elapsed = min(self.now - self.start, self.window) if self.now else 0
+        return 60 * len(self.done) / elapsed if elapsed > 0 else 0.0
+
+    def __str__(self):
+        return (
+            f"queued: {self.count('submitted')}, running: {self.count('running')}, "
+            f"finished: {self.count('finished')}, "
+            f"failed: {self.count('failed', 'unknown')}, "
+            f"skipped: {self.count('skipped')}, "
+            f"throughput: {self.throughput:.1f}/min"
+        )
@@ -0,0 +1,270 @@
+# coding=utf-8
+"""Distributed VCF to Parquet conversion
+
+An indexed VCF file is split into fixed size regions, and every region is
+converted (`genomegenie.io.to_arrow`), and written to Parquet by a task on
+a `dask.distributed` cluster; only the file names, and row counts travel
+back to the client.  The cluster can be a `LocalCluster`, or workers
+started as batch jobs (e.g. SGE) that share the filesystem with the client.
+
+The output is partitioned by chromosome, with a file per region:
+
+    <outdir>/<chrom>/<start>.parquet
+
+The start is zero padded, so the files sort in genomic order, and a
+directory can be read as one table with `pyarrow.parquet.read_table`.
+
+On a shared filesystem there is no data to move, but reading a VCF
+sequentially is much cheaper than reading it at random: consecutive
+regions are handed to the same worker in contiguous stripes (as loose
+restrictions, so idle workers can still steal them), which keeps the BGZF
+blocks, and the index in the page cache of the node.
+
+Regions split the work by bases, so a dense region still decodes on one
+core, and an unindexed file cannot be split at all.  Alternatively, a
+bgzipped VCF file is split in chunks of whole records at BGZF block
+boundaries (`genomegenie.bgzf.chunks`), which does not need an index; the
+workers decompress, and parse their chunks, and the output has a file per
+chunk, in file order:
+
+    <outdir>/chunk-<k>.parquet
+
+"""
+
+import logging
+import os
+import tempfile
+from pathlib import Path
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from distributed import default_client
+from pysam import VariantFile
+
+from genomegenie.bgzf import chunks, read_chunk
+from genomegenie.io import to_arrow
+from genomegenie.schemas import get_header, get_vcf_cols, header_path, write_header
+
+logger = logging.getLogger(__name__)
+
+
+def regions(vfname, size=200_000, contigs=None):
+    """Split the contigs of an indexed VCF file in regions of `size` bases
+
+    vfname  -- indexed VCF file name
+    size    -- region size in bases
+    contigs -- contigs to include (default: all contigs in the index)
+
+    Returns a list of (contig, start, end) tuples, with 0-based half-open
+    coordinates; contigs without a length in the header are read as one
+    region.
+
+    """
+    with VariantFile(vfname, mode="r") as vf:
+        indexed = list(vf.index) if vf.index is not None else []
+        lengths = dict((k, v.length) for k, v in vf.header.contigs.items())
+    if not indexed:
+        raise ValueError(f"{vfname}: no index, or no records")
+    contigs = indexed if contigs is None else [i for i in indexed if i in contigs]
+    res = []
+    for contig in contigs:
+        length = lengths.get(contig)
+        if length is None:
+            res.append((contig, 0, None))
+            continue
+        res.extend((contig, i, min(i + size, length)) for i in range(0, length, size))
+    return res
+
+
+def region_path(outdir, region):
+    contig, start, _ = region
+    return Path(outdir) / contig / f"{start:012d}.parquet"
+
+
+def convert_region(vfname, region, cols, outdir, row_group_size=15000):
+    """Convert a region of a VCF file, and write it to Parquet
+
+    Records are assigned to the region they start in; a record overlapping
+    a region boundary (e.g. a long deletion) is fetched for both regions,
+    but only written once.  The file is written under a temporary name,
+    and renamed when done, so a partial file is never left behind.
+
+    vfname -- indexed VCF file name
+    region -- (contig, start, end), see `regions`
+    cols   -- record column spec (see `genomegenie.schemas.get_vcf_cols`)
+    outdir -- output directory
+
+    Returns the file name, and the number of rows; empty regions are not
+    written, and return `None` as file name.
+
+    """
+    batch = to_arrow(vfname, region, cols)
+    start = region[1]
+    if batch.num_rows and start > 0:  # POS is 1-based
+        batch = batch.filter(pc.greater(batch.column("POS"), start))
+    if batch.num_rows == 0:
+        return None, 0
+    return _write(batch, region_path(outdir, region), row_group_size)
+
+
+def _write(batch, path, row_group_size):
+    """Write a batch under a temporary name, and rename it when done"""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f".{path.name}.tmp")
+    table = pa.Table.from_batches([batch])
+    pq.write_table(table, tmp, row_group_size=row_group_size, flavor="spark")
+    os.replace(tmp, path)
+    return str(path), batch.num_rows
+
+
+def chunk_path(outdir, k):
+    return Path(outdir) / f"chunk-{k:06d}.parquet"
+
+
+def parse_chunk(vfname, chunk, cols, header):
+    """Parse a chunk of a bgzipped VCF file (see `genomegenie.bgzf.chunks`)
+
+    The records are parsed by pysam, like `genomegenie.io.to_arrow`, from a
+    temporary file with the header, and the decompressed chunk.
+
+    vfname -- bgzipped VCF file name
+    chunk  -- (start, end) virtual offsets
+    cols   -- record column spec (see `genomegenie.schemas.get_vcf_cols`)
+    header -- header text of the VCF file
+
+    Returns a `RecordBatch`
+
+    """
+    with tempfile.NamedTemporaryFile("wb", suffix=".vcf") as tmp:
+        tmp.write(header.encode())
+        tmp.write(read_chunk(vfname, chunk))
+        tmp.flush()
+        return to_arrow(tmp.name, (), cols)
+
+
+def convert_chunk(
+    vfname, chunk, cols, header, path, contigs=None, row_group_size=15000
+):
+    """Convert a chunk of a VCF file, and write it to Parquet
+
+    vfname  -- bgzipped VCF file name
+    chunk   -- (start, end) virtual offsets (see `genomegenie.bgzf.chunks`)
+    cols    -- record column spec (see `genomegenie.schemas.get_vcf_cols`)
+    header  -- header text of the VCF file
+    path    -- output file name
+    contigs -- contigs to keep (default: all)
+
+    Returns the file name, and the number of rows; empty chunks are not
+    written, and return `None` as file name.
+
+    """
+    batch = parse_chunk(vfname, chunk, cols, header)
+    if batch.num_rows and contigs is not None:
+        batch = batch.filter(pc.is_in(batch.column("CHROM"), pa.array(contigs)))
+    if batch.num_rows == 0:
+        return None, 0
+    return _write(batch, Path(path), row_group_size)
+
+
+def _stripes(nregions, workers):
+    """Worker for each region, so that workers get contiguous stripes"""
+    if not workers:
+        return [None] * nregions
+    per = -(-nregions // len(workers))  # ceil
+    return [[workers[i // per]] for i in range(nregions)]
+
+
+def _header(vfname):
+    with VariantFile(vfname, mode="r") as vf:
+        hdr, samples = get_header(vf, drop_cols=None)
+        return hdr, samples, str(vf.header), vf.index is not None
+
+
+def _submit(client, func, tasks, **kwargs):
+    """Submit tasks in contiguous stripes over the workers (see `_stripes`)"""
+    workers = sorted(client.scheduler_info()["workers"])
+    return [
+        client.submit(
+            func,
+            *args,
+            workers=stripe,
+            allow_other_workers=stripe is not None,
+            **kwargs,
+        )
+        for args, stripe in zip(tasks, _stripes(len(tasks), workers))
+    ]
+
+
+def to_batches(vfname, client=None, chunk_size=2 ** 24, cols=None):
+    """Read a bgzipped VCF file in parallel on a dask cluster
+
+    The file is split in chunks (see `genomegenie.bgzf.chunks`), that are
+    parsed by the workers; it does not need an index.
+
+    vfname     -- bgzipped VCF file name, on a filesystem shared with the
+                  workers
+    client     -- `distributed.Client` (default: current client)
+    chunk_size -- approximate chunk size in compressed bytes
+    cols       -- record column spec (default: all columns, see
+                  `genomegenie.schemas.get_vcf_cols`)
+
+    Returns a list of `RecordBatch`es, in file order
+
+    """
+    client = client if client is not None else default_client()
+    hdr, samples, text, _ = _header(vfname)
+    cols = cols if cols is not None else get_vcf_cols(hdr, samples)
+    cols_f, text_f = client.scatter([cols, text], broadcast=True, hash=False)
+    tasks = [(vfname, chunk, cols_f, text_f) for chunk in chunks(vfname, chunk_size)]
+    futures = _submit(client, parse_chunk, tasks)
+    return [i for i in client.gather(futures) if i.num_rows]
+
+
+def vcf2parquet(
+    vfname, outdir, client=None, size=200_000, contigs=None, chunk_size=None
+):
+    """Convert a VCF file to partitioned Parquet on a dask cluster
+
+    vfname     -- VCF file name, on a filesystem shared with the workers
+    outdir     -- output directory, on a filesystem shared with the workers
+    client     -- `distributed.Client` (default: current client)
+    size       -- region size in bases (see `regions`)
+    contigs    -- contigs to convert (default: all contigs)
+    chunk_size -- split the file in chunks of about this many compressed
+                  bytes instead of regions (see `genomegenie.bgzf.chunks`);
+                  unindexed files are always split in chunks (default:
+                  16 MiB)
+
+    The VCF header is written to '<outdir>/_header.parquet' (see
+    `genomegenie.schemas.write_header`).
+
+    Returns a list of (file name, number of rows) tuples, in genomic order
+    (file order for chunks); empty regions, or chunks are skipped.
+
+    """
+    client = client if client is not None else default_client()
+    hdr, samples, text, indexed = _header(vfname)
+    cols = get_vcf_cols(hdr, samples)
+    Path(outdir).mkdir(parents=True, exist_ok=True)
+    write_header(hdr, samples, header_path(outdir))
+
+    if indexed and chunk_size is None:
+        [cols_f] = client.scatter([cols], broadcast=True, hash=False)
+        todo = regions(vfname, size, contigs)
+        tasks = [(vfname, region, cols_f, outdir) for region in todo]
+        func, unit = convert_region, "regions"
+    else:
+        cols_f, text_f = client.scatter([cols, text], broadcast=True, hash=False)
+        todo = chunks(vfname, chunk_size or 2 ** 24)
+        tasks = [
+            (vfname, chunk, cols_f, text_f, chunk_path(outdir, k), contigs)
+            for k, chunk in enumerate(todo)
+        ]
+        func, unit = convert_chunk, "chunks"
+    nworkers = len(client.scheduler_info()["workers"])
+    logger.info(f"{vfname}: {len(todo)} {unit} on {nworkers} workers")
+    futures = _submit(client, func, tasks, pure=False)  # writes files
+    res = [i for i in client.gather(futures) if i[0] is not None]
+    logger.info(f"{vfname}: wrote {sum(n for _, n in res)} rows in {len(res)} files")
+    return res
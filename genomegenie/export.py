@@ -0,0 +1,294 @@
+# coding=utf-8
+"""Export converted variants back to VCF
+
+Converted variants (`genomegenie.io.to_arrow`, and
+`genomegenie.convert.vcf2parquet`) are written out as a bgzipped, and
+tabix indexed VCF file, optionally for a region, or a subset of the
+samples, so that the original VCF files can be archived.
+
+The text of the records is built column-wise with Arrow compute kernels,
+a batch of records at a time; the per-sample columns are built for every
+distinct FORMAT in a batch.  The text is compressed in BGZF blocks by a
+pool of threads (`genomegenie.bgzf.BgzfWriter`).  The header is read from
+the header table written next to the converted files (see
+`genomegenie.schemas.write_header`).
+
+>>> to_vcf("variants/", "chr1.vcf.gz", region=("1",), samples=["s1"])  # doctest: +SKIP
+
+"""
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pysam
+
+from genomegenie.bgzf import BgzfWriter
+from genomegenie.index import dataset_files
+from genomegenie.schemas import header_path, read_header
+
+_site_cols = ["CHROM", "POS", "ID", "REF", "ALTS", "QUAL", "FILTER"]
+
+# header record types, and the keys of their fields in VCF order
+_record_keys = ["ID", "Number", "Type", "length", "assembly", "Description"]
+_header_names = {"CONTIG": "contig"}
+
+# genotype separator: unphased, phased
+_phase_sep = pa.array(["/", "|"])
+
+
+def header_text(hdr, samples):
+    """VCF header from a header table (see `genomegenie.schemas.get_header`)
+
+    hdr     -- header table (`pandas.DataFrame`), with or without the
+               Description column
+    samples -- samples, in column order
+
+    """
+    lines = []
+    for rec in hdr.to_dict("records"):
+        kind = rec["HeaderType"]
+        if kind == "GENERIC":
+            key, value = rec.get("ID"), rec.get("Description")
+            if pd.notna(key) and key and pd.notna(value):
+                lines.append(f"##{key}={value}")
+            continue
+        fields = [(k, rec.get(k)) for k in _record_keys]
+        # NOTE: missing cells are NaN, or None depending on the column type
+        fields = [f"{k}={v}" for k, v in fields if pd.notna(v)]
+        if "Description" not in rec and kind in ("INFO", "FORMAT", "FILTER"):
+            fields.append('Description=""')
+        lines.append(f"##{_header_names.get(kind, kind)}=<{','.join(fields)}>")
+    if not any(i.startswith("##fileformat=") for i in lines):
+        lines.insert(0, "##fileformat=VCFv4.2")
+    columns = ["#CHROM", "POS", "ID", "REF", "ALT", "QUAL", "FILTER", "INFO"]
+    if samples:
+        columns += ["FORMAT"] + list(samples)
+    return "\n".join(lines + ["\t".join(columns)]) + "\n"
+
+
+def _missing(arr):
+    """Null, or empty strings as '.'"""
+    arr = pc.fill_null(arr, ".")
+    return pc.if_else(pc.equal(arr, ""), ".", arr)
+
+
+def _text(arr, sep=","):
+    """Text of a column: values of lists are joined by `sep`
+
+    Missing values in a list are '.', and missing, or empty lists are null.
+
+    """
+    if not (pa.types.is_list(arr.type) or pa.types.is_large_list(arr.type)):
+        return pc.cast(arr, pa.string())
+    lengths = pc.fill_null(pc.list_value_length(arr), 0).to_numpy()
+    values = pc.fill_null(pc.cast(pc.list_flatten(arr), pa.string()), ".")
+    offsets = np.concatenate([[0], np.cumsum(lengths)]).astype(np.int32)
+    res = pc.binary_join(pa.ListArray.from_arrays(pa.array(offsets), values), sep)
+    return pc.if_else(pc.equal(res, ""), pa.scalar(None, pa.string()), res)
+
+
+def _drop_phase(arr):
+    """Phase, and values of a FORMAT column, the phase is the first value"""
+    lengths = pc.fill_null(pc.list_value_length(arr), 0).to_numpy()
+    values = pc.list_flatten(arr)
+    starts = (np.cumsum(lengths) - lengths)[lengths > 0]
+    phase = np.zeros(len(arr), dtype=bool)
+    phase[lengths > 0] = pc.fill_null(values.take(pa.array(starts)), 0).to_numpy() > 0
+    keep = np.ones(len(values), dtype=bool)
+    keep[starts] = False
+    offsets = np.concatenate([[0], np.cumsum(np.maximum(lengths - 1, 0))])
+    rest = pa.ListArray.from_arrays(
+        pa.array(offsets.astype(np.int32)), values.filter(pa.array(keep))
+    )
+    return phase, rest
+
+
+def _format_text(arr, field):
+    """Text of a FORMAT column of a sample (see `genomegenie.io.to_arrow`)"""
+    if not pa.types.is_list(arr.type):
+        return _missing(_text(arr))
+    phase, values = _drop_phase(arr)
+    if field != "GT":
+        return _missing(_text(values))
+    sep = _phase_sep.take(pa.array(phase.astype(np.int8)))
+    values = pc.fill_null(pc.cast(pc.list_flatten(values), pa.string()), ".")
+    lengths = pc.fill_null(pc.list_value_length(arr), 0).to_numpy()
+    offsets = np.concatenate([[0], np.cumsum(np.maximum(lengths - 1, 0))])
+    gt = pa.ListArray.from_arrays(pa.array(offsets.astype(np.int32)), values)
+    return _missing(pc.binary_join(gt, sep))
+
+
+def _info_text(batch, info):
+    """INFO text: 'KEY=value' of the fields present, ';' separated"""
+    parts = []
+    for key, name in info:
+        arr = batch.column(batch.schema.get_field_index(name))
+        if pa.types.is_boolean(arr.type):
+            flag = pc.if_else(pc.fill_null(arr, False), key, None)
+            parts.append(pc.cast(flag, pa.string()))
+        else:
+            parts.append(pc.binary_join_element_wise(key, _text(arr), "="))
+    if not parts:
+        return pa.array(["."] * batch.num_rows)
+    # NOTE: null_handling="skip" returns an empty array when all values are
+    # null, so join 'KEY=value;' parts, and trim the last separator
+    parts = [pc.fill_null(pc.binary_join_element_wise(i, "", ";"), "") for i in parts]
+    return _missing(pc.utf8_rtrim(pc.binary_join_element_wise(*parts, ""), ";"))
+
+
+def _sample_text(batch, fmt, samples):
+    """Sample columns of records with the same FORMAT"""
+    names = batch.schema.names
+    fields = fmt.split(":")
+    res = []
+    for sample in samples:
+        parts = [
+            _format_text(batch.column(names.index(f"{field}_{sample}")), field)
+            if f"{field}_{sample}" in names
+            else pa.array(["."] * batch.num_rows)
+            for field in fields
+        ]
+        res.append(pc.binary_join_element_wise(*parts, ":"))
+    return [pa.array([fmt] * batch.num_rows)] + res
+
+
+def vcf_lines(batch, info, samples):
+    """VCF records of a batch of converted variants
+
+    batch   -- `RecordBatch` (see `genomegenie.io.to_arrow`)
+    info    -- list of (INFO key, column name) tuples
+    samples -- samples to write
+
+    Returns a string array, a record per variant.
+
+    """
+    cols = [batch.column(batch.schema.get_field_index(i)) for i in _site_cols]
+    chrom, pos, id_, ref, alts, qual, filter_ = cols
+    site = [
+        chrom,
+        pc.cast(pos, pa.string()),
+        _missing(_text(id_)),
+        ref,
+        _missing(_text(alts)),
+        _missing(_text(qual)),
+        _missing(_text(filter_, ";")),
+        _info_text(batch, info),
+    ]
+    if not samples:
+        return pc.binary_join_element_wise(*site, "\t")
+
+    # sample columns, for every distinct FORMAT
+    fmts = batch.column(batch.schema.get_field_index("FORMAT"))
+    fmts = _missing(pc.binary_join(fmts, ":")).dictionary_encode()
+    codes = fmts.indices.to_numpy(zero_copy_only=False)
+    lines, order = [], []
+    for k, fmt in enumerate(fmts.dictionary.to_pylist()):
+        rows = np.flatnonzero(codes == k)
+        part, part_site = batch, site
+        if len(rows) < batch.num_rows:
+            idx = pa.array(rows)
+            part, part_site = batch.take(idx), [i.take(idx) for i in site]
+        columns = part_site + _sample_text(part, fmt, samples)
+        lines.append(pc.binary_join_element_wise(*columns, "\t"))
+        order.append(rows)
+    if len(lines) == 1:
+        return lines[0]
+    lines = pa.concat_arrays(lines)
+    return lines.take(pa.array(np.argsort(np.concatenate(order), kind="stable")))
+
+
+def _columns(schema, hdr, samples):
+    """INFO (key, column), and columns to read for the samples"""
+    names = set(schema.names)
+    info = [
+        (i, f"INFO_{i}")
+        for i in hdr[hdr.HeaderType == "INFO"].ID
+        if f"INFO_{i}" in names
+    ]
+    fmts = list(hdr[hdr.HeaderType == "FORMAT"].ID)
+    per_sample = [f"{f}_{s}" for s in samples for f in fmts if f"{f}_{s}" in names]
+    columns = _site_cols + [name for _, name in info]
+    if samples:
+        columns += ["FORMAT"] + per_sample
+    return info, columns
+
+
+def _scans(dataset, hdr, region):
+    """Filter expressions to read the dataset in header contig order"""
+    chrom, pos = ds.field("CHROM"), ds.field("POS")
+    if region:
+        expr = chrom == region[0]
+        if len(region) > 1 and region[1]:
+            expr = expr & (pos > region[1])  # POS is 1-based
+        if len(region) > 2 and region[2] is not None:
+            expr = expr & (pos <= region[2])
+        return [expr]
+    contigs = list(hdr[hdr.HeaderType == "CONTIG"].ID)
+    if not contigs:
+        return [None]
+    # contigs missing from the header go last
+    return [chrom == i for i in contigs] + [~chrom.isin(contigs)]
+
+
+def to_vcf(
+    source,
+    path,
+    region=None,
+    samples=None,
+    header=None,
+    batch_size=15000,
+    threads=None,
+    index=True,
+):
+    """Write converted variants as a bgzipped, and indexed VCF file
+
+    source     -- Parquet file, or dataset directory
+    path       -- output file name (e.g. 'variants.vcf.gz')
+    region     -- (CHROM, start, end) with 0-based half-open coordinates, or
+                  (CHROM,) for a chromosome (default: everything), records
+                  are selected by their start like
+                  `genomegenie.io.read_region`
+    samples    -- samples to write (default: all)
+    header     -- (header table, samples), see
+                  `genomegenie.schemas.get_header` (default: the header
+                  table next to the source, `genomegenie.schemas.header_path`)
+    batch_size -- records per batch
+    threads    -- compression threads (default: number of CPUs)
+    index      -- write a tabix index ('<path>.tbi')
+
+    Returns the output file name
+
+    """
+    if header is None:
+        fname = header_path(source)
+        if not fname.exists():
+            raise ValueError(f"{source}: no header table ({fname}), pass `header`")
+        header = read_header(fname)
+    hdr, all_samples = header
+    if samples is None:
+        samples = all_samples
+    missing = [i for i in samples if i not in all_samples]
+    if missing:
+        raise KeyError(f"No such samples: {missing}")
+
+    dataset = ds.dataset([str(i) for i in dataset_files(source)], format="parquet")
+    info, columns = _columns(dataset.schema, hdr, samples)
+    with BgzfWriter(path, threads) as out:
+        out.write(header_text(hdr, samples).encode())
+        for expr in _scans(dataset, hdr, region):
+            batches = dataset.to_batches(
+                columns=columns, filter=expr, batch_size=batch_size
+            )
+            for batch in batches:
+                if batch.num_rows == 0:
+                    continue
+                lines = vcf_lines(batch, info, samples)
+                offsets = pa.array([0, len(lines)], pa.int32())
+                text = pc.binary_join(pa.ListArray.from_arrays(offsets, lines), "\n")
+                out.write(memoryview(text[0].as_buffer()))
+                out.write(b"\n")
+    if index:
+        pysam.tabix_index(str(path), preset="vcf", force=True)
+    return str(path)
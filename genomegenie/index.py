@@ -0,0 +1,253 @@
+# coding=utf-8
+"""Secondary indices for variant ID, and position lookups
+
+Row group statistics help to find variants by position in converted VCF
+files, as the rows are sorted by position, but not by ID (e.g. rsIDs are
+in no particular order).  An index maps the variant keys to their location
+in the Parquet dataset, (file, row group, row), and is sorted by key:
+
+    <dataset>/_index/ids.parquet        ID -> location
+    <dataset>/_index/positions.parquet  (CHROM, POS) -> location
+
+Files, and directories starting with an underscore are ignored when the
+dataset is read with `pyarrow.parquet.read_table`.  As the index files are
+sorted, the row group statistics of an index file are precise, and serve as
+the first level of the index: a lookup reads only the index row groups
+whose key range contains a key, and then only the row groups of the dataset
+that contain a match.
+
+>>> index = build_index("variants/")  # doctest: +SKIP
+>>> index.fetch_ids(["rs123", "rs456"], columns=["CHROM", "POS"])  # doctest: +SKIP
+
+"""
+
+import json
+import os
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+_location = [("file", pa.int32()), ("row_group", pa.int32()), ("row", pa.int32())]
+
+
+def dataset_files(source):
+    """Parquet files of a dataset: a file, or a directory (recursively)
+
+    Hidden files, and files starting with an underscore are skipped, as
+    `pyarrow.parquet.read_table` does.
+
+    """
+    source = Path(source)
+    if source.is_file():
+        return [source]
+
+    def _visible(path):
+        parts = path.relative_to(source).parts
+        return not any(i.startswith(("_", ".")) for i in parts)
+
+    return sorted(i for i in source.rglob("*.parquet") if _visible(i))
+
+
+def _default_path(source):
+    source = Path(source)
+    if source.is_file():
+        return source.with_name(f"{source.name}.index")
+    return source / "_index"
+
+
+def _locations(files):
+    """Keys, and locations of every row in the dataset"""
+    for i, fname in enumerate(files):
+        pf = pq.ParquetFile(str(fname))
+        names = [k for k in ("ID", "CHROM", "POS") if k in pf.schema_arrow.names]
+        for j in range(pf.num_row_groups):
+            group = pf.read_row_group(j, columns=names)
+            n = group.num_rows
+            location = [np.full(n, i), np.full(n, j), np.arange(n)]
+            for (name, type_), values in zip(_location, location):
+                group = group.append_column(name, pa.array(values, type_))
+            yield group
+
+
+def _split_ids(table):
+    """One row per ID: IDs separated by ';' are split, missing IDs dropped"""
+    ids = pc.split_pattern(table.column("ID"), ";")
+    if isinstance(ids, pa.ChunkedArray):
+        ids = ids.combine_chunks()
+    parents = pc.list_parent_indices(ids)
+    locations = table.select([name for name, _ in _location]).take(parents)
+    res = locations.add_column(0, "ID", pc.list_flatten(ids))
+    keep = pc.and_(pc.is_valid(res.column("ID")), pc.not_equal(res.column("ID"), "."))
+    return res.filter(pc.fill_null(keep, False))
+
+
+def _write(table, sort_keys, path, row_group_size):
+    order = pc.sort_indices(table, sort_keys=sort_keys)
+    pq.write_table(table.take(order), str(path), row_group_size=row_group_size)
+
+
+def build_index(source, path=None, row_group_size=65536):
+    """Build the ID, and position index of a Parquet dataset
+
+    The keys of the whole dataset are sorted in memory; the index takes
+    about 20 bytes per variant, plus the IDs.
+
+    source         -- Parquet file, or dataset directory (e.g. the output of
+                      `genomegenie.convert.vcf2parquet`)
+    path           -- index directory (default: '<dataset>/_index', or
+                      '<file>.index' next to a file)
+    row_group_size -- rows per index row group, the unit read by a lookup
+
+    Returns a `VariantIndex`
+
+    """
+    path = Path(path) if path is not None else _default_path(source)
+    files = dataset_files(source)
+    if not files:
+        raise ValueError(f"No Parquet files in: {source}")
+    root = Path(source) if Path(source).is_dir() else Path(source).parent
+    meta = {
+        "root": os.path.relpath(str(root), str(path)),
+        "files": [str(i.relative_to(root)) for i in files],
+    }
+    table = pa.concat_tables(_locations(files))
+    path.mkdir(parents=True, exist_ok=True)
+    if "ID" in table.schema.names:
+        ids = _split_ids(table)
+        _write(ids, [("ID", "ascending")], path / "ids.parquet", row_group_size)
+    if "CHROM" in table.schema.names and "POS" in table.schema.names:
+        positions = table.select(["CHROM", "POS"] + [name for name, _ in _location])
+        sort_keys = [("CHROM", "ascending"), ("POS", "ascending")]
+        _write(positions, sort_keys, path / "positions.parquet", row_group_size)
+    with open(path / "index.json", "w") as out:
+        json.dump(meta, out)
+    return VariantIndex(path)
+
+
+def _ranges(pf, column):
+    """(min, max) of a column in every row group of an index file"""
+    idx = pf.schema_arrow.get_field_index(column)
+    res = []
+    for i in range(pf.num_row_groups):
+        stats = pf.metadata.row_group(i).column(idx).statistics
+        res.append((stats.min, stats.max) if stats and stats.has_min_max else None)
+    return res
+
+
+class VariantIndex(object):
+    """Look up variants by ID, or position (see `build_index`)
+
+    path -- index directory
+
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "index.json") as meta:
+            meta = json.load(meta)
+        self.root = (self.path / meta["root"]).resolve()
+        self.files = [self.root / i for i in meta["files"]]
+        self._ranges = {}
+
+    def __repr__(self):
+        return f"VariantIndex({str(self.path)!r}, {len(self.files)} files)"
+
+    def _index_file(self, name, *columns):
+        """Index file, and the (min, max) of columns in every row group"""
+        path = self.path / f"{name}.parquet"
+        if not path.exists():
+            raise ValueError(f"{self.path}: no {name} index")
+        pf = pq.ParquetFile(str(path))
+        for column in columns:
+            if (name, column) not in self._ranges:
+                self._ranges[name, column] = _ranges(pf, column)
+        return (pf,) + tuple(self._ranges[name, column] for column in columns)
+
+    def ids(self, ids):
+        """Locations of variants by ID
+
+        Returns a `Table` with the columns: ID, file, row_group, and row;
+        IDs that are not found are left out.
+
+        """
+        keys = sorted(set(ids))
+        pf, ranges = self._index_file("ids", "ID")
+        groups = [
+            i
+            for i, rng in enumerate(ranges)
+            if rng is None or bisect_right(keys, rng[1]) > bisect_left(keys, rng[0])
+        ]
+        if not groups or not keys:
+            return pf.schema_arrow.empty_table()
+        table = pf.read_row_groups(groups)
+        return table.filter(pc.is_in(table.column("ID"), value_set=pa.array(keys)))
+
+    def positions(self, keys):
+        """Locations of variants by position
+
+        keys -- list of (CHROM, POS) tuples
+
+        Returns a `Table` with the columns: CHROM, POS, file, row_group, and
+        row; positions that are not found are left out.
+
+        """
+        keys = sorted(set((str(c), int(p)) for c, p in keys))
+        pf, chroms, positions = self._index_file("positions", "CHROM", "POS")
+        key_chroms = [c for c, _ in keys]
+
+        def _match(chrom, pos):
+            if chrom is None or pos is None:
+                return True
+            if chrom[0] != chrom[1]:  # spans chromosomes, compare those only
+                lo, hi = chrom
+                return bisect_right(key_chroms, hi) > bisect_left(key_chroms, lo)
+            lo, hi = (chrom[0], pos[0]), (chrom[0], pos[1])
+            return bisect_right(keys, hi) > bisect_left(keys, lo)
+
+        groups = [i for i, rng in enumerate(zip(chroms, positions)) if _match(*rng)]
+        if not groups or not keys:
+            return pf.schema_arrow.empty_table()
+        table = pf.read_row_groups(groups)
+        chrom = table.column("CHROM").to_pandas()
+        pos = table.column("POS").to_numpy()
+        found = np.zeros(table.num_rows, dtype=bool)
+        for name, wanted in groupby(keys, key=lambda key: key[0]):
+            found |= (chrom == name).to_numpy() & np.isin(pos, [p for _, p in wanted])
+        return table.filter(pa.array(found))
+
+    def fetch(self, locations, columns=None):
+        """Read variants at locations (see `VariantIndex.ids`)
+
+        Only the row groups with a variant are read.  Returns a `Table` with
+        the variants, in dataset order.
+
+        locations -- `Table` with the columns: file, row_group, and row
+        columns  -- columns to read (default: all)
+
+        """
+        df = locations.select([name for name, _ in _location]).to_pandas()
+        df = df.drop_duplicates().sort_values(["file", "row_group", "row"])
+        parts = []
+        for (i, j), rows in df.groupby(["file", "row_group"]).row:
+            pf = pq.ParquetFile(str(self.files[i]))
+            group = pf.read_row_group(j, columns=columns)
+            parts.append(group.take(pa.array(rows.to_numpy())))
+        if not parts:
+            schema = pq.read_schema(str(self.files[0]))
+            if columns is not None:
+                schema = pa.schema([schema.field(i) for i in columns])
+            return schema.empty_table()
+        return pa.concat_tables(parts)
+
+    def fetch_ids(self, ids, columns=None):
+        """Read variants by ID (see `VariantIndex.fetch`)"""
+        return self.fetch(self.ids(ids), columns)
+
+    def fetch_positions(self, keys, columns=None):
+        """Read variants by position (see `VariantIndex.fetch`)"""
+        return self.fetch(self.positions(keys), columns)
@@ -2,6 +2,7 @@
 """I/O wrappers and utilities
 
 - convert VCF files to Apache Arrow compatible formats
+- cache converted regions locally as memory mapped Arrow IPC files
 - other I/O utilities
 
 @author: Suvayu Ali
@@ -9,13 +10,20 @@
 
 """
 
+import hashlib
+import json
+import os
 from collections import OrderedDict
+from pathlib import Path
 
 import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
 from pysam import VariantFile
 
-from genomegenie.schemas import _simple_vcf_cols
+from genomegenie.schemas import _simple_vcf_cols, get_header, get_vcf_cols
+from genomegenie.utils import fingerprint
 
 def to_arrow(vfname, batchparams, cols, nested_props=("FILTER", "FORMAT")):
     """Convert `VariantRecord` batches to Arrow `RecordBatch`es
@@ -90,3 +98,160 @@ def to_parquet(pqwriter, batches):
     """
     tbl = pa.Table.from_batches(batches)
     pqwriter.write_table(tbl, row_group_size=15000)
+
+
+_vcf_suffixes = (".vcf", ".vcf.gz", ".bcf")
+
+
+def _is_vcf(source):
+    return str(source).endswith(_vcf_suffixes)
+
+
+def _source_fingerprint(source, method="stat"):
+    """Fingerprint of a VCF file, or a Parquet file, or dataset directory"""
+    from genomegenie.index import dataset_files
+
+    source = Path(source)
+    files = dataset_files(source) if source.is_dir() else [source]
+    digest = hashlib.sha256()
+    for fname in files:
+        fp = fingerprint(fname, method)
+        if fp is None:
+            raise FileNotFoundError(f"No such file: {fname}")
+        digest.update(f"{fname}:{fp}\n".encode())
+    return digest.hexdigest()
+
+
+def read_region(source, region=None, columns=None):
+    """Read a region, and columns from a VCF file, or Parquet dataset
+
+    Records are assigned to the region they start in, like
+    `genomegenie.convert.convert_region`.
+
+    source  -- VCF file (indexed, unless the whole file is read), or Parquet
+               file, or dataset directory (e.g. from
+               `genomegenie.convert.vcf2parquet`)
+    region  -- (CHROM, start, end) with 0-based half-open coordinates, or
+               (CHROM,) for a chromosome (default: everything)
+    columns -- columns to read (default: all)
+
+    Returns a `Table`
+
+    """
+    region = tuple(region) if region else ()
+    if _is_vcf(source):
+        with VariantFile(str(source), mode="r") as vf:
+            hdr, samples = get_header(vf)
+        cols = get_vcf_cols(hdr, samples)
+        table = pa.Table.from_batches([to_arrow(str(source), region, cols)])
+        if len(region) > 1 and region[1]:  # POS is 1-based
+            table = table.filter(pc.greater(table.column("POS"), region[1]))
+        return table.select(columns) if columns is not None else table
+    filters = None
+    if region:
+        filters = [("CHROM", "=", region[0])]
+        if len(region) > 1 and region[1]:
+            filters.append(("POS", ">", region[1]))
+        if len(region) > 2 and region[2] is not None:
+            filters.append(("POS", "<=", region[2]))
+    return pq.read_table(str(source), columns=columns, filters=filters)
+
+
+class RegionCache(object):
+    """Local cache of regions of VCF, or Parquet sources for repeat reads
+
+    A region, and set of columns is read once (see `read_region`), and
+    written as an uncompressed Arrow IPC file; later reads memory map the
+    file, so they neither decompress nor decode, and do not copy the data.
+    An entry is named after the source, region, and columns, and the
+    fingerprint of the source (see `genomegenie.utils.fingerprint`); when a
+    source changes, its stale entries are replaced on the next read.
+
+    When the cache grows past `max_size` bytes, the least recently used
+    entries are removed; the file modification time records the last use,
+    so the cache can be shared by processes.
+
+    path     -- cache directory
+    max_size -- size limit in bytes (default: 10 GiB)
+    method   -- fingerprint method, "stat", or "hash"
+
+    >>> cache = RegionCache("~/.cache/genomegenie")  # doctest: +SKIP
+    >>> cache.read("variants/", ("1", 0, 10_000_000), ["POS"])  # doctest: +SKIP
+
+    """
+
+    def __init__(self, path, max_size=10 * 2 ** 30, method="stat"):
+        self.path = Path(path).expanduser()
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_size = max_size
+        self.method = method
+
+    def __repr__(self):
+        return f"RegionCache({str(self.path)!r}, {self.size} bytes)"
+
+    def _key(self, source, region, columns):
+        key = [str(Path(source).resolve()), list(region or ()), columns]
+        return hashlib.sha256(json.dumps(key).encode()).hexdigest()[:32]
+
+    def _entries(self):
+        return list(self.path.glob("*.arrow"))
+
+    @property
+    def size(self):
+        """Total size of the cache entries in bytes"""
+        return sum(i.stat().st_size for i in self._entries())
+
+    def read(self, source, region=None, columns=None):
+        """Read a region, and columns of a source (see `read_region`)
+
+        Returns a `Table` backed by a memory mapped cache entry.
+
+        """
+        key = self._key(source, region, columns)
+        fp = _source_fingerprint(source, self.method)[:16]
+        entry = self.path / f"{key}.{fp}.arrow"
+        for stale in self.path.glob(f"{key}.*.arrow"):
+            if stale != entry:
+                stale.unlink()
+        if entry.exists():
+            os.utime(entry)  # last use, for eviction
+        else:
+            table = read_region(source, region, columns)
+            tmp = entry.with_name(f".{entry.name}.tmp")
+            with pa.OSFile(str(tmp), "wb") as sink:
+                writer = pa.ipc.new_file(sink, table.schema)
+                writer.write_table(table)
+                writer.close()
+            os.replace(tmp, entry)
+            self.evict(keep=entry)
+        return pa.ipc.open_file(pa.memory_map(str(entry))).read_all()
+
+    def evict(self, keep=None):
+        """Remove the least recently used entries until the cache fits
+
+        keep -- entry that is not removed (e.g. the one just written)
+
+        """
+        entries = []
+        for i in self._entries():
+            try:
+                stat = i.stat()
+            except FileNotFoundError:  # removed by another process
+                continue
+            entries.append((stat.st_mtime_ns, stat.st_size, i))
+        size = sum(nbytes for _, nbytes, _ in entries)
+        for _, nbytes, entry in sorted(entries, key=lambda i: i[0]):
+            if size <= self.max_size:
+                break
+            if entry == keep:
+                continue
+            try:
+                entry.unlink()
+            except FileNotFoundError:
+                pass
+            size -= nbytes
+
+    def clear(self):
+        """Remove all entries"""
+        for entry in self._entries():
+            entry.unlink()
@@ -0,0 +1,257 @@
+# coding=utf-8
+"""Merge, and compare variant calls from multiple callers
+
+The calls of every caller are read with the Arrow conversion
+(`genomegenie.io.to_arrow`), one contig at a time, and split into one row
+per alternate allele.  The calls of all callers for a contig are merged on
+(CHROM, POS, REF, ALT):
+
+1. the rows of all callers are put in position order with a stable sort;
+   every caller is already sorted by position, so this merges sorted runs
+   in linear time (timsort),
+2. identical alleles are grouped with a hash table, numbering the groups in
+   the order they are first seen, i.e. in position order,
+3. the rows of every caller are scattered into the groups.
+
+Only one contig is in memory at a time, and the consensus table is written
+to Parquet a row group per contig, with the columns:
+
+- CHROM, POS, ID, REF, ALT: the variant (ID of the first caller with it)
+- NCALLERS: the number of callers that called the variant
+- CALL_<caller>: whether the caller called the variant
+- QUAL_<caller>, FILTER_<caller>: the calls of the caller (null if absent)
+
+Callers are named by the caller templates (e.g. "gatk", "muse").  The
+calls of a caller should be indexed (tabix) to read them a contig at a
+time; calls that are not indexed are read in one go.
+
+"""
+
+import logging
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pysam import VariantFile
+
+from genomegenie.io import to_arrow
+from genomegenie.selection import _list_contains
+
+logger = logging.getLogger(__name__)
+
+# site columns, QUAL is fractional for most callers
+site_cols = OrderedDict(
+    CHROM=pa.string(),
+    POS=pa.int32(),
+    ID=pa.string(),
+    REF=pa.string(),
+    ALTS=pa.list_(pa.string()),
+    QUAL=pa.float32(),
+    FILTER=pa.list_(pa.string()),
+)
+
+keys = ["CHROM", "POS", "REF", "ALT"]
+
+
+def schema(callers):
+    """Schema of the consensus table for a list of callers"""
+    fields = [(k, site_cols[k]) for k in ["CHROM", "POS", "ID", "REF"]]
+    fields += [("ALT", pa.string()), ("NCALLERS", pa.int8())]
+    for caller in callers:
+        fields += [
+            (f"CALL_{caller}", pa.bool_()),
+            (f"QUAL_{caller}", site_cols["QUAL"]),
+            (f"FILTER_{caller}", site_cols["FILTER"]),
+        ]
+    return pa.schema(fields)
+
+
+def explode_alts(table):
+    """One row per alternate allele: ALTS -> ALT; sites without one are dropped
+
+    >>> tbl = pa.table({"POS": [1, 2], "ALTS": [["A", "T"], None]})
+    >>> explode_alts(tbl).to_pydict()
+    {'POS': [1, 1], 'ALT': ['A', 'T']}
+
+    """
+    alts = table.column("ALTS")
+    alts = alts.combine_chunks() if isinstance(alts, pa.ChunkedArray) else alts
+    parents = pc.list_parent_indices(alts)
+    idx = table.schema.get_field_index("ALTS")
+    return (
+        table.remove_column(idx)
+        .take(parents)
+        .add_column(idx, "ALT", pc.list_flatten(alts))
+    )
+
+
+def passed(table):
+    """Mask of calls that pass all filters (FILTER is PASS, or empty)"""
+    filters = table.column("FILTER")
+    if isinstance(filters, pa.ChunkedArray):
+        filters = filters.combine_chunks()
+    empty = pc.fill_null(pc.equal(pc.list_value_length(filters), 0), True)
+    return pc.or_(empty, _list_contains(filters, "PASS"))
+
+
+def contigs(vfname):
+    """Contigs of a VCF file, in header order (indexed contigs if indexed)"""
+    with VariantFile(vfname, mode="r") as vf:
+        names = list(vf.header.contigs)
+        if vf.index is not None:
+            indexed = set(vf.index)
+            names = [i for i in names if i in indexed]
+            names += sorted(indexed.difference(names))
+    return names
+
+
+class CallReader(object):
+    """Read the calls of a caller a contig at a time
+
+    vfname      -- VCF file name
+    passed_only -- only keep calls that pass all filters (see `passed`)
+
+    """
+
+    def __init__(self, vfname, passed_only=False):
+        self.vfname = str(vfname)
+        self.passed_only = passed_only
+        with VariantFile(self.vfname, mode="r") as vf:
+            self.indexed = vf.index is not None
+            self._indexed = set(vf.index) if self.indexed else set()
+        self._all = None  # calls that are not indexed, by contig
+
+    def _read(self, region):
+        table = pa.Table.from_batches([to_arrow(self.vfname, region, site_cols)])
+        if self.passed_only and table.num_rows:
+            table = table.filter(passed(table))
+        return explode_alts(table)
+
+    def read(self, contig):
+        """Calls on a contig, one row per alternate allele"""
+        if self.indexed:
+            if contig not in self._indexed:
+                return _empty()
+            return self._read((contig,))
+        if self._all is None:
+            table = self._read(())
+            chrom = table.column("CHROM").to_pandas()
+            self._all = dict(
+                (i, table.take(pa.array(idx)))
+                for i, idx in chrom.groupby(chrom, sort=False).indices.items()
+            )
+        return self._all.get(contig, _empty())
+
+
+def _empty():
+    return explode_alts(pa.schema(list(site_cols.items())).empty_table())
+
+
+def _scatter(size, index, values):
+    """res[index] = values, where res has `size` entries, missing are -1"""
+    res = np.full(size, -1, dtype=np.int64)
+    res[index] = values
+    return res
+
+
+def merge_contig(tables, callers):
+    """Merge the calls of one contig from multiple callers
+
+    tables  -- calls of every caller (see `CallReader.read`)
+    callers -- caller names
+
+    Returns the consensus table (see `schema`), in position order
+
+    """
+    nrows = [i.num_rows for i in tables]
+    table = pa.concat_tables(tables)
+    if table.num_rows == 0:
+        return schema(callers).empty_table()
+    caller = np.repeat(np.arange(len(tables)), nrows)
+    # merge sorted runs: stable sort is linear in the number of runs
+    pos = table.column("POS").to_numpy()
+    order = np.argsort(pos, kind="stable")
+    table, caller = table.take(pa.array(order)), caller[order]
+
+    df = table.select(keys).to_pandas()
+    group = df.groupby(keys, sort=False).ngroup().to_numpy()
+    ngroups = group.max() + 1
+    rows = np.arange(len(group))
+    # first row of every group: scatter in reverse, so the first row wins
+    first = _scatter(ngroups, group[::-1], rows[::-1])
+    res = table.select(["CHROM", "POS", "ID", "REF", "ALT"]).take(pa.array(first))
+    ncallers = np.zeros(ngroups, dtype=np.int8)
+    for i, name in enumerate(callers):
+        mine = caller == i
+        idx = _scatter(ngroups, group[mine], rows[mine])
+        found = idx >= 0
+        ncallers += found
+        take = pa.array(idx, mask=~found)
+        res = res.append_column(f"CALL_{name}", pa.array(found))
+        res = res.append_column(f"QUAL_{name}", table.column("QUAL").take(take))
+        res = res.append_column(f"FILTER_{name}", table.column("FILTER").take(take))
+    res = res.add_column(5, "NCALLERS", pa.array(ncallers))
+    return res.cast(schema(callers))
+
+
+def merge_calls(calls, path, min_callers=1, passed_only=False):
+    """Merge the variant calls of multiple callers into a consensus table
+
+    calls       -- dictionary of caller names, and VCF files
+    path        -- output Parquet file
+    min_callers -- only keep variants called by at least this many callers;
+                   e.g. 1 is the union, and `len(calls)` the intersection
+    passed_only -- only consider calls that pass all filters
+
+    Returns the number of variants written
+
+    """
+    callers = list(calls)
+    readers = [CallReader(calls[i], passed_only) for i in callers]
+    order = []
+    for reader in readers:
+        order += [i for i in contigs(reader.vfname) if i not in order]
+    nvariants = 0
+    with pq.ParquetWriter(str(path), schema(callers)) as writer:
+        for contig in order:
+            merged = merge_contig([i.read(contig) for i in readers], callers)
+            if min_callers > 1:
+                keep = pc.greater_equal(merged.column("NCALLERS"), min_callers)
+                merged = merged.filter(keep)
+            if merged.num_rows:
+                writer.write_table(merged)
+                nvariants += merged.num_rows
+    logger.info(f"{path}: {nvariants} variants from {', '.join(callers)}")
+    return nvariants
+
+
+def _sample(path):
+    """Sample name of a call file: file name without VCF extensions"""
+    name = Path(path).name
+    for ext in (".gz", ".bgz", ".vcf", ".bcf"):
+        if name.endswith(ext):
+            name = name[: -len(ext)]
+    return name
+
+
+def pair_calls(dirs):
+    """Pair the call files of every sample in per caller directories
+
+    Call files are matched on their names without the VCF extensions (e.g.
+    'sample.vcf.gz', and 'sample.vcf').
+
+    dirs -- dictionary of caller names, and directories
+
+    Returns a dictionary of sample names, and dictionaries of caller names,
+    and call files; samples missing from a caller are left out of it.
+
+    """
+    samples = {}
+    for caller, directory in dirs.items():
+        for path in sorted(Path(directory).iterdir()):
+            if path.name.endswith((".vcf", ".vcf.gz", ".vcf.bgz", ".bcf")):
+                samples.setdefault(_sample(path), {})[caller] = str(path)
+    return samples
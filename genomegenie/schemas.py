@@ -6,7 +6,9 @@
 
 """
 
+import json
 from collections import OrderedDict
+from pathlib import Path
 
 import pyarrow as pa
 
@@ -92,12 +94,15 @@ def get_vcf_cols(hdr, samples):
 def get_header(vf, drop_cols=["Description"]):
     """Get header from VariantFile
 
+    Generic records (e.g. '##fileformat=VCFv4.2') have the key as ID, and
+    the value as Description.
+
     vf        -- VariantFile
     drop_cols -- Columns to drop from the final table
 
     """
     header = [
-        dict(Description=rec.value, HeaderType=rec.type)
+        dict(ID=rec.key, Description=rec.value, HeaderType=rec.type)
         if rec.type is "GENERIC"
         else dict(rec, HeaderType=rec.type)
         for rec in vf.header.records
@@ -110,3 +115,34 @@ def get_header(vf, drop_cols=["Description"]):
         return (hdrtbl.to_pandas().drop(columns=drop_cols), samples)
     else:
         return (hdrtbl.to_pandas(), samples)
+
+
+def header_path(source):
+    """Header file of a Parquet file, or dataset directory"""
+    source = Path(source)
+    if source.is_dir():
+        return source / "_header.parquet"
+    return source.with_name(f"{source.name}.header.parquet")
+
+
+def write_header(hdr, samples, path):
+    """Write the header table, and samples of a VCF file (see `get_header`)
+
+    The header is kept next to the converted files, so that the VCF file
+    can be regenerated (see `genomegenie.export`).
+
+    """
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(hdr, preserve_index=False)
+    meta = dict(table.schema.metadata or {}, samples=json.dumps(samples))
+    pq.write_table(table.replace_schema_metadata(meta), str(path))
+
+
+def read_header(path):
+    """Read a header table, and samples (see `write_header`)"""
+    import pyarrow.parquet as pq
+
+    table = pq.read_table(str(path))
+    samples = json.loads(table.schema.metadata[b"samples"])
+    return table.to_pandas(), samples
@@ -0,0 +1,341 @@
+# coding=utf-8
+"""Select variants with filter expressions
+
+Filter expressions are written in Python syntax on the variant columns, e.g.
+
+    CHROM == "1" and 10000 <= POS < 20000 and QUAL > 30 and INFO.DP >= 10
+
+`INFO.<key>` refers to the `INFO_<key>` column (see `genomegenie.io`); list
+columns are supported with membership tests, e.g. `"PASS" in FILTER`.  An
+expression is compiled once (`Selection`) into Arrow compute kernels, that
+evaluate to a mask, and then to an index array of the selected rows.
+
+Selected rows are returned as lazy "take" views (`TakeView`): only the
+(narrow) columns used in the filter are read to evaluate it, the other
+columns, e.g. the wide per-sample columns, are read, and gathered with the
+index array when they are accessed.  Parquet row groups that cannot match
+are skipped using the column statistics.
+
+>>> sel = Selection('CHROM == "1" and POS > 150')
+>>> sel.columns
+['CHROM', 'POS']
+
+"""
+
+import ast
+import operator
+from functools import reduce
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+
+# comparison: (arrow compute kernel, python operator for statistics, flipped)
+_comparisons = {
+    ast.Eq: ("equal", operator.eq, ast.Eq),
+    ast.NotEq: ("not_equal", operator.ne, ast.NotEq),
+    ast.Lt: ("less", operator.lt, ast.Gt),
+    ast.LtE: ("less_equal", operator.le, ast.GtE),
+    ast.Gt: ("greater", operator.gt, ast.Lt),
+    ast.GtE: ("greater_equal", operator.ge, ast.LtE),
+}
+
+
+class _Column(object):
+    """Reference to a column in a filter expression"""
+
+    def __init__(self, name):
+        self.name = name
+
+
+def _operand(node):
+    """Column reference, or literal value of an expression node"""
+    if isinstance(node, ast.Name):
+        return _Column(node.id)
+    elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name):
+        return _Column(f"{node.value.id}_{node.attr}")  # INFO.DP -> INFO_DP
+    try:
+        return ast.literal_eval(node)
+    except ValueError:
+        raise ValueError(f"Unsupported expression: {ast.dump(node)}") from None
+
+
+def _compile(node):
+    """Compile an expression node to a tree of tuples
+
+    ("and"|"or", [children]), ("not", child), (op, column, value), where op
+    is a comparison node type, ast.In, or ast.NotIn.
+
+    """
+    if isinstance(node, ast.Expression):
+        return _compile(node.body)
+    elif isinstance(node, ast.BoolOp):
+        kind = "and" if isinstance(node.op, ast.And) else "or"
+        return (kind, [_compile(i) for i in node.values])
+    elif isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+        return ("not", _compile(node.operand))
+    elif isinstance(node, ast.Compare):
+        # chained: a < b < c -> a < b and b < c
+        terms = []
+        left = _operand(node.left)
+        for op, comparator in zip(node.ops, node.comparators):
+            right = _operand(comparator)
+            terms.append(_comparison(type(op), left, right))
+            left = right
+        return terms[0] if len(terms) == 1 else ("and", terms)
+    raise ValueError(f"Unsupported expression: {ast.dump(node)}")
+
+
+def _comparison(op, left, right):
+    if op in (ast.In, ast.NotIn):
+        if isinstance(left, _Column) and not isinstance(right, _Column):
+            return (op, left.name, list(right))  # POS in [1, 2, 3]
+        elif isinstance(right, _Column) and not isinstance(left, _Column):
+            return (op, right.name, left)  # "PASS" in FILTER
+    elif op in _comparisons:
+        if isinstance(left, _Column) and not isinstance(right, _Column):
+            return (op, left.name, right)
+        elif isinstance(right, _Column) and not isinstance(left, _Column):
+            return (_comparisons[op][2], right.name, left)  # 30 < QUAL
+    raise ValueError("Comparisons should be between a column, and a value")
+
+
+def _walk_columns(tree):
+    kind = tree[0]
+    if kind in ("and", "or"):
+        for i in tree[1]:
+            yield from _walk_columns(i)
+    elif kind == "not":
+        yield from _walk_columns(tree[1])
+    else:
+        yield tree[1]
+
+
+def _list_contains(arr, value):
+    """Mask of list array elements that contain `value`"""
+    arr = arr.combine_chunks() if isinstance(arr, pa.ChunkedArray) else arr
+    flat = pc.fill_null(pc.equal(pc.list_flatten(arr), value), False)
+    parents = pc.list_parent_indices(arr).to_numpy()
+    counts = np.bincount(
+        parents[flat.to_numpy(zero_copy_only=False)], minlength=len(arr)
+    )
+    return pa.array(counts > 0)
+
+
+class Selection(object):
+    """Variant filter expression, compiled to Arrow compute kernels
+
+    expr -- filter expression (see module documentation)
+
+    """
+
+    def __init__(self, expr):
+        self.expr = expr
+        self._tree = _compile(ast.parse(expr, mode="eval"))
+        self.columns = list(dict.fromkeys(_walk_columns(self._tree)))
+
+    def __repr__(self):
+        return f"Selection({self.expr!r})"
+
+    def _eval(self, tree, batch):
+        kind = tree[0]
+        if kind == "and":
+            return reduce(pc.and_kleene, (self._eval(i, batch) for i in tree[1]))
+        elif kind == "or":
+            return reduce(pc.or_kleene, (self._eval(i, batch) for i in tree[1]))
+        elif kind == "not":
+            return pc.invert(self._eval(tree[1], batch))
+        op, name, value = tree
+        col = batch.column(name)
+        if op in (ast.In, ast.NotIn):
+            if pa.types.is_list(col.type):
+                mask = _list_contains(col, value)
+            else:
+                mask = pc.is_in(col, value_set=pa.array(value, type=col.type))
+            return pc.invert(mask) if op is ast.NotIn else mask
+        return getattr(pc, _comparisons[op][0])(col, value)
+
+    def mask(self, batch):
+        """Boolean mask of the selected rows; missing values are not selected
+
+        batch -- `RecordBatch` or `Table` with (at least) `Selection.columns`
+
+        """
+        if batch.num_rows == 0:
+            return pa.array([], type=pa.bool_())
+        mask = self._eval(self._tree, batch)
+        if isinstance(mask, pa.ChunkedArray):
+            mask = mask.combine_chunks()
+        return pc.fill_null(mask, False)
+
+    def indices(self, batch):
+        """Index array (int64) of the selected rows (see `Selection.mask`)"""
+        mask = self.mask(batch).to_numpy(zero_copy_only=False)
+        return pa.array(np.flatnonzero(mask), type=pa.int64())
+
+    def _may_match(self, tree, stats):
+        kind = tree[0]
+        if kind == "and":
+            return all(self._may_match(i, stats) for i in tree[1])
+        elif kind == "or":
+            return any(self._may_match(i, stats) for i in tree[1])
+        elif kind == "not":
+            return True  # conservative
+        op, name, value = tree
+        if name not in stats:
+            return True
+        lo, hi = stats[name]
+        try:
+            if op is ast.In:
+                return any(lo <= i <= hi for i in value)
+            elif op is ast.Eq:
+                return lo <= value <= hi
+            elif op in (ast.Lt, ast.LtE):
+                return _comparisons[op][1](lo, value)
+            elif op in (ast.Gt, ast.GtE):
+                return _comparisons[op][1](hi, value)
+        except TypeError:  # e.g. list columns, or mismatched types
+            pass
+        return True
+
+    def may_match(self, stats):
+        """Whether any row in a block with the column statistics can match
+
+        stats -- dictionary of column names, and (min, max) tuples; columns
+                 without statistics are assumed to match
+
+        """
+        return self._may_match(self._tree, stats)
+
+
+class TakeView(object):
+    """Lazy view of the selected rows of a record batch, or a row group
+
+    Columns are gathered with the index array (`TakeView.indices`) when they
+    are first accessed, and cached.  For a Parquet row group, the column is
+    also read from the file only then.
+
+    source  -- `RecordBatch`, `Table`, or a callable that reads a list of
+               columns as a `Table` (e.g. a Parquet row group)
+    indices -- index array of the selected rows
+    schema  -- schema of the source (default: `source.schema`)
+    columns -- optional dictionary of columns that have been read already
+
+    """
+
+    def __init__(self, source, indices, schema=None, columns=None):
+        self._source = source
+        self.indices = indices
+        self.schema = schema if schema is not None else source.schema
+        self._read = dict(columns or {})
+        self._cache = {}
+
+    def __repr__(self):
+        return f"TakeView({self.num_rows} rows, {len(self.schema)} columns)"
+
+    def __len__(self):
+        return self.num_rows
+
+    @property
+    def num_rows(self):
+        return len(self.indices)
+
+    @property
+    def column_names(self):
+        return self.schema.names
+
+    def _source_column(self, name):
+        if name in self._read:
+            return self._read[name]
+        if callable(self._source):
+            return self._source([name]).column(name)
+        return self._source.column(name)
+
+    def column(self, name):
+        """Selected rows of a column (`Array` or `ChunkedArray`)"""
+        if name not in self._cache:
+            if name not in self.schema.names:
+                raise KeyError(f"No such column: {name}")
+            self._cache[name] = self._source_column(name).take(self.indices)
+        return self._cache[name]
+
+    __getitem__ = column
+
+    def to_table(self, columns=None):
+        """Materialise the selected rows as a `Table`
+
+        columns -- list of columns (default: all columns)
+
+        """
+        columns = columns if columns is not None else self.schema.names
+        if callable(self._source):  # read all missing columns at once
+            missing = [
+                i for i in columns if i not in self._cache and i not in self._read
+            ]
+            if missing:
+                self._read.update(zip(missing, self._source(missing).columns))
+        arrays = [self.column(i) for i in columns]
+        return pa.Table.from_arrays(arrays, names=columns)
+
+
+def _row_group_stats(meta, names):
+    stats = {}
+    for i in range(meta.num_columns):
+        col = meta.column(i)
+        name = col.path_in_schema
+        if name in names and col.is_stats_set and col.statistics.has_min_max:
+            stats[name] = (col.statistics.min, col.statistics.max)
+    return stats
+
+
+def select(source, expr):
+    """Select variants from record batches, a table, or a Parquet file
+
+    source -- `RecordBatch`, `Table`, list of `RecordBatch`es, Parquet file
+              name, or `ParquetFile`
+    expr   -- filter expression, or `Selection`
+
+    Yields a `TakeView` per record batch, or Parquet row group, with any
+    selected rows.
+
+    >>> batch = pa.RecordBatch.from_arrays(
+    ...     [pa.array(["1", "1", "2"]), pa.array([100, 200, 300])], ["CHROM", "POS"]
+    ... )
+    >>> views = select(batch, 'CHROM == "1" and POS > 150')
+    >>> [view["POS"].to_pylist() for view in views]
+    [[200]]
+
+    """
+    sel = expr if isinstance(expr, Selection) else Selection(expr)
+    if isinstance(source, (str, pq.ParquetFile)) or hasattr(source, "__fspath__"):
+        yield from _select_parquet(source, sel)
+        return
+    if isinstance(source, pa.RecordBatch):
+        batches = [source]
+    elif isinstance(source, pa.Table):
+        batches = source.to_batches()
+    else:
+        batches = source
+    for batch in batches:
+        indices = sel.indices(batch)
+        if len(indices):
+            yield TakeView(batch, indices)
+
+
+def _select_parquet(source, sel):
+    pf = source if isinstance(source, pq.ParquetFile) else pq.ParquetFile(source)
+    schema = pf.schema_arrow
+    for i in range(pf.num_row_groups):
+        if not sel.may_match(_row_group_stats(pf.metadata.row_group(i), sel.columns)):
+            continue
+        narrow = pf.read_row_group(i, columns=sel.columns)
+        indices = sel.indices(narrow)
+        if len(indices):
+            yield TakeView(
+                lambda cols, i=i: pf.read_row_group(i, columns=cols),
+                indices,
+                schema,
+                dict(zip(sel.columns, narrow.columns)),
+            )
@@ -0,0 +1,316 @@
+# coding=utf-8
+"""Cohort statistics over converted genotype columns
+
+Genotypes are stored one column per sample, `GT_<sample>`, as a list of
+int8: `[phased, allele 1, allele 2, ...]`, missing alleles are null (see
+`genomegenie.io.to_arrow`).  The genotype columns of a block of variants are
+unpacked once into dense allele arrays (variants x samples, one per allele,
+-1 for missing), and all statistics are computed on them with vectorised
+NumPy operations:
+
+- per variant: allele number (AN), alternate allele count (AC), alternate
+  allele frequency (AF), call rate, observed heterozygosity, and the Hardy
+  Weinberg equilibrium chi-square statistic and p-value (`variant_stats`)
+- per sample: number of variants, called, heterozygous, and homozygous
+  alternate genotypes (`sample_counts`); these are sums, so blocks can be
+  combined
+
+Multi-allelic variants are treated as reference vs any alternate allele.
+`cohort_stats` streams over the row groups of Parquet files, processing
+several row groups in parallel, so memory stays bounded.
+
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+# per sample counts, see `sample_counts`
+sample_columns = ["n_variants", "n_called", "n_het", "n_hom_alt"]
+
+
+def gt_columns(names):
+    """Genotype columns, and sample names from a list of column names"""
+    cols = [i for i in names if i.startswith("GT_")]
+    return cols, [i[3:] for i in cols]
+
+
+def _flat(arr):
+    """Flat values (-1 if missing), starts, and lengths of a genotype column"""
+    if isinstance(arr, pa.ChunkedArray):
+        arr = arr.combine_chunks()
+    # NOTE: offsets of a sliced array do not start at 0
+    offsets = np.asarray(arr.offsets)
+    values = arr.values.slice(offsets[0], offsets[-1] - offsets[0])
+    values = pc.fill_null(values, -1).to_numpy()
+    starts = offsets[:-1] - offsets[0]
+    lengths = np.diff(offsets)
+    if arr.null_count:
+        lengths = np.where(arr.is_null().to_numpy(zero_copy_only=False), 0, lengths)
+    return values, starts, lengths
+
+
+def _alleles(arr, ploidy):
+    """Allele indices of a genotype column: variants x ploidy, -1 if missing"""
+    res = np.full((len(arr), ploidy), -1, dtype=np.int8)
+    if len(arr) == 0:
+        return res
+    values, starts, lengths = _flat(arr)
+    if (lengths == ploidy + 1).all():  # fast path: uniform ploidy, no nulls
+        return values.reshape(-1, ploidy + 1)[:, 1:].copy()
+    for k in range(ploidy):
+        present = lengths > k + 1
+        res[present, k] = values[starts[present] + k + 1]
+    return res
+
+
+def genotypes(table, columns=None):
+    """Unpack genotype columns into a dense allele array
+
+    table   -- `Table` or `RecordBatch` with genotype columns
+    columns -- genotype columns (default: all `GT_*` columns)
+
+    Returns an int8 array of shape (variants, samples, ploidy), missing
+    alleles are -1.
+
+    >>> gt = pa.array([[0, 0, 1], [1, 1, 1], None], pa.list_(pa.int8()))
+    >>> genotypes(pa.table({"GT_s1": gt}))[:, 0].tolist()
+    [[0, 1], [1, 1], [-1, -1]]
+
+    """
+    return np.stack(_unpack(table, columns), axis=2)
+
+
+def _ploidy(arrays):
+    """Ploidy of genotype columns: the longest genotype (default: diploid)"""
+    # NOTE: the first element is the phase, ploidy is the rest
+    ploidy = max(
+        (
+            pc.max(pc.list_value_length(i)).as_py() or 1
+            for i in arrays
+            if len(i) and i.null_count < len(i)
+        ),
+        default=3,
+    )
+    return max(ploidy - 1, 1)
+
+
+def _unpack(table, columns=None, ploidy=None):
+    """Unpack genotype columns into a list of variants x samples arrays
+
+    One array per allele; this layout keeps the arrays contiguous for the
+    reductions over samples, and over variants.  Alleles beyond `ploidy`
+    (default: see `_ploidy`) are dropped.
+
+    """
+    columns = columns if columns is not None else gt_columns(table.schema.names)[0]
+    arrays = [table.column(i) for i in columns]
+    ploidy = ploidy if ploidy is not None else _ploidy(arrays)
+    shape = (table.num_rows, len(columns))
+    res = [np.empty(shape, dtype=np.int8) for k in range(ploidy)]
+    for j, arr in enumerate(arrays):
+        alleles = _alleles(arr, ploidy)
+        for k in range(ploidy):
+            res[k][:, j] = alleles[:, k]
+    return res
+
+
+def _erfc(x):
+    """Complementary error function, vectorised (fractional error < 1.2e-7)
+
+    Chebyshev approximation from Numerical Recipes (erfcc), as NumPy does
+    not provide one.
+
+    """
+    z = np.abs(x)
+    t = 1 / (1 + 0.5 * z)
+    coeffs = [
+        0.17087277,
+        -0.82215223,
+        1.48851587,
+        -1.13520398,
+        0.27886807,
+        -0.18628806,
+        0.09678418,
+        0.37409196,
+        1.00002368,
+        -1.26551223,
+    ]
+    poly = np.zeros_like(t)
+    for c in coeffs:
+        poly = poly * t + c
+    res = t * np.exp(-z * z + poly)
+    return np.where(x >= 0, res, 2 - res)
+
+
+def hwe_chi2(n_hom_ref, n_het, n_hom_alt):
+    """Hardy Weinberg equilibrium chi-square test (1 degree of freedom)
+
+    Returns the chi-square statistic, and the p-value; NaN when a variant
+    has no called genotypes, or is monomorphic.
+
+    >>> chi2, p = hwe_chi2(np.array([25]), np.array([50]), np.array([25]))
+    >>> chi2.tolist(), float(round(p[0], 6))
+    ([0.0], 1.0)
+
+    """
+    obs = np.stack([n_hom_ref, n_het, n_hom_alt]).astype(np.float64)
+    n = obs.sum(axis=0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        p = (2 * obs[0] + obs[1]) / (2 * n)
+        q = 1 - p
+        exp = np.stack([n * p * p, 2 * n * p * q, n * q * q])
+        chi2 = ((obs - exp) ** 2 / exp).sum(axis=0)
+    chi2 = np.where((p > 0) & (q > 0), chi2, np.nan)
+    return chi2, _erfc(np.sqrt(chi2 / 2))
+
+
+def _genotype_classes(alleles):
+    """Genotype classes from unpacked alleles (see `_unpack`)
+
+    Returns the number of present, and alternate alleles per variant, and
+    boolean variants x samples arrays: called, het, hom_ref, and hom_alt.
+    A genotype of two alternate alleles (e.g. 1/2) is homozygous alternate.
+
+    """
+    first = alleles[0]
+    called = first >= 0
+    hom_ref = first == 0
+    hom_alt = first > 0
+    n_present = np.count_nonzero(called, axis=1)
+    n_alt = np.count_nonzero(hom_alt, axis=1)
+    for allele in alleles[1:]:
+        present, alt = allele >= 0, allele > 0
+        n_present += np.count_nonzero(present, axis=1)
+        n_alt += np.count_nonzero(alt, axis=1)
+        called &= present
+        hom_ref &= allele == 0
+        hom_alt &= alt
+    het = called & ~hom_ref & ~hom_alt
+    return n_present, n_alt, called, het, hom_ref, hom_alt
+
+
+def variant_stats(table, columns=None, keys=("CHROM", "POS")):
+    """Per variant statistics of a block of variants
+
+    table   -- `Table` or `RecordBatch` with genotype columns
+    columns -- genotype columns (default: all `GT_*` columns)
+    keys    -- columns to copy to the result, to identify variants
+
+    Returns a `pandas.DataFrame` with a row per variant, and the columns:
+    `keys`, an, ac, af, call_rate, het (fraction of called genotypes that
+    are heterozygous), hwe_chi2, and hwe_p
+
+    """
+    return _variant_stats(table, _genotype_classes(_unpack(table, columns)), keys)
+
+
+def _variant_stats(table, classes, keys):
+    an, ac, called, het, hom_ref, hom_alt = classes
+    n_called = np.count_nonzero(called, axis=1)
+    n_het = np.count_nonzero(het, axis=1)
+    chi2, pval = hwe_chi2(
+        np.count_nonzero(hom_ref, axis=1), n_het, np.count_nonzero(hom_alt, axis=1)
+    )
+    nsamples = max(called.shape[1], 1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        res = {
+            "an": an,
+            "ac": ac,
+            "af": ac / an,
+            "call_rate": n_called / nsamples,
+            "het": n_het / n_called,
+            "hwe_chi2": chi2,
+            "hwe_p": pval,
+        }
+    keys = [i for i in keys if i in table.schema.names]
+    df = pd.DataFrame(res)
+    for i, key in enumerate(keys):
+        df.insert(i, key, table.column(key).to_pandas())
+    return df
+
+
+def sample_counts(table, columns=None):
+    """Per sample genotype counts of a block of variants
+
+    Counts can be added up over blocks; see `sample_stats` for rates.
+
+    Returns a `pandas.DataFrame` indexed by sample, with the columns in
+    `sample_columns`
+
+    """
+    columns = columns if columns is not None else gt_columns(table.schema.names)[0]
+    return _sample_counts(_genotype_classes(_unpack(table, columns)), columns)
+
+
+def _sample_counts(classes, columns):
+    _, _, called, het, _, hom_alt = classes
+    return pd.DataFrame(
+        {
+            "n_variants": np.full(called.shape[1], called.shape[0]),
+            "n_called": np.count_nonzero(called, axis=0),
+            "n_het": np.count_nonzero(het, axis=0),
+            "n_hom_alt": np.count_nonzero(hom_alt, axis=0),
+        },
+        index=pd.Index([i[3:] for i in columns], name="sample"),
+    )
+
+
+def sample_stats(counts):
+    """Per sample rates from (summed) counts: call_rate, and het_rate"""
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return counts.assign(
+            call_rate=counts.n_called / counts.n_variants,
+            het_rate=counts.n_het / counts.n_called,
+        )
+
+
+def _block_stats(block, columns, keys):
+    classes = _genotype_classes(_unpack(block, columns))
+    return _variant_stats(block, classes, keys), _sample_counts(classes, columns)
+
+
+def cohort_stats(sources, samples=None, keys=("CHROM", "POS"), nthreads=None):
+    """Per variant, and per sample statistics of a cohort
+
+    The row groups of all files are processed in parallel, at most
+    `nthreads` at a time; Arrow, and NumPy release the GIL for the heavy
+    lifting, so threads are sufficient.
+
+    sources  -- Parquet file name, or list of file names (e.g. one per
+                chromosome), with genotype columns
+    samples  -- samples to include (default: all)
+    keys     -- columns to identify variants (see `variant_stats`)
+    nthreads -- number of row groups to process concurrently (default:
+                number of cores)
+
+    Returns two `pandas.DataFrame`s: per variant statistics in file order
+    (see `variant_stats`), and per sample statistics (see `sample_stats`)
+
+    """
+    sources = [sources] if isinstance(sources, str) else list(sources)
+    files = [pq.ParquetFile(i) for i in sources]
+    columns, names = gt_columns(files[0].schema_arrow.names)
+    if samples is not None:
+        wanted = set(samples)
+        columns = [c for c, s in zip(columns, names) if s in wanted]
+    keys = [i for i in keys if i in files[0].schema_arrow.names]
+
+    def _task(args):
+        pf, i = args
+        block = pf.read_row_group(i, columns=keys + columns)
+        return _block_stats(block, columns, keys)
+
+    tasks = [(pf, i) for pf in files for i in range(pf.num_row_groups)]
+    variants, counts = [], None
+    with ThreadPoolExecutor(nthreads) as pool:
+        for df, cnt in pool.map(_task, tasks):
+            variants.append(df)
+            counts = cnt if counts is None else counts + cnt
+    if not variants:
+        raise ValueError(f"No variants in: {', '.join(sources)}")
+    return pd.concat(variants, ignore_index=True), sample_stats(counts)
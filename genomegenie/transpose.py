@@ -0,0 +1,313 @@
+# coding=utf-8
+"""Sample-major genotype store
+
+The converted VCF (`genomegenie.io.to_arrow`) is variant-major: a row per
+variant, and a genotype column per sample (`GT_<sample>`).  Reading the
+genotypes of one sample genome-wide then touches every row group.  The
+sample-major store transposes the genotypes, so that the genotypes of a
+sample are contiguous:
+
+    <store>/variants.parquet      variant keys (CHROM, POS, ID, REF, ALTS)
+    <store>/block-<k>.arrow       genotypes of a block of samples
+
+The variant keys are in the same order, and row groups as the
+variant-major file(s), so a variant is identified by its row number in
+both stores.  A block file is an Arrow IPC file with a record batch per
+chunk of variants (a row group of the variant-major store), and a row per
+sample; the genotypes of a sample in a chunk are one binary value, a
+matrix of the phase, and the alleles of every variant:
+
+- "int8": (1 + ploidy) x variants int8, missing alleles are -1, and the
+  phase of a missing genotype is -1
+- "bits": (1 + 2 x ploidy) x variants bits, packed; the phase, and for
+  every allele whether it is missing, and whether it is an alternate
+  allele (a missing genotype is a missing, alternate first allele).
+  This is 5 times smaller for diploids, but multi-allelic variants are
+  reduced to reference vs any alternate allele (as in
+  `genomegenie.stats`).
+
+Block files are memory mapped, so reading a sample only reads its part of
+the chunks that are needed.
+
+"""
+
+import json
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from genomegenie.stats import _flat, _ploidy, _unpack, gt_columns
+
+key_columns = ["CHROM", "POS", "ID", "REF", "ALTS"]
+
+_schema = pa.schema([("GT", pa.large_binary())])
+
+
+def _phase(arr):
+    """Phase of a genotype column (-1 if the genotype is missing)"""
+    res = np.full(len(arr), -1, dtype=np.int8)
+    if len(arr) == 0:
+        return res
+    values, starts, lengths = _flat(arr)
+    present = lengths > 0
+    res[present] = np.maximum(values[starts[present]], 0)
+    return res
+
+
+def _encode(phase, alleles, encoding):
+    """Genotype matrices of a block of samples: samples x (planes x variants)"""
+    if encoding == "int8":
+        planes = np.stack([phase] + alleles, axis=1)  # variants x planes x samples
+    else:
+        bits = [phase > 0]
+        for k, allele in enumerate(alleles):
+            # a missing genotype: the first allele is missing, and alternate
+            bits += [allele < 0, (allele > 0) | (k == 0) & (phase < 0)]
+        planes = np.packbits(np.stack(bits, axis=1), axis=0)
+    nsamples = planes.shape[2]
+    return np.ascontiguousarray(planes.transpose(2, 1, 0)).reshape(nsamples, -1)
+
+
+def _decode(buf, nvariants, ploidy, encoding):
+    """Phase, and alleles (variants x ploidy) of a sample from its matrix"""
+    data = np.frombuffer(buf, dtype=np.int8 if encoding == "int8" else np.uint8)
+    if encoding == "int8":
+        planes = data.reshape(1 + ploidy, nvariants)
+        return planes[0], planes[1:].T
+    planes = np.unpackbits(data.reshape(1 + 2 * ploidy, -1), axis=1)[:, :nvariants]
+    missing, alt = planes[1::2].T, planes[2::2].T.astype(np.int8)
+    phase = np.where(missing[:, 0] & alt[:, 0], np.int8(-1), planes[0].astype(np.int8))
+    return phase, np.where(missing, np.int8(-1), alt)
+
+
+def _batch(matrices):
+    """Record batch with a binary value per sample, without copying"""
+    nsamples, nbytes = matrices.shape
+    offsets = np.arange(nsamples + 1, dtype=np.int64) * nbytes
+    arr = pa.Array.from_buffers(
+        pa.large_binary(),
+        nsamples,
+        [None, pa.py_buffer(offsets), pa.py_buffer(matrices)],
+    )
+    return pa.RecordBatch.from_arrays([arr], schema=_schema)
+
+
+def to_sample_major(
+    sources, path, block_size=256, encoding="int8", compression=None, ploidy=None
+):
+    """Write a sample-major genotype store from variant-major Parquet files
+
+    The files are read a row group at a time, so memory use is bounded by
+    the row group size.
+
+    sources     -- Parquet file name, or list of file names in genomic order
+                   (e.g. from `genomegenie.convert.vcf2parquet`)
+    path        -- store directory
+    block_size  -- number of samples per block file
+    encoding    -- "int8", or "bits" (see module documentation)
+    compression -- compression of the block files: None, "lz4", or "zstd";
+                   compressed files cannot be memory mapped
+    ploidy      -- ploidy (default: from the first row group)
+
+    Returns a `SampleStore`
+
+    """
+    if encoding not in ("int8", "bits"):
+        raise ValueError(f"Unknown genotype encoding: {encoding}")
+    sources = [sources] if isinstance(sources, (str, Path)) else list(sources)
+    files = [pq.ParquetFile(str(i)) for i in sources]
+    columns, samples = gt_columns(files[0].schema_arrow.names)
+    keys = [i for i in key_columns if i in files[0].schema_arrow.names]
+    path = Path(path)
+    path.mkdir(parents=True, exist_ok=True)
+
+    starts = range(0, len(samples), block_size)
+    blocks = [(i, min(i + block_size, len(samples))) for i in starts]
+    options = pa.ipc.IpcWriteOptions(compression=compression)
+    writers = [
+        pa.ipc.new_file(str(path / f"block-{k:05d}.arrow"), _schema, options=options)
+        for k in range(len(blocks))
+    ]
+    chunks = []
+    key_writer = None
+    try:
+        for pf in files:
+            for i in range(pf.num_row_groups):
+                group = pf.read_row_group(i, columns=keys + columns)
+                if ploidy is None:
+                    ploidy = _ploidy([group.column(j) for j in columns])
+                if key_writer is None:
+                    key_path = str(path / "variants.parquet")
+                    key_writer = pq.ParquetWriter(key_path, group.select(keys).schema)
+                # a row group per chunk, so keys can be read by chunk
+                nrows = group.num_rows
+                key_writer.write_table(group.select(keys), row_group_size=nrows)
+                chunks.append(nrows)
+                alleles = _unpack(group, columns, ploidy)
+                phase = np.stack([_phase(group.column(j)) for j in columns], axis=1)
+                for (start, end), writer in zip(blocks, writers):
+                    block = [a[:, start:end] for a in alleles]
+                    matrices = _encode(phase[:, start:end], block, encoding)
+                    writer.write_batch(_batch(matrices))
+    finally:
+        for writer in writers:
+            writer.close()
+        if key_writer is not None:
+            key_writer.close()
+
+    meta = {
+        "samples": samples,
+        "block_size": block_size,
+        "encoding": encoding,
+        "ploidy": ploidy,
+        "chunks": chunks,
+    }
+    with open(path / "store.json", "w") as out:
+        json.dump(meta, out)
+    return SampleStore(path)
+
+
+class SampleStore(object):
+    """Read genotypes from a sample-major store (see `to_sample_major`)
+
+    path -- store directory
+
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path / "store.json") as meta:
+            meta = json.load(meta)
+        self.samples = meta["samples"]
+        self.block_size = meta["block_size"]
+        self.encoding = meta["encoding"]
+        self.ploidy = meta["ploidy"]
+        self.chunks = meta["chunks"]
+        self.offsets = np.concatenate([[0], np.cumsum(self.chunks)]).astype(np.int64)
+        self._index = dict((s, i) for i, s in enumerate(self.samples))
+        self._readers = {}
+        self._positions = None
+
+    def __repr__(self):
+        return f"SampleStore({str(self.path)!r}, {len(self.samples)} samples)"
+
+    @property
+    def variants(self):
+        """Variant keys of the store (in variant-major order)"""
+        return pq.read_table(str(self.path / "variants.parquet"))
+
+    def _chunks(self, rows):
+        return np.searchsorted(self.offsets, rows, side="right") - 1
+
+    def keys(self, rows):
+        """Variant keys of rows, only the chunks with the rows are read"""
+        pf = pq.ParquetFile(str(self.path / "variants.parquet"))
+        rows = np.asarray(rows, dtype=np.int64)
+        if len(rows) == 0:
+            return pf.schema_arrow.empty_table()
+        chunk = self._chunks(rows)
+        wanted = np.unique(chunk)
+        table = pf.read_row_groups([int(i) for i in wanted])
+        base = np.cumsum([0] + [self.chunks[i] for i in wanted])
+        local = rows - self.offsets[chunk] + base[np.searchsorted(wanted, chunk)]
+        return table.take(pa.array(local))
+
+    def _reader(self, block):
+        if block not in self._readers:
+            source = pa.memory_map(str(self.path / f"block-{block:05d}.arrow"))
+            self._readers[block] = pa.ipc.open_file(source)
+        return self._readers[block]
+
+    def rows(self, region):
+        """Row numbers of the variants in a region
+
+        region -- (CHROM, start, end), with 0-based half-open coordinates
+                  like `genomegenie.convert.regions`; or (CHROM,) for a
+                  chromosome, or (CHROM, start) up to its end
+
+        """
+        if self._positions is None:
+            self._positions = pq.read_table(
+                str(self.path / "variants.parquet"), columns=["CHROM", "POS"]
+            )
+        chrom = self._positions.column("CHROM")
+        pos = self._positions.column("POS")
+        mask = pc.equal(chrom, region[0])
+        if len(region) > 1 and region[1]:  # POS is 1-based
+            mask = pc.and_(mask, pc.greater(pos, region[1]))
+        if len(region) > 2 and region[2] is not None:
+            mask = pc.and_(mask, pc.less_equal(pos, region[2]))
+        mask = pc.fill_null(mask, False)
+        if isinstance(mask, pa.ChunkedArray):
+            mask = mask.combine_chunks()
+        return np.flatnonzero(mask.to_numpy(zero_copy_only=False))
+
+    def alleles(self, sample, rows=None):
+        """Phase, and alleles (variants x ploidy, -1 if missing) of a sample
+
+        The phase of a missing genotype is -1.
+
+        sample -- sample name
+        rows   -- row numbers of variants, sorted (default: all)
+
+        """
+        try:
+            idx = self._index[sample]
+        except KeyError:
+            raise KeyError(f"No such sample: {sample}") from None
+        block, row = divmod(idx, self.block_size)
+        reader = self._reader(block)
+        if rows is None:
+            wanted = range(len(self.chunks))
+        else:
+            rows = np.asarray(rows, dtype=np.int64)
+            wanted = np.unique(self._chunks(rows))
+        phases, alleles = [], []
+        for chunk in wanted:
+            value = reader.get_batch(chunk).column(0)[row].as_buffer()
+            nrows = self.chunks[chunk]
+            phase, allele = _decode(value, nrows, self.ploidy, self.encoding)
+            if rows is not None:
+                start, end = self.offsets[chunk], self.offsets[chunk + 1]
+                local = rows[(rows >= start) & (rows < end)] - start
+                phase, allele = phase[local], allele[local]
+            phases.append(phase)
+            alleles.append(allele)
+        if not phases:
+            empty = np.empty((0, self.ploidy), dtype=np.int8)
+            return np.empty(0, dtype=np.int8), empty
+        return np.concatenate(phases), np.concatenate(alleles)
+
+    def genotypes(self, sample, region=None, alt_only=False):
+        """Variants, and genotypes of a sample
+
+        sample   -- sample name
+        region   -- optional region (see `SampleStore.rows`)
+        alt_only -- only variants where the sample has an alternate allele
+
+        Returns a `Table` with the variant keys, a row number column (VIDX),
+        and the genotypes of the sample (`GT_<sample>`), in the layout of
+        the variant-major store; missing genotypes are null.
+
+        """
+        rows = None if region is None else self.rows(region)
+        phase, alleles = self.alleles(sample, rows)
+        if rows is None:
+            rows = np.arange(self.offsets[-1])
+        if alt_only:
+            keep = (alleles > 0).any(axis=1)
+            rows, phase, alleles = rows[keep], phase[keep], alleles[keep]
+        null = phase < 0
+        phase = np.maximum(phase, 0)
+        values = np.concatenate([phase[:, None], alleles], axis=1).ravel()
+        offsets = np.arange(len(rows) + 1, dtype=np.int32) * (1 + self.ploidy)
+        gt = pa.ListArray.from_arrays(
+            pa.array(offsets), pa.array(values, mask=values < 0), mask=pa.array(null)
+        )
+        keys = self.keys(rows)
+        return keys.append_column("VIDX", pa.array(rows)).append_column(
+            f"GT_{sample}", gt
+        )
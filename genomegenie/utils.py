@@ -1,14 +1,15 @@
 # coding=utf-8
 """Utilities"""
 
+import hashlib
+import os
 import re
-from collections import deque, Sequence
+from collections import deque
+from collections.abc import Mapping, Sequence
 from copy import deepcopy
 from pathlib import Path
 from ast import literal_eval
-
-import pandas as pd
-from glom import glom, Coalesce
+from concurrent.futures import ThreadPoolExecutor
 
 
 def raise_if_not(items, obj, msg):
@@ -57,6 +58,38 @@ def flatten(lst):
             yield el
 
 
+def records(data, depth=3):
+    """Walk the nested job results, and yield the job result dictionaries
+
+    The results are traversed once in order.  An element nested deeper than
+    `depth` levels beyond the first two levels of nesting is yielded as an
+    empty dictionary (i.e. all columns are missing).
+
+    >>> data = [[{"a": 1}, {"a": 2}], [[{"a": 3}, {"a": 4}], {"a": 5}]]
+    >>> [i["a"] for i in records(data)]
+    [1, 2, 3, 4, 5]
+
+    """
+
+    def _walk(el, depth):
+        if isinstance(el, Mapping):
+            yield el
+        elif depth > 0 and isinstance(el, Sequence) and not isinstance(el, str):
+            for i in el:
+                yield from _walk(i, depth - 1)
+        else:
+            yield {}
+
+    for tasks in data:
+        for el in tasks:
+            yield from _walk(el, depth)
+
+
+def _columns(data, cols, depth, default):
+    rows = [i for i in records(data, depth)]
+    return dict((key, [row.get(key, default) for row in rows]) for key in cols)
+
+
 def results(data, cols, depth=3):
     """Convert the returned job status from a pipeline to a dataframe
 
@@ -81,7 +114,7 @@ def results(data, cols, depth=3):
     -------
     pandas.DataFrame
 
-        a dataframe with `cols` as columns
+        a dataframe with `cols` as columns, missing values are set to "?"
 
     Examples
     --------
@@ -98,31 +131,229 @@ def results(data, cols, depth=3):
     4  5  50
 
     """
+    import pandas as pd
 
-    def _nest(key, depth):
-        res = [key]
-        for i in range(depth):
-            res.append([res[-1]])
-        return res
+    return pd.DataFrame(_columns(data, cols, depth, "?"))
+
+
+def results_table(data, cols, depth=3):
+    """Convert the returned job status from a pipeline to an Arrow table
+
+    Same as `results`, but the results are gathered into an Arrow table
+    directly, missing values are set to null.  This avoids a copy of large
+    text columns (job scripts, and outputs) when they are written to disk,
+    e.g. with `pyarrow.parquet.write_table`.
+
+    >>> data = [[{"a": 1, "b": "x"}], [[{"a": 2}]]]
+    >>> results_table(data, ["a", "b"]).to_pydict()
+    {'a': [1, 2], 'b': ['x', None]}
+
+    """
+    import pyarrow as pa
+
+    columns = _columns(data, cols, depth, None)
+    return pa.Table.from_arrays([pa.array(columns[key]) for key in cols], cols)
+
+
+def stream_results(staged, cols, client=None, batch_size=100):
+    """Stream job results from a staged pipeline as jobs finish
+
+    Unlike `results`, the pipeline does not have to finish before results are
+    available.  The staged pipeline is submitted to a `dask.distributed`
+    cluster, and the job results are yielded as Arrow `RecordBatch`es as soon
+    as `batch_size` jobs have finished.
+
+    Parameters
+    ----------
+    staged : dask.delayed.Delayed
+        Staged pipeline, as returned by `Pipeline.stage`
+
+    cols : iterable
+        List of keys to extract from the job results
+
+    client : distributed.Client (default: current client)
+
+    batch_size : int
+        Number of job results per `RecordBatch`
 
-    return pd.DataFrame(
-        dict(
-            (
-                key,
-                [
-                    i
-                    for i in glom(
-                        data, ([[Coalesce(*_nest(key, depth), default="?")]], flatten)
-                    )
-                ],
-            )
-            for key in cols
+    Yields
+    ------
+    pyarrow.RecordBatch
+
+    """
+    import pyarrow as pa
+    from distributed import as_completed, default_client
+
+    client = client if client is not None else default_client()
+    graph = dict(staged.__dask_graph__())
+    # every node in the pipeline graph is computed as a future; job
+    # submissions return a dictionary, or a list of dictionaries for packed
+    # jobs (one per packed job), the rest are lists of lists of results
+    futures = client.get(graph, list(graph), sync=False)
+
+    def _batch(rows):
+        return pa.RecordBatch.from_arrays(
+            [pa.array([row.get(key, None) for row in rows]) for key in cols], cols
         )
-    )
 
+    rows = []
+    for _, res in as_completed(futures, with_results=True):
+        if isinstance(res, Mapping):
+            rows.append(res)
+        elif isinstance(res, list) and res and all(isinstance(i, Mapping) for i in res):
+            rows.extend(res)
+        else:
+            continue
+        if len(rows) >= batch_size:
+            yield _batch(rows)
+            rows = []
+    if rows:
+        yield _batch(rows)
+
+
+class FrozenDict(Mapping):
+    """Immutable dictionary, see `freeze`
+
+    Changes are made on a copy with `FrozenDict.override`; the copy shares
+    all values that are not overridden with the original, so it is cheap
+    even for large nested options.
+
+    >>> opts = freeze({"gatk": {"nprocs": 4}, "inputs": [{"bam": "foo.bam"}]})
+    >>> opts["gatk"]["nprocs"] = 8
+    Traceback (most recent call last):
+      ...
+    TypeError: 'FrozenDict' object does not support item assignment
+    >>> new = opts.override(gatk=opts["gatk"].override(nprocs=8))
+    >>> new["gatk"]["nprocs"], opts["gatk"]["nprocs"]
+    (8, 4)
+    >>> new["inputs"] is opts["inputs"]
+    True
+
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, *args, **kwargs):
+        self._data = dict((k, freeze(v)) for k, v in dict(*args, **kwargs).items())
 
-def add_class_property(cls, prop):
-    """Dynamically add a property and a setter that does deepcopy.
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return repr(self._data)
+
+    # immutable: copies are not needed
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def override(self, *args, **kwargs):
+        """Return a copy with some keys replaced (same arguments as `dict`)"""
+        res = FrozenDict.__new__(FrozenDict)
+        res._data = dict(self._data)
+        res._data.update((k, freeze(v)) for k, v in dict(*args, **kwargs).items())
+        return res
+
+
+class FrozenList(Sequence):
+    """Immutable list, see `freeze`
+
+    Unlike a tuple, it is not mistaken for a set of parallel tasks in a
+    pipeline graph.
+
+    """
+
+    __slots__ = ("_data",)
+
+    def __init__(self, iterable=()):
+        self._data = tuple(freeze(i) for i in iterable)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            res = FrozenList.__new__(FrozenList)
+            res._data = self._data[idx]
+            return res
+        return self._data[idx]
+
+    def __len__(self):
+        return len(self._data)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, FrozenList)):
+            return list(self._data) == list(other)
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self._data))
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze(obj):
+    """Convert nested dictionaries and lists to immutable equivalents
+
+    Dictionaries become `FrozenDict`, lists become `FrozenList`, tuples and
+    sets are frozen element-wise; other values are returned as is.  Frozen
+    objects are returned as is, so freezing again is free.
+
+    >>> graph = freeze([("foo", ["bar", "baz"]), "whaat"])
+    >>> graph
+    [('foo', ['bar', 'baz']), 'whaat']
+    >>> freeze(graph) is graph
+    True
+
+    """
+    if isinstance(obj, (FrozenDict, FrozenList, str, bytes)):
+        return obj
+    elif isinstance(obj, Mapping):
+        return FrozenDict(obj)
+    elif isinstance(obj, list):
+        return FrozenList(obj)
+    elif isinstance(obj, tuple):
+        return tuple(freeze(i) for i in obj)
+    elif isinstance(obj, (set, frozenset)):
+        return frozenset(freeze(i) for i in obj)
+    return obj
+
+
+def thaw(obj):
+    """Convert frozen objects back to (mutable) dictionaries and lists
+
+    >>> thaw(freeze({"pipeline": [("foo", ["bar"])]}))
+    {'pipeline': [('foo', ['bar'])]}
+
+    """
+    if isinstance(obj, Mapping):
+        return dict((k, thaw(v)) for k, v in obj.items())
+    elif isinstance(obj, (list, FrozenList)):
+        return [thaw(i) for i in obj]
+    elif isinstance(obj, tuple):
+        return tuple(thaw(i) for i in obj)
+    elif isinstance(obj, frozenset):
+        return set(thaw(i) for i in obj)
+    return obj
+
+
+def add_class_property(cls, prop, convert=deepcopy):
+    """Dynamically add a property and a setter that converts the value.
+
+    By default the value is deep copied, so that the object does not share
+    mutable state with the caller; with `convert=freeze` the value is frozen
+    instead (see `freeze`), which avoids copying large nested values.
 
     Note: a deleter is not defined, so if your property needs special care to
     delete, please do not use this helper function.
@@ -133,7 +364,7 @@ def add_class_property(cls, prop):
         return getattr(self, f"_{prop}", None)
 
     def _setter(self, val):
-        setattr(self, f"_{prop}", deepcopy(val))
+        setattr(self, f"_{prop}", convert(val))
 
     _prop = property(_getter, _setter, None, f"Property {prop}")
     setattr(cls, prop, _prop)
@@ -165,6 +396,112 @@ def contents(jobid, logdir):
     return matches[0].read_text()
 
 
+def tail(path, nbytes=4096):
+    """Read the last lines of a file, without reading the whole file
+
+    The file is read backwards from the end in blocks of `nbytes`, until at
+    least one complete line has been read.  A partial leading line is
+    dropped.
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to the file
+
+    nbytes : int
+        Block size to read at a time
+
+    Returns
+    -------
+    str
+        The last lines of the file
+
+    """
+    with open(path, "rb") as f:
+        size = f.seek(0, os.SEEK_END)
+        offset, buf = size, b""
+        while offset > 0:
+            offset = max(offset - nbytes, 0)
+            f.seek(offset)
+            buf = f.read(size - offset)
+            # a newline before the last line => last line is complete
+            if buf.rstrip(b"\n").find(b"\n") >= 0:
+                break
+    if offset > 0:
+        buf = buf[buf.index(b"\n") + 1 :]
+    return buf.decode(errors="replace")
+
+
+class LogIndex(object):
+    """Index of job logs in a log directory
+
+    The log directory is scanned once, and log files matching the pattern
+    '*.o<jobid>' are indexed by job id.  Job statuses are read from the end
+    of the log files concurrently (see `job_status`).
+
+    Parameters
+    ----------
+    logdir : str or Path
+        Log directory as a relative or absolute path
+
+    Examples
+    --------
+    >>> index = LogIndex("/path/to/logs")  # doctest: +SKIP
+    >>> index.status([1234, 1235])  # doctest: +SKIP
+    [True, False]
+
+    """
+
+    pattern = re.compile(r"\.o(?P<jobid>[0-9.]+)$")
+
+    def __init__(self, logdir):
+        self.logdir = Path(logdir).absolute()
+        self.files = {}
+        for entry in os.scandir(self.logdir):
+            match = self.pattern.search(entry.name)
+            if match:
+                self.files[match.group("jobid")] = entry.path
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, jobid):
+        return str(jobid) in self.files
+
+    def get(self, jobid, default=None):
+        """Path to the log file of a job, or `default` if there is none"""
+        return self.files.get(str(jobid), default)
+
+    def _status(self, jobid):
+        path = self.get(jobid)
+        if path is None:
+            return None
+        try:
+            return job_status(tail(path))
+        except (AttributeError, IndexError):  # incomplete log
+            return None
+
+    def status(self, jobids, nthreads=16):
+        """Return the status of jobs, `None` if the log is missing or incomplete
+
+        Parameters
+        ----------
+        jobids : iterable
+            Job ids
+
+        nthreads : int
+            Number of log files read concurrently
+
+        Returns
+        -------
+        list
+            Job statuses (see `job_status`)
+
+        """
+        with ThreadPoolExecutor(nthreads) as executor:
+            return [i for i in executor.map(self._status, jobids)]
+
+
 def job_status(log):
     """Return job status by parsing log files
 
@@ -196,6 +533,41 @@ def job_status(log):
     return status == "finished"
 
 
+def fingerprint(path, method="stat"):
+    """Fingerprint a file to detect changes
+
+    Parameters
+    ----------
+    path : str or Path
+        Path to the file
+
+    method : str (default: "stat")
+        "stat" uses the file size and modification time, which is cheap;
+        "hash" uses a SHA256 digest of the file contents, which is robust
+        against touched but unchanged files, but has to read the whole file.
+
+    Returns
+    -------
+    str or None
+        The fingerprint, or `None` if the file does not exist
+
+    """
+    path = Path(path)
+    try:
+        if method == "stat" or (method == "hash" and path.is_dir()):
+            stat = path.stat()
+            return f"{stat.st_size}:{stat.st_mtime_ns}"
+        elif method == "hash":
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    digest.update(chunk)
+            return digest.hexdigest()
+    except FileNotFoundError:
+        return None
+    raise ValueError(f"Unknown fingerprint method: {method}")
+
+
 def read_config(filename):
     """Read pipeline config file
 
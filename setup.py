@@ -8,11 +8,11 @@ setup(
     license="GPLv3",
     python_requires="~=3.6",
     install_requires=[
-        "dask",
-        "distributed",
+        "dask>=2022.02.0",
+        "distributed>=2022.02.0",
         "glom>=19",
         "pandas>=0.24",
-        "pyarrow>=0.12",
+        "pyarrow>=4.0",
         "pysam",
         "jinja2",
     ],
@@ -0,0 +1,77 @@
+import stat
+
+import pandas as pd
+import pytest
+
+from genomegenie.batch.accounting import as_options, parse_qacct, recommend, usage
+
+_qacct_ = """
+==============================================================
+qname        all.q
+hostname     node1
+jobnumber    {jobid}
+slots        4
+ru_wallclock {wallclock}s
+cpu          {cpu}s
+maxvmem      {maxvmem}
+"""
+
+
+def test_parse_qacct():
+    out = _qacct_.format(jobid=1, wallclock=100, cpu=350.5, maxvmem="2.000G")
+    out += _qacct_.format(jobid=2, wallclock=10, cpu=1, maxvmem="512.000M")
+    res = parse_qacct(out)
+    assert sorted(res) == ["1", "2"]
+    assert res["1"] == {
+        "maxvmem": 2 * 2 ** 30,
+        "wallclock": 100,
+        "cpu": 350.5,
+        "slots": 4,
+    }
+    assert res["2"]["maxvmem"] == 2 ** 29
+    assert parse_qacct("error: job id 3 not found") == {}
+
+
+@pytest.fixture
+def qacct(tmp_path):
+    """Fake qacct: job 404 is not found, others use 1 GB and 2 cores"""
+    script = tmp_path / "qacct"
+    record = _qacct_.format(
+        jobid="$2", wallclock="$(( $2 * 10 ))", cpu="$(( $2 * 20 ))", maxvmem="1.000G"
+    )
+    script.write_text(
+        "#!/bin/bash\n"
+        '[ "$2" = 404 ] && { echo "error: job id $2 not found" >&2; exit 1; }\n'
+        f"cat <<EOF\n{record}EOF\n"
+    )
+    script.chmod(script.stat().st_mode | stat.S_IEXEC)
+    return f"{script} -j"
+
+
+def test_usage(qacct):
+    df = usage(["1", "2.1", "2.2", "404"], command=qacct)
+    assert list(df.jobid) == ["1", "2.1", "2.2", "404"]
+    assert list(df.wallclock[:3]) == [10, 20, 20]  # packed jobs share the usage
+    assert all(df.maxvmem[:3] == 2 ** 30)
+    assert df.iloc[3][["maxvmem", "wallclock", "cpu"]].isnull().all()
+
+
+def test_recommend():
+    df = pd.DataFrame(
+        {
+            "task": ["gatk"] * 10 + ["muse"] * 2 + ["broken"],
+            "maxvmem": [i * 1e9 for i in range(1, 11)] + [1e6] * 2 + [None],
+            "wallclock": [i * 3600 for i in range(1, 11)] + [60] * 2 + [None],
+            "cpu": [i * 4 * 3600 for i in range(1, 11)] + [60] * 2 + [None],
+        }
+    )
+    rec = recommend(df, quantile=0.9, headroom=1)
+    assert list(rec.index) == ["gatk", "muse"]  # no usage: no recommendation
+    assert rec.loc["gatk"].tolist() == [10, "9.1 GB", "09:06:00", 4]
+    assert rec.loc["muse"].tolist() == [2, "0.1 GB", "00:10:00", 1]  # minimum
+
+    opts = as_options(rec)
+    assert opts["gatk"] == {
+        "nprocs": 4,
+        "sge": {"memory": "9.1 GB", "walltime": "09:06:00"},
+    }
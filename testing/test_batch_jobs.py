@@ -1,17 +1,20 @@
 import os
+import pickle
 import pytest
 import shlex
 from time import sleep
 from datetime import datetime
 from itertools import product
 from collections import namedtuple
+from types import SimpleNamespace
 
 import numpy as np
 import dask
 from dask.distributed import Client
 
 from genomegenie.batch.jobs import Pipeline
-from genomegenie.utils import results
+from genomegenie.batch.state import JobStore
+from genomegenie.utils import results, stream_results, thaw
 
 from .test_batch_factory import _test_tmpl_dir_
 
@@ -71,6 +74,40 @@ def test_pipeline_stage_par(pipeline_results):
     assert all(i > j for i, j in product(t2, t1))
 
 
+def test_stream_results():
+    graph = [("foo", "bar"), "baz"]
+
+    @dask.delayed
+    def submit(job, monitor_t, *args):
+        return {"name": job, "jobid": len(args)}
+
+    with Client(processes=False) as client:
+        staged = Pipeline.stage(graph, lambda key: [key], submit)
+        batches = [i for i in stream_results(staged, ["name", "jobid"], client, 2)]
+
+    assert [i.num_rows for i in batches] == [2, 1]
+    names = [name for i in batches for name in i.column(0).to_pylist()]
+    assert sorted(names) == ["bar", "baz", "foo"]
+
+
+def test_stream_results_packed():
+    graph = [("foo", "bar"), "baz"]
+
+    @dask.delayed
+    def submit(job, monitor_t, *args):
+        # a packed job returns a result per packed job
+        if job == "foo":
+            return [{"name": f"foo{i}", "jobid": 1} for i in range(3)]
+        return {"name": job, "jobid": 2}
+
+    with Client(processes=False) as client:
+        staged = Pipeline.stage(graph, lambda key: [key], submit)
+        batches = [i for i in stream_results(staged, ["name", "jobid"], client)]
+
+    names = [name for i in batches for name in i.column(0).to_pylist()]
+    assert sorted(names) == ["bar", "baz", "foo0", "foo1", "foo2"]
+
+
 @pytest.fixture(scope="module")
 def pipeline():
     opts = {
@@ -122,12 +159,80 @@ def test_pipeline_process(pipeline):
     assert len(jobs) == len(opts["test_override"]["inputs"])
 
     # task specific module override
-    pipeline.options["test_regular"]["module"] = ["mypkg"]
+    task_opts = pipeline.options["test_regular"].override(module=["mypkg"])
+    pipeline.options = pipeline.options.override(test_regular=task_opts)
     jobs = pipeline.process("test_regular")
     assert jobs[0].script.find("mypkg")
     assert all([i not in jobs[0].script for i in pipeline.options["module"]])
 
 
+def test_pipeline_task_backend_opts(pipeline):
+    # task specific resource requests override the backend options
+    opts = pipeline.options
+    sge = {"memory": "2 GB", "walltime": "01:00:00"}
+    task_opts = opts["test_regular"].override(sge=sge)
+    pipeline.options = opts.override(test_regular=task_opts)
+    try:
+        job = pipeline.process("test_regular")[0]
+    finally:
+        pipeline.options = opts
+    assert job.memory == 2 * 10 ** 9
+    assert "h_rt=01:00:00" in job.job_header
+    assert job.log_directory == pipeline.options["sge"]["log_directory"]
+
+
+def test_pipeline_options_frozen(pipeline):
+    opts = pipeline.options
+    with pytest.raises(TypeError):
+        opts["test_regular"]["nprocs"] = 1
+    with pytest.raises(TypeError):
+        opts["inputs"][0]["normal_bam"] = "foo.bam"
+
+    # isolated from the caller, and cheap to clone: nothing is copied
+    raw = {**thaw(opts), "pipeline": [("test_all", "test_regular")]}
+    clone = Pipeline(raw)
+    raw["inputs"].append({"normal_bam": "normal4.bam"})
+    raw["pipeline"][0] = "test_all"
+    assert len(clone.inputs) == 3
+    assert clone.graph == [("test_all", "test_regular")]
+    assert Pipeline(clone.options).options["inputs"] is clone.options["inputs"]
+
+
+def test_pipeline_skip_finished(pipeline, tmp_path):
+    job = pipeline.process("test_regular")[0]
+    pipeline.store = JobStore(tmp_path / "state.db")
+    pipeline.store.record(job.digest, "test_regular", 1234, "finished")
+    try:
+        # no qsub here, would raise if the job was submitted
+        res = pipeline.submit(job, 0).compute()
+    finally:
+        pipeline.store = None
+    assert res["jobid"] == "1234"
+    assert res["status"] == "skipped"
+
+    # identical jobs have identical digests, different inputs do not
+    jobs = pipeline.process("test_regular")
+    assert jobs[0].digest == job.digest
+    assert jobs[1].digest != job.digest
+
+
+def test_pipeline_usage(pipeline):
+    pipeline = Pipeline(pipeline.options, backend="local")
+    job = dict(task="test_regular", submitted=1.0, started=None, maxvmem=10)
+    res = [
+        # finished before monitoring noticed it started
+        [dict(job, jobid="1", ended=2.0, status="finished")],
+        [
+            dict(job, jobid="2", ended=2.0, status="skipped"),
+            dict(job, jobid="3", ended=None, status="submitted"),
+            dict(job, jobid="4", started=1.5, ended=2.0, status="failed"),
+        ],
+    ]
+    usage = pipeline.usage(res)
+    assert list(usage.jobid) == ["1", "4"]
+    assert list(usage.maxvmem) == [10, 10]
+
+
 @pytest.mark.parametrize(
     "cmd, raise_on_err",
     [
@@ -150,3 +255,180 @@ def test_pipeline_call(cmd, raise_on_err):
     out, err = Pipeline._call(cmd, raise_on_err)
     assert out
     assert not err
+
+
+def test_pipeline_sources_targets(pipeline):
+    opts = pipeline.options
+    targets = ["{{ normal_bam | path_transform(output) | bam2vcf }}"]
+    task_opts = opts["test_regular"].override(targets=targets)
+    pipeline.options = opts.override(test_regular=task_opts)
+    try:
+        jobs = pipeline.process("test_regular")
+    finally:
+        pipeline.options = opts
+    # default sources: the input files
+    assert jobs[0].sources == ["normal1.bam", "tumor1.bam"]
+    assert jobs[0].targets == ["result.vcf.gz/normal1.vcf"]
+
+
+def test_pipeline_monitor(pipeline):
+    opts = dict(pipeline.options, pipeline=["test_regular"])
+    debug_pipeline = Pipeline(opts)
+    debug_pipeline.debug = True
+    debug_pipeline.tmpl_dir = _test_tmpl_dir_
+
+    with Client(processes=False) as client:
+        staged = debug_pipeline.stage(
+            debug_pipeline.graph, debug_pipeline.process, debug_pipeline.submit, 0
+        )
+        future, events = debug_pipeline.monitor(staged, client, poll=0.1)
+        events = [i for i in events]
+        res = future.result()
+
+    njobs = len(opts["inputs"])
+    assert len(events) == 3 * njobs
+    for status in ("submitted", "running", "finished"):
+        assert njobs == len([i for i in events if i.status == status])
+    df = results(res, ["submitted", "started", "ended"])
+    assert all(df.submitted <= df.started) and all(df.started <= df.ended)
+
+
+def test_pipeline_emit_no_cluster(pipeline):
+    # outside a dask cluster, events are only noted in the job result
+    job = SimpleNamespace(_template="test_regular", name="test_regular-1")
+    res = {"jobid": 1}
+    pipeline._emit("running", job, res)
+    assert res["started"] > 0
+
+
+@pytest.mark.parametrize("processes", [False, True])
+def test_pipeline_prepare(pipeline, processes):
+    graph = [("test_all", "test_regular"), "test_override"]
+    opts = dict(pipeline.options, pipeline=graph)
+    bulk_pipeline = Pipeline(opts)
+    bulk_pipeline.debug = True
+    bulk_pipeline.tmpl_dir = _test_tmpl_dir_
+
+    table = bulk_pipeline.job_table()
+    assert len(table) == 1 + len(opts["inputs"]) + 1
+    override = table[table.task == "test_override"]
+    assert override.depends.iloc[0] == ["test_all", "test_regular"]
+
+    jobs = bulk_pipeline.render(table, processes=processes)
+    assert [len(jobs[task]) for task in ("test_all", "test_regular")] == [1, 3]
+    expected = pipeline.process("test_regular")[0]
+    assert jobs["test_regular"][0].job_cmd == expected.job_cmd
+
+    staged = bulk_pipeline.prepare(monitor_t=0)
+    res = staged.compute(scheduler="threads")
+    timings = results(res, ["task", "name", "submitted", "started", "ended"])
+    assert 5 == len(timings)
+    assert all(timings.name.str.startswith(tuple(timings.task)))
+    assert all(timings.submitted <= timings.ended)
+    assert bulk_pipeline.time_to_first_submit(res) > 0
+    assert bulk_pipeline.metrics["njobs"] == 5
+
+
+def test_pipeline_dedup(pipeline):
+    # the same task in two branches: identical jobs are submitted once
+    graph = [("test_regular", ["test_all", "test_regular"]), "test_override"]
+    calls = []
+
+    @dask.delayed
+    def submit(job, monitor_t, *args):
+        calls.append(job.name)
+        return {"name": job.name}
+
+    staged = pipeline.stage(graph, pipeline.process, submit, 0)
+    res = staged.compute(scheduler="threads")
+    njobs = len(pipeline.options["inputs"])
+    assert len(calls) == len(set(calls)) == njobs + 1 + 1
+    names = results(res, ["name"]).name
+    assert len(names) == 2 * njobs + 1 + 1
+    assert set(names) == set(calls)
+
+
+def test_pipeline_dedup_upstream(pipeline):
+    waits = {}
+
+    @dask.delayed
+    def submit(job, monitor_t, *args):
+        waits[job.name] = set(results(list(args), ["name"]).name) if args else set()
+        return {"name": job.name}
+
+    def upstream(graph):
+        waits.clear()
+        pipeline.stage(graph, pipeline.process, submit, 0).compute(scheduler="threads")
+        return dict(
+            (task, set.union(*[waits[job.name] for job in pipeline.process(task)]))
+            for task in ("test_all", "test_regular", "test_override")
+            if pipeline.process(task)[0].name in waits
+        )
+
+    names = dict(
+        (task, set(job.name for job in pipeline.process(task)))
+        for task in ("test_all", "test_regular", "test_override")
+    )
+
+    # duplicates with different parents: the job waits for all of them
+    deps = upstream([("test_regular", ["test_all", "test_regular"]), "test_override"])
+    assert deps["test_regular"] == names["test_all"]
+    assert deps["test_override"] == names["test_regular"]
+
+    # the parents of a repeated task wait for their own parents
+    deps = upstream((["test_regular"], ["test_all", "test_override", "test_regular"]))
+    assert deps["test_all"] == set()
+    assert deps["test_override"] == names["test_all"]
+    assert deps["test_regular"] == names["test_override"]
+
+    for graph in [
+        [("test_all", "test_regular"), ["test_regular", "test_all"]],
+        ["test_all", "test_regular", "test_override", "test_regular"],
+    ]:
+        with pytest.raises(ValueError, match="Circular"):
+            pipeline.stage(graph, pipeline.process, submit, 0)
+
+
+def test_pipeline_script_dir(pipeline, tmp_path):
+    job = pipeline.process("test_regular")[0]
+    assert job.name == pipeline.process("test_regular")[0].name
+    pipeline.script_dir = tmp_path / "scripts"
+    try:
+        with pipeline.job_file(job.script) as fn1:
+            pass
+        with pipeline.job_file(job.script) as fn2:
+            pass
+    finally:
+        pipeline.script_dir = None
+    assert fn1 == fn2
+    assert open(fn1).read() == job.script
+    assert 1 == len(list((tmp_path / "scripts").iterdir()))
+
+
+def test_pipeline_plan(pipeline, tmp_path):
+    graph = [("test_all", "test_regular"), "test_override"]
+    opts = dict(pipeline.options, pipeline=graph)
+    opts["test_regular"] = dict(opts["test_regular"], pack=2)
+    compiled = Pipeline(opts)
+    compiled.tmpl_dir = _test_tmpl_dir_
+    compiled.compile(tmp_path / "plan.parquet")
+
+    loaded = Pipeline.from_plan(tmp_path / "plan.parquet")
+    assert loaded.graph == graph
+    assert loaded.options["sge"] == opts["sge"]
+    for task in ("test_all", "test_regular", "test_override"):
+        expected, jobs = compiled.process(task), loaded.process(task)
+        assert [i.script for i in jobs] == [i.script for i in expected]
+        assert [i.digest for i in jobs] == [i.digest for i in expected]
+    packed = loaded.process("test_regular")
+    assert [len(i.jobs) for i in packed] == [2, 1]
+    assert packed[0].jobs[1].sources == ["normal2.bam", "tumor2.bam"]
+
+    # the plan is not shipped to workers
+    assert pickle.loads(pickle.dumps(loaded)).plan is None
+
+    loaded.debug = True
+    staged = loaded.prepare(monitor_t=0)
+    res = staged.compute(scheduler="threads")
+    assert loaded.metrics["njobs"] == 5
+    assert 5 == len(results(res, ["jobid"]))
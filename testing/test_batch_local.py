@@ -0,0 +1,131 @@
+import shutil
+import threading
+import time
+
+from genomegenie.batch.jobs import Pipeline
+from genomegenie.batch.local import LocalExecutor
+from genomegenie.batch.state import JobStore
+from genomegenie.utils import records, results, LogIndex
+
+from .test_batch_factory import _test_tmpl_dir_
+
+
+def test_executor_reserve():
+    executor = LocalExecutor(nprocs=2, memory=100)
+    running, peak = [0], [0]
+    lock = threading.Lock()
+
+    def job(nprocs, memory):
+        with executor.reserve(nprocs, memory):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            time.sleep(0.1)
+            with lock:
+                running[0] -= 1
+
+    # 2 cores, 100 bytes: at most 2 single core jobs, or 1 large memory job
+    for jobs, expected in [([(1, 10)] * 4, 2), ([(1, 60)] * 3, 1), ([(4, 0)], 1)]:
+        peak[0] = 0
+        threads = [threading.Thread(target=job, args=i) for i in jobs]
+        [i.start() for i in threads]
+        [i.join() for i in threads]
+        assert peak[0] == expected
+    assert executor._free == {"nprocs": 2, "memory": 100}
+
+
+def test_pipeline_local(tmp_path):
+    opts = {
+        "pipeline": ["test_override"],
+        "module": ["pkg1"],
+        "inputs": [],
+        "test_override": {
+            "inputs": [{"ajob": "foo.vcf"}, {"ajob": "bar.vcf"}],
+            "output": "baz.parquet",
+        },
+        "local": {"log_directory": str(tmp_path), "memory": "1 MB"},
+    }
+    pipeline = Pipeline(opts, backend="local")
+    pipeline.tmpl_dir = _test_tmpl_dir_
+    staged = pipeline.stage(pipeline.graph, pipeline.process, pipeline.submit, 0)
+    res = staged.compute(scheduler="threads")
+    df = results(res, ["jobid"])
+
+    # the template ignores the inputs: identical scripts, run once
+    index = LogIndex(tmp_path)
+    assert 1 == len(index)
+    assert 2 == len(df) and 1 == df.jobid.nunique()
+    assert all(index.status(df.jobid))
+
+    usage = pipeline.usage(res)
+    assert list(usage.task) == ["test_override"] * 2
+    assert all(usage.maxvmem > 0) and all(usage.wallclock > 0)
+
+
+def test_pipeline_local_packed(tmp_path, monkeypatch):
+    opts = {
+        "pipeline": ["test_override"],
+        "module": ["pkg1"],
+        "inputs": [],
+        "test_override": {
+            "inputs": [{"ajob": f"{i}.vcf"} for i in range(3)],
+            "output": "baz.parquet",
+            "pack": 2,
+            "pack_nprocs": 2,
+        },
+        "local": {"log_directory": str(tmp_path), "memory": "1 MB"},
+    }
+    # distinct jobs, so that each has a record in the job store
+    tmpl_dir = tmp_path / "templates"
+    shutil.copytree(_test_tmpl_dir_, tmpl_dir)
+    (tmpl_dir / "test_override").write_text("echo processing: {{ ajob }}\n")
+    pipeline = Pipeline(opts, backend="local")
+    pipeline.tmpl_dir = str(tmpl_dir)
+    jobs = pipeline.process("test_override")
+    assert [len(i.jobs) for i in jobs] == [2, 1]
+    # memory for the jobs that run concurrently
+    assert [i.memory for i in jobs] == [2 * 10 ** 6, 10 ** 6]
+
+    reserved = []
+    reserve = LocalExecutor.reserve
+
+    def _reserve(self, nprocs, memory):
+        reserved.append(memory)
+        return reserve(self, nprocs, memory)
+
+    monkeypatch.setattr(LocalExecutor, "reserve", _reserve)
+    pipeline.store = JobStore(tmp_path / "state.db")
+    staged = pipeline.stage(pipeline.graph, pipeline.process, pipeline.submit, 0)
+    res = staged.compute(scheduler="threads")
+    df = results(res, ["jobid", "script"])
+    assert 3 == len(df)
+    assert all(df.jobid.str.endswith((".1", ".2")))
+
+    index = LogIndex(tmp_path)
+    assert 5 == len(index)  # 2 packed jobs, 3 jobs
+    assert all(index.status(df.jobid))
+    packs = df.jobid.str.split(".").str[0]
+    assert packs[0] == packs[1] != packs[2]
+    assert sorted(reserved) == [10 ** 6, 2 * 10 ** 6]
+
+    # a store record per packed job, under its own job id
+    recs = pipeline.store.records()
+    assert sorted(i["jobid"] for i in recs) == sorted(df.jobid)
+    assert all(i["status"] == "finished" for i in recs)
+    pipeline.store.update_status(df.jobid, [False] * 3)
+    assert all(i["status"] == "failed" for i in pipeline.store.records())
+    pipeline.store.update_status(df.jobid, [True] * 3)
+
+    # the pack's usage is shared by its jobs
+    usage = pipeline.usage(res).set_index("jobid")
+    pack = [i for i in records(res) if i["jobid"] == df.jobid[0]][0]
+    assert usage.maxvmem[df.jobid[0]] == pack["maxvmem"] / 2
+    assert usage.cpu[df.jobid[0]] == pack["cpu"] / 2
+    single = [i for i in records(res) if i["jobid"] == df.jobid[2]][0]
+    assert usage.maxvmem[df.jobid[2]] == single["maxvmem"]
+
+    # finished jobs are skipped in the next run
+    res = staged.compute(scheduler="threads")
+    again = results(res, ["jobid", "status"])
+    assert all(again.status == "skipped")
+    assert list(again.jobid) == list(df.jobid)
@@ -0,0 +1,98 @@
+import os
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from genomegenie import utils
+from genomegenie.batch.state import JobStore, up_to_date
+
+
+@pytest.fixture
+def store(tmp_path):
+    return JobStore(tmp_path / "state.db")
+
+
+def test_jobstore_record(store):
+    assert store.get("abc") is None
+    assert not store.succeeded("abc")
+
+    store.record("abc", "gatk", 1234, "submitted", ["/path/to/out.vcf"])
+    rec = store.get("abc")
+    assert rec["jobid"] == "1234"
+    assert rec["outputs"] == ["/path/to/out.vcf"]
+    assert not store.succeeded("abc")
+
+    store.record("abc", "gatk", 1234, "finished")
+    assert store.succeeded("abc")
+    assert 1 == len(store.records())
+
+
+def test_jobstore_migrate(tmp_path):
+    # store created before input fingerprints were recorded
+    path = tmp_path / "old.db"
+    with sqlite3.connect(str(path)) as conn:
+        conn.execute(
+            "CREATE TABLE jobs (digest TEXT PRIMARY KEY, task TEXT, jobid TEXT, "
+            "status TEXT, outputs TEXT, updated REAL)"
+        )
+        conn.execute(
+            "INSERT INTO jobs VALUES ('abc', 'gatk', '1', 'finished', '[]', 0)"
+        )
+    conn.close()
+    store = JobStore(path)
+    assert store.get("abc")["fingerprints"] is None
+    assert store.succeeded("abc", {"in.bam": "1:2"})
+    store.record("def", "gatk", 2, "finished", fingerprints={"in.bam": "1:2"})
+    assert store.get("def")["fingerprints"] == {"in.bam": "1:2"}
+
+
+def test_jobstore_update_status(store):
+    store.record("abc", "gatk", 1, "submitted")
+    store.record("def", "muse", 2, "submitted")
+    store.update_status(["1", "2"], [True, False])
+    assert store.succeeded("abc")
+    assert store.get("def")["status"] == "failed"
+
+
+def test_jobstore_bad_status(store):
+    with pytest.raises(ValueError, match="Unknown job status"):
+        store.record("abc", "gatk", 1, "running")
+
+
+def fake_job(tmp_path, fingerprint="stat"):
+    src, tgt = tmp_path / "sample.bam", tmp_path / "sample.vcf"
+    job = SimpleNamespace(digest="abc", sources=[str(src)], targets=[str(tgt)])
+    job.fingerprints = lambda: dict(
+        (i, utils.fingerprint(i, fingerprint)) for i in job.sources
+    )
+    return job, src, tgt
+
+
+def test_up_to_date_make(tmp_path):
+    job, src, tgt = fake_job(tmp_path)
+    src.write_text("reads")
+    assert not up_to_date(job)  # no outputs
+
+    tgt.write_text("variants")
+    os.utime(src, (0, 0))
+    assert up_to_date(job)
+
+    os.utime(tgt, (0, 0))
+    os.utime(src)
+    assert not up_to_date(job)  # input newer than output
+
+
+@pytest.mark.parametrize("method", ["stat", "hash"])
+def test_up_to_date_fingerprints(store, tmp_path, method):
+    job, src, tgt = fake_job(tmp_path, method)
+    src.write_text("reads")
+    tgt.write_text("variants")
+    os.utime(tgt, (0, 0))  # older than inputs, but fingerprints take precedence
+    store.record(job.digest, "gatk", 1, "finished", job.targets, job.fingerprints())
+    assert up_to_date(job, store)
+    assert store.succeeded(job.digest, job.fingerprints())
+
+    src.write_text("more reads")
+    assert not up_to_date(job, store)
+    assert not store.succeeded(job.digest, job.fingerprints())
@@ -0,0 +1,105 @@
+import pickle
+import subprocess
+import sys
+import time
+
+import pytest
+
+from genomegenie.batch.throttle import SubmitGovernor
+
+
+def test_governor_rate(tmp_path):
+    governor = SubmitGovernor(rate=20, burst=2, state_dir=tmp_path)
+    t0 = time.monotonic()
+    for i in range(6):
+        governor.acquire()
+    # 2 at once, then 1 every 50ms
+    assert time.monotonic() - t0 >= 0.2
+
+
+def test_governor_queue_depth(tmp_path):
+    queue = "printf 'job-ID prior name\\n------\\n 101 0.5 foo\\n 102 0.5 bar\\n'"
+    governor = SubmitGovernor(
+        max_jobs=3, queue_command=f"bash -c \"{queue}\"", state_dir=tmp_path
+    )
+    assert 2 == governor.queue_depth()
+    governor.acquire(poll=0.01)
+    assert 3 == governor.queue_depth()  # includes the pending submission
+
+    governor.refresh = 0  # queue depth is refreshed: back to 2
+    governor.acquire(poll=0.01)
+
+
+def test_governor_retry(tmp_path):
+    governor = SubmitGovernor(retries=2, backoff=0.01, state_dir=tmp_path)
+    calls = []
+
+    def submit():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RuntimeError("Unable to run job: job rejected: max_u_jobs limit")
+        return ("1234", "")
+
+    assert governor.submit(submit) == ("1234", "")
+    assert 3 == len(calls)
+
+    calls.clear()
+    governor.retries = 1
+    with pytest.raises(RuntimeError, match="max_u_jobs"):
+        governor.submit(submit)
+
+    def fail():
+        raise RuntimeError("Command exited with non-zero exit code")
+
+    with pytest.raises(RuntimeError, match="non-zero"):  # not retried
+        governor.submit(fail)
+
+    calls.clear()
+
+    def fail_memory():  # scheduler limits unrelated to the number of jobs
+        calls.append(1)
+        raise RuntimeError("Unable to run job: h_vmem exceeds the queue limit")
+
+    with pytest.raises(RuntimeError, match="h_vmem"):
+        governor.submit(fail_memory)
+    assert 1 == len(calls)
+    for msg in [
+        "job rejected: Only 100 jobs are allowed per user (current job count: 100)",
+        "job rejected: the maximal number of 5000 jobs per user is exceeded",
+        "qsub: Maximum number of jobs already in queue",
+        "Job violates accounting/QOS policy (QOSMaxSubmitJobPerUserLimit)",
+    ]:
+        assert governor.rejected.search(msg)
+
+
+def test_governor_shared(tmp_path):
+    governor = SubmitGovernor(
+        max_jobs=10, rate=1, queue_command="true", state_dir=tmp_path
+    )
+    # copies, like the ones dask ships to workers, share the state
+    other = pickle.loads(pickle.dumps(governor))
+    assert other.max_jobs == 10
+    assert other.state_file == governor.state_file
+    governor.acquire()
+    assert 1 == other.queue_depth()  # the pending submission
+    t0 = time.monotonic()
+    other.acquire()  # waits for a token
+    assert time.monotonic() - t0 >= 0.5
+    assert 2 == governor.queue_depth()
+
+    # a process shares the state too
+    script = (
+        "import pickle, sys; "
+        "governor = pickle.loads(sys.stdin.buffer.read()); "
+        "print(governor.queue_depth())"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", script],
+        input=pickle.dumps(governor),
+        stdout=subprocess.PIPE,
+        check=True,
+    )
+    assert b"2" == proc.stdout.strip()
+
+    # other limits, other state
+    assert SubmitGovernor(max_jobs=5, state_dir=tmp_path).state_file != other.state_file
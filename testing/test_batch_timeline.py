@@ -0,0 +1,85 @@
+import json
+
+import pandas as pd
+import pytest
+
+from genomegenie.batch.timeline import (
+    _order,
+    chrome_trace,
+    critical_path,
+    makespan,
+    schedule,
+    task_durations,
+)
+
+_graph_ = [("pon", "muse"), "gatk", "merge"]
+
+
+@pytest.fixture
+def timings():
+    # task, submitted, started, ended
+    rows = [
+        ("pon", 0, 10, 40),
+        ("pon", 0, 20, 50),
+        ("muse", 0, 5, 100),
+        ("gatk", 100, 110, 160),
+        ("gatk", 100, 110, 150),
+        ("merge", 160, 160, 170),
+        ("merge", None, None, 165),  # skipped
+    ]
+    df = pd.DataFrame(rows, columns=["task", "submitted", "started", "ended"])
+    return df.assign(
+        name=[f"{task}-{i}" for i, task in enumerate(df.task)], jobid=range(len(df))
+    )
+
+
+def test_schedule(timings):
+    durations = task_durations(timings)
+    assert durations.to_dict() == {"pon": 50, "muse": 100, "gatk": 60, "merge": 10}
+    assert task_durations(timings, "started").pon == 40
+
+    sched = schedule(_graph_, durations)
+    assert list(sched.index) == ["pon", "muse", "gatk", "merge"]
+    assert sched.slack.to_dict() == {"pon": 50, "muse": 0, "gatk": 0, "merge": 0}
+    assert critical_path(sched) == ["muse", "gatk", "merge"]
+    assert sched.earliest_finish.max() == 170
+
+    # muse in a parallel branch: pon is now on the critical path
+    sched = schedule([("muse", ["pon", "gatk"]), "merge"], durations)
+    assert critical_path(sched) == ["pon", "gatk", "merge"]
+    assert sched.slack.muse == 10
+
+    # a task waits for itself when it occurs twice: it does not wait again
+    assert list(schedule(["muse", "muse"], durations).index) == ["muse"]
+    with pytest.raises(ValueError, match="Circular"):
+        schedule([("muse", ["pon", "muse"]), "pon"], durations)
+    with pytest.raises(ValueError, match="Circular"):
+        _order({"pon": [], "muse": ["muse"]})
+
+
+def test_makespan(timings):
+    # run times: pon 30, 30; muse 95; gatk 50, 40; merge 10
+    assert makespan(_graph_, timings) == 95 + 50 + 10
+    assert makespan(_graph_, timings, parallelism=2) == 95 + 50 + 10
+    # muse first (longest path), then pon jobs one after the other
+    assert makespan(_graph_, timings, parallelism=1) == 95 + 60 + 90 + 10
+    assert makespan(["muse", "unknown"], timings) == 95
+
+
+def test_chrome_trace(timings, tmp_path):
+    sched = schedule(_graph_, task_durations(timings))
+    path = tmp_path / "trace.json"
+    chrome_trace(timings, path, sched)
+    with open(path) as trace:
+        events = json.load(trace)["traceEvents"]
+
+    running = [i for i in events if i["name"] != "queued"]
+    assert len(running) == len(timings)
+    muse = [i for i in running if i["name"] == "muse"][0]
+    assert muse["ts"] == 5e6 and muse["dur"] == 95e6
+    assert muse["args"]["critical"] and muse["args"]["slack"] == 0
+
+    # jobs on the same lane do not overlap
+    for lane in set(i["tid"] for i in events):
+        spans = sorted((i["ts"], i["ts"] + i["dur"]) for i in events if i["tid"] == lane)
+        assert all(i[1] <= j[0] for i, j in zip(spans, spans[1:]))
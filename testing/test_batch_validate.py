@@ -0,0 +1,46 @@
+import os
+from copy import deepcopy
+
+import pytest
+
+from genomegenie.batch.factory import TemplateIndex
+from genomegenie.batch.validate import validate, validate_pipeline, mandatory
+from genomegenie.utils import read_config
+
+
+@pytest.fixture
+def config():
+    return read_config("etc/pipeline-opts.py")
+
+
+def test_validate(config):
+    opts = {"tool": "gatk", "run_type": "somatic", "gatk": config["gatk"]}
+    with pytest.raises(ValueError, match="Missing mandatory option"):
+        validate(opts)  # input files are missing
+
+    opts["gatk"] = dict(**config["inputs"][0], **config["gatk"])
+    validate(opts)
+    assert mandatory("somatic").issubset(opts["gatk"])
+
+
+def test_validate_pipeline(config):
+    validate_pipeline(config)
+
+    config = deepcopy(config)
+    config["gatk"].pop("ref_fasta")
+    config["muse"].pop("db")
+    with pytest.raises(ValueError, match="gatk: ref_fasta") as err:
+        validate_pipeline(config)
+    assert "muse: db" in str(err.value)
+
+
+def test_template_index_invalidation(tmp_path):
+    tmpl = tmp_path / "foo"
+    tmpl.write_text("{{ bar }}")
+    os.utime(tmpl, (0, 0))
+    index = TemplateIndex(tmp_path)
+    assert index.mandatory("foo") == {"bar"}
+
+    tmpl.write_text("{{ bar }} {% if baz is defined %}{{ baz }}{% endif %}")
+    assert index.variables("foo") == {"bar", "baz"}
+    assert index.mandatory("foo") == {"bar"}
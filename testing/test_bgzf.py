@@ -0,0 +1,61 @@
+import gzip
+import random
+
+import pytest
+
+from genomegenie.bgzf import BgzfWriter, bgzf_block, chunks, read_chunk
+
+header = "##fileformat=VCFv4.2\n#CHROM\tPOS\tID\tREF\tALT\tQUAL\tFILTER\tINFO\n"
+
+
+@pytest.fixture(scope="module")
+def records():
+    rng = random.Random(42)
+    return [
+        f"1\t{i + 1}\trs{rng.randrange(10 ** 9)}\tA\tG\t{rng.randrange(100)}\tPASS"
+        f"\tDP={rng.randrange(500)}\n"
+        for i in range(20000)
+    ]
+
+
+@pytest.fixture
+def vcf(tmp_path, records):
+    path = tmp_path / "test.vcf.gz"
+    with BgzfWriter(path, threads=2) as out:
+        out.write(header.encode())
+        for i in range(0, len(records), 1000):
+            out.write("".join(records[i : i + 1000]).encode())
+    return path
+
+
+def test_bgzf_block():
+    data = b"chr1\t100\n" * 1000
+    block = bgzf_block(data)
+    assert block[12:16] == b"BC\x02\x00"
+    assert int.from_bytes(block[16:18], "little") == len(block) - 1
+    assert gzip.decompress(block) == data
+
+
+def test_writer(vcf, records):
+    with gzip.open(vcf, "rt") as f:
+        assert f.read() == header + "".join(records)
+
+
+@pytest.mark.parametrize("size", [5000, 30000, 2 ** 24])
+def test_chunks(vcf, records, size):
+    bounds = chunks(vcf, size)
+    assert bounds[0][0] == len(header)  # virtual offset in the first block
+    assert bounds[-1][1] is None
+    if size < vcf.stat().st_size:
+        assert len(bounds) > 1
+    parts = [read_chunk(vcf, i).decode() for i in bounds]
+    # every chunk has whole records, and every record is in one chunk
+    assert all(i.endswith("\n") and i.startswith("1\t") for i in parts)
+    assert "".join(parts) == "".join(records)
+
+
+def test_chunks_not_bgzf(tmp_path):
+    path = tmp_path / "test.vcf"
+    path.write_text(header)
+    with pytest.raises(ValueError, match="no BGZF block"):
+        chunks(path)
@@ -0,0 +1,70 @@
+import pyarrow.parquet as pq
+import pysam
+import pytest
+from dask.distributed import Client
+
+from genomegenie.convert import _stripes, regions, to_batches, vcf2parquet
+
+header = """##fileformat=VCFv4.2
+##contig=<ID=1,length=1000>
+##contig=<ID=2,length=500>
+##FILTER=<ID=PASS,Description="All filters passed">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM	POS	ID	REF	ALT	QUAL	FILTER	INFO	FORMAT	s1	s2
+"""
+
+records = [
+    "1	100	rs1	A	G	50	PASS	DP=10	GT	0|1	1|1",
+    # overlaps the boundary at 300
+    "1	298	rs2	CTTTT	C	20	PASS	DP=5	GT	0|0	0/1",
+    "1	600	rs3	C	T	20	PASS	DP=5	GT	0|0	1/1",
+    "2	50	.	G	A	30	PASS	DP=7	GT	./.	0|1",
+]
+
+
+@pytest.fixture
+def vcf(tmp_path):
+    path = tmp_path / "test.vcf"
+    path.write_text(header + "\n".join(records) + "\n")
+    return pysam.tabix_index(str(path), preset="vcf", force=True)
+
+
+def test_regions(vcf):
+    assert regions(vcf, 300, contigs=["2"]) == [("2", 0, 300), ("2", 300, 500)]
+    assert len(regions(vcf, 300)) == 6
+
+
+def test_stripes():
+    assert _stripes(5, ["a", "b"]) == [["a"], ["a"], ["a"], ["b"], ["b"]]
+    assert _stripes(2, []) == [None, None]
+
+
+def test_vcf2parquet(vcf, tmp_path):
+    outdir = tmp_path / "pq"
+    with Client(n_workers=2, threads_per_worker=1, processes=False) as client:
+        res = vcf2parquet(vcf, outdir, client, size=300)
+    assert [n for _, n in res] == [2, 1, 1]
+    assert res[0][0] == str(outdir / "1" / "000000000000.parquet")
+    table = pq.read_table(outdir)
+    assert table.column("POS").to_pylist() == [100, 298, 600, 50]
+    assert table.column("GT_s2").to_pylist()[-1] == [1, 0, 1]
+
+
+@pytest.fixture
+def unindexed(vcf, tmp_path):
+    path = tmp_path / "unindexed.vcf.gz"
+    with open(vcf, "rb") as src, open(path, "wb") as dst:
+        dst.write(src.read())
+    return path
+
+
+def test_vcf2parquet_chunks(unindexed, tmp_path):
+    outdir = tmp_path / "pq"
+    with Client(n_workers=2, threads_per_worker=1, processes=False) as client:
+        res = vcf2parquet(str(unindexed), outdir, client, contigs=["1"])
+        batches = to_batches(str(unindexed), client, chunk_size=100)
+    assert res == [(str(outdir / "chunk-000000.parquet"), 3)]
+    table = pq.read_table(outdir)
+    assert table.column("POS").to_pylist() == [100, 298, 600]
+    assert [pos for i in batches for pos in i.to_pydict()["POS"]] == [100, 298, 600, 50]
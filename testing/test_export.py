@@ -0,0 +1,119 @@
+import gzip
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pysam
+import pytest
+from dask.distributed import Client
+
+from genomegenie.convert import vcf2parquet
+from genomegenie.export import header_text, to_vcf, vcf_lines
+from genomegenie.schemas import get_header, read_header
+
+header = """##fileformat=VCFv4.2
+##FILTER=<ID=PASS,Description="All filters passed">
+##source=test
+##contig=<ID=1,length=1000>
+##contig=<ID=2,length=500>
+##FILTER=<ID=q10,Description="Low quality">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">
+##INFO=<ID=AF,Number=A,Type=Float,Description="Allele frequency">
+##INFO=<ID=DB,Number=0,Type=Flag,Description="dbSNP">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+##FORMAT=<ID=AD,Number=R,Type=Integer,Description="Allelic depths">
+#CHROM	POS	ID	REF	ALT	QUAL	FILTER	INFO	FORMAT	s1	s2
+"""
+
+records = [
+    "1	100	rs1	A	G,T	50	PASS	DP=10;AF=0.5,0.25;DB	GT:AD	0|1:3,4,0	1/2:0,2,2",
+    "1	298	rs2	CTTTT	C	20	q10	DP=5	GT	0|0	./.",
+    "1	600	rs3	C	T	.	.	.	GT:AD	0/0:5,.	1|1:.",
+    "2	50	.	G	A	30	PASS	AF=0.1	GT	.	0|1",
+]
+
+
+@pytest.fixture
+def vcf(tmp_path):
+    path = tmp_path / "test.vcf"
+    path.write_text(header + "\n".join(records) + "\n")
+    return pysam.tabix_index(str(path), preset="vcf", force=True)
+
+
+@pytest.fixture
+def dataset(vcf, tmp_path):
+    outdir = tmp_path / "pq"
+    with Client(n_workers=1, threads_per_worker=1, processes=False) as client:
+        vcf2parquet(vcf, outdir, client, size=300)
+    return outdir
+
+
+def _records(path):
+    with gzip.open(path, "rt") as vcf:
+        return [i.rstrip("\n") for i in vcf if not i.startswith("#")]
+
+
+def test_header_text(vcf, dataset):
+    with pysam.VariantFile(vcf) as vf:
+        hdr, samples = get_header(vf, drop_cols=None)
+    assert header_text(hdr, samples) == header
+    assert read_header(dataset / "_header.parquet")[1] == samples
+    # without descriptions, and samples
+    text = header_text(hdr.drop(columns=["Description"]), [])
+    assert '##INFO=<ID=DP,Number=1,Type=Integer,Description="">' in text
+    assert text.endswith("\tINFO\n")
+
+    # missing cells as NaN
+    hdr = pd.DataFrame(
+        {
+            "HeaderType": ["GENERIC", "GENERIC", "FILTER", "CONTIG"],
+            "ID": ["source", np.nan, "PASS", "1"],
+            "Number": [np.nan, np.nan, np.nan, np.nan],
+            "length": [np.nan, np.nan, np.nan, "1000"],
+            "Description": ["test", "orphan", '"All filters passed"', np.nan],
+        }
+    )
+    lines = header_text(hdr, []).splitlines()
+    assert lines[1:4] == [
+        "##source=test",
+        '##FILTER=<ID=PASS,Description="All filters passed">',
+        "##contig=<ID=1,length=1000>",
+    ]
+
+
+def test_vcf_lines():
+    gt = pa.array([[1, 0, 1], [0, None, None], None], pa.list_(pa.int8()))
+    batch = pa.RecordBatch.from_pydict(
+        {
+            "CHROM": ["1", "1", "2"],
+            "POS": pa.array([1, 2, 3], pa.int32()),
+            "ID": ["rs1", None, None],
+            "REF": ["A", "C", "G"],
+            "ALTS": [["T"], ["G", "A"], None],
+            "QUAL": pa.array([10, None, 1], pa.int8()),
+            "FILTER": [["PASS"], [], None],
+            "INFO_DP": pa.array([3, None, None], pa.int32()),
+            "FORMAT": [["GT"], ["GT"], ["GT", "DP"]],
+            "GT_s1": gt,
+        }
+    )
+    assert vcf_lines(batch, [("DP", "INFO_DP")], ["s1"]).to_pylist() == [
+        "1\t1\trs1\tA\tT\t10\tPASS\tDP=3\tGT\t0|1",
+        "1\t2\t.\tC\tG,A\t.\t.\t.\tGT\t./.",
+        "2\t3\t.\tG\t.\t1\t.\t.\tGT:DP\t.:.",
+    ]
+
+
+def test_to_vcf(dataset, tmp_path):
+    path = to_vcf(dataset, tmp_path / "out.vcf.gz", threads=2)
+    assert _records(path) == records
+    with pysam.VariantFile(path) as vf:
+        assert [r.pos for r in vf.fetch("1", 200, 700)] == [298, 600]
+
+    path = to_vcf(dataset, tmp_path / "sub.vcf.gz", ("1", 200, 1000), ["s2"])
+    assert _records(path) == [
+        "1	298	rs2	CTTTT	C	20	q10	DP=5	GT	./.",
+        "1	600	rs3	C	T	.	.	.	GT:AD	1|1:.",
+    ]
+    with pytest.raises(KeyError):
+        to_vcf(dataset, tmp_path / "none.vcf.gz", samples=["s3"])
@@ -0,0 +1,89 @@
+import os
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+pytestmark = pytest.mark.skipif(
+    sys.version_info < (3, 7), reason="-X importtime needs Python >= 3.7"
+)
+
+root = Path(__file__).parent.parent
+
+heavy = {"numpy", "pandas", "pyarrow", "pysam", "distributed", "glom", "pdb"}
+
+# entry point: (modules that should not be imported, cold start budget in ms);
+# the budgets are generous, so that they hold on a loaded machine
+budgets = {
+    "genomegenie": (heavy | {"jinja2", "dask"}, 100),
+    "genomegenie.cli": (heavy | {"jinja2", "dask"}, 150),
+    "genomegenie.batch.factory": (heavy | {"dask"}, 300),
+    "genomegenie.batch.validate": (heavy | {"dask"}, 300),
+    "genomegenie.batch.jobs": (heavy, 600),
+    "bin/debug-templates.py": (heavy | {"dask"}, 400),
+}
+
+
+def importtime(args):
+    """Modules imported, and the import time in ms (`python -X importtime`)
+
+    Modules imported at interpreter startup are not counted.
+
+    """
+    env = dict(os.environ, PYTHONPATH=str(root))
+
+    def _run(args):
+        proc = subprocess.run(
+            [sys.executable, "-X", "importtime"] + args,
+            cwd=str(root),
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+        assert proc.returncode == 0, proc.stderr
+        for line in proc.stderr.splitlines():
+            if not line.startswith("import time:") or "|" not in line:
+                continue
+            _, cumulative, name = line[len("import time:") :].split("|")
+            if not cumulative.strip().isdigit():  # header
+                continue
+            depth = (len(name) - len(name.lstrip()) - 1) // 2
+            yield name.strip(), depth, int(cumulative) / 1000
+
+    startup = set(name for name, _, _ in _run(["-c", "pass"]))
+    imported, total = set(), 0
+    for name, depth, ms in _run(args):
+        if name in startup:
+            continue
+        imported.add(name.split(".")[0])
+        if depth == 0:
+            total += ms
+    return imported, total
+
+
+@pytest.mark.parametrize("entry_point", list(budgets))
+def test_import_budget(entry_point):
+    if entry_point.endswith(".py"):
+        args = [entry_point, "--help"]
+    else:
+        args = ["-c", f"import {entry_point}"]
+    forbidden, budget = budgets[entry_point]
+    imported, total = importtime(args)
+    assert not imported & forbidden, f"{entry_point} imports {imported & forbidden}"
+    assert total < budget, f"{entry_point}: {total:.0f} ms (budget: {budget} ms)"
+
+
+def test_lazy_io():
+    script = (
+        "import sys, genomegenie; genomegenie.to_arrow; print('pysam' in sys.modules)"
+    )
+    proc = subprocess.run(
+        [sys.executable, "-c", script],
+        cwd=str(root),
+        env=dict(os.environ, PYTHONPATH=str(root)),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+    )
+    assert proc.stdout.strip() == "True"
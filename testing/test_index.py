@@ -0,0 +1,68 @@
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from genomegenie.index import VariantIndex, build_index, dataset_files
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    n = 40
+    for chrom in ["1", "2"]:
+        table = pa.table(
+            {
+                "CHROM": [chrom] * n,
+                "POS": list(range(100, 100 + 10 * n, 10)),
+                "ID": [f"rs{chrom}{i:03d}" if i % 7 else "." for i in range(n)],
+                "REF": ["A"] * n,
+            }
+        )
+        (tmp_path / chrom).mkdir()
+        pq.write_table(table, str(tmp_path / chrom / "0.parquet"), row_group_size=15)
+    # multiple IDs, and missing IDs
+    table = pa.table(
+        {
+            "CHROM": ["3", "3"],
+            "POS": [5, 6],
+            "ID": ["rs7;COSM1", None],
+            "REF": ["C", "G"],
+        }
+    )
+    pq.write_table(table, str(tmp_path / "3.parquet"))
+    return tmp_path
+
+
+def test_build_index(dataset):
+    index = build_index(dataset, row_group_size=8)
+    assert index.path == dataset / "_index"
+    assert [i.relative_to(dataset) for i in index.files] == [
+        i.relative_to(dataset) for i in dataset_files(dataset)
+    ]
+    # the dataset can still be read
+    assert pq.read_table(str(dataset)).num_rows == 82
+    ids = pq.read_table(str(index.path / "ids.parquet")).column("ID").to_pylist()
+    assert ids == sorted(ids) and "." not in ids and "COSM1" in ids
+
+
+def test_lookup(dataset):
+    build_index(dataset, row_group_size=8)
+    index = VariantIndex(dataset / "_index")
+
+    res = index.fetch_ids(["rs2013", "rs1001", "rs7", "rs999"], ["CHROM", "POS", "ID"])
+    assert res.to_pydict() == {
+        "CHROM": ["1", "2", "3"],
+        "POS": [110, 230, 5],
+        "ID": ["rs1001", "rs2013", "rs7;COSM1"],
+    }
+    assert index.ids(["COSM1"]).column("ID").to_pylist() == ["COSM1"]
+
+    res = index.fetch_positions([("2", 110), ("1", 490), ("3", 6), ("1", 111)])
+    assert list(zip(res["CHROM"].to_pylist(), res["POS"].to_pylist())) == [
+        ("1", 490),
+        ("2", 110),
+        ("3", 6),
+    ]
+    assert res.schema.names == ["CHROM", "POS", "ID", "REF"]
+
+    assert index.fetch_ids(["nope"], ["POS"]).num_rows == 0
+    assert index.positions([]).num_rows == 0
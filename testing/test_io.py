@@ -0,0 +1,107 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pysam
+import pytest
+
+from genomegenie.io import RegionCache, read_region
+
+header = """##fileformat=VCFv4.2
+##contig=<ID=1,length=1000>
+##contig=<ID=2,length=500>
+##FILTER=<ID=PASS,Description="All filters passed">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">
+##FORMAT=<ID=GT,Number=1,Type=String,Description="Genotype">
+#CHROM	POS	ID	REF	ALT	QUAL	FILTER	INFO	FORMAT	s1	s2
+"""
+
+records = [
+    "1	100	rs1	A	G	50	PASS	DP=10	GT	0|1	1|1",
+    "1	298	rs2	CTTTT	C	20	PASS	DP=5	GT	0|0	0/1",
+    "1	600	rs3	C	T	20	PASS	DP=5	GT	0|0	1/1",
+    "2	50	.	G	A	30	PASS	DP=7	GT	./.	0|1",
+]
+
+
+@pytest.fixture
+def vcf(tmp_path):
+    path = tmp_path / "test.vcf"
+    path.write_text(header + "\n".join(records) + "\n")
+    return pysam.tabix_index(str(path), preset="vcf", force=True)
+
+
+@pytest.fixture
+def dataset(tmp_path):
+    path = tmp_path / "variants"
+    for chrom, n in [("1", 50), ("2", 20)]:
+        table = pa.table({"CHROM": [chrom] * n, "POS": list(range(10, 10 * n + 1, 10))})
+        (path / chrom).mkdir(parents=True)
+        pq.write_table(table, str(path / chrom / "0.parquet"), compression="zstd")
+    return path
+
+
+def test_read_region(vcf, dataset):
+    table = read_region(vcf, ("1", 200, 1000), ["POS", "ID", "GT_s2"])
+    assert table.column_names == ["POS", "ID", "GT_s2"]
+    assert table.column("POS").to_pylist() == [298, 600]
+    assert read_region(vcf, ("2",)).column("ID").to_pylist() == [None]
+    assert read_region(vcf).num_rows == 4
+
+    assert read_region(dataset, ("1", 100, 150)).column("POS").to_pylist() == [
+        110,
+        120,
+        130,
+        140,
+        150,
+    ]
+    assert read_region(dataset, ("2",), ["POS"]).num_rows == 20
+
+
+def test_cache_read(tmp_path, dataset, vcf):
+    cache = RegionCache(tmp_path / "cache")
+    expected = read_region(dataset, ("1", 100, 200))
+    assert cache.read(dataset, ("1", 100, 200)).equals(expected)
+    [entry] = cache.path.glob("*.arrow")
+    os.utime(entry, ns=(0, 0))
+    table = cache.read(dataset, ("1", 100, 200))
+    assert table.equals(expected)
+    assert list(cache.path.glob("*.arrow")) == [entry]
+    assert entry.stat().st_mtime_ns > 0  # last use recorded
+
+    # zero copy: the columns point into the memory map, not the heap
+    before = pa.total_allocated_bytes()
+    cache.read(dataset, ("1", 100, 200))
+    assert pa.total_allocated_bytes() == before
+
+    assert cache.read(vcf, ("1", 0, 1000), ["POS"]).num_rows == 3
+    assert len(list(cache.path.glob("*.arrow"))) == 2
+
+
+def test_cache_invalidate(tmp_path, dataset):
+    cache = RegionCache(tmp_path / "cache")
+    assert cache.read(dataset, ("2",)).num_rows == 20
+    [stale] = cache.path.glob("*.arrow")
+    table = pa.table({"CHROM": ["2"] * 3, "POS": [1, 2, 3]})
+    pq.write_table(table, str(dataset / "2" / "0.parquet"))
+    assert cache.read(dataset, ("2",)).column("POS").to_pylist() == [1, 2, 3]
+    [entry] = cache.path.glob("*.arrow")
+    assert entry != stale
+
+
+def test_cache_evict(tmp_path, dataset):
+    cache = RegionCache(tmp_path / "cache")
+    cache.read(dataset, ("1",))
+    cache.read(dataset, ("2",))
+    first, second = sorted(cache.path.glob("*.arrow"), key=os.path.getmtime)
+    os.utime(first, ns=(1, 1))
+    os.utime(second, ns=(2, 2))
+    cache.max_size = cache.size  # room for two entries, at most
+    cache.read(dataset, ("1",))  # hit, now the most recently used
+    cache.read(dataset, ("1", 0, 100))
+    entries = set(cache.path.glob("*.arrow"))
+    assert first in entries and second not in entries
+    assert cache.size <= cache.max_size
+
+    cache.clear()
+    assert cache.size == 0
@@ -0,0 +1,80 @@
+import pyarrow.parquet as pq
+import pysam
+import pytest
+
+from genomegenie.merge import merge_calls, pair_calls
+
+header = """##fileformat=VCFv4.2
+##contig=<ID=1,length=1000>
+##contig=<ID=2,length=500>
+##FILTER=<ID=PASS,Description="All filters passed">
+##FILTER=<ID=LowQual,Description="Low quality">
+##INFO=<ID=DP,Number=1,Type=Integer,Description="Depth">
+#CHROM	POS	ID	REF	ALT	QUAL	FILTER	INFO
+"""
+
+calls = {
+    "gatk": [
+        "1	100	rs1	A	G	50.5	PASS	DP=10",
+        "1	200	.	C	T,G	20	PASS	DP=5",
+        "2	50	.	G	A	30	LowQual	DP=7",
+    ],
+    "muse": [
+        "1	100	.	A	G	.	PASS	.",
+        "1	200	.	C	G	.	PASS	.",
+        "1	300	.	T	C	.	PASS	.",
+        "2	50	.	G	A	.	PASS	.",
+    ],
+}
+
+
+def write_calls(directory, records, index):
+    path = directory / "sample.vcf"
+    path.write_text(header + "\n".join(records) + "\n")
+    if index:
+        return pysam.tabix_index(str(path), preset="vcf", force=True)
+    return str(path)
+
+
+@pytest.fixture
+def call_dirs(tmp_path):
+    dirs = {}
+    for caller, records in calls.items():
+        dirs[caller] = tmp_path / caller
+        dirs[caller].mkdir()
+        # muse calls are not indexed, read in one go
+        write_calls(dirs[caller], records, caller == "gatk")
+    return dirs
+
+
+def test_pair_calls(call_dirs):
+    paired = pair_calls(call_dirs)
+    assert list(paired) == ["sample"]
+    assert paired["sample"]["gatk"].endswith("sample.vcf.gz")
+    assert paired["sample"]["muse"].endswith("sample.vcf")
+
+
+@pytest.mark.parametrize(
+    "min_callers, passed_only, expected",
+    [
+        (
+            1,
+            False,
+            [(100, "G", 2), (200, "T", 1), (200, "G", 2), (300, "C", 1), (50, "A", 2)],
+        ),
+        (2, False, [(100, "G", 2), (200, "G", 2), (50, "A", 2)]),
+        (2, True, [(100, "G", 2), (200, "G", 2)]),
+    ],
+)
+def test_merge_calls(call_dirs, tmp_path, min_callers, passed_only, expected):
+    path = tmp_path / "merged.parquet"
+    paired = pair_calls(call_dirs)["sample"]
+    assert merge_calls(paired, path, min_callers, passed_only) == len(expected)
+    table = pq.read_table(path).to_pydict()
+    assert list(zip(table["POS"], table["ALT"], table["NCALLERS"])) == expected
+    assert table["ID"][0] == "rs1"
+    assert table["QUAL_gatk"][0] == 50.5 and table["QUAL_muse"][0] is None
+    if min_callers == 1:
+        assert table["CALL_muse"] == [True, False, True, True, True]
+        assert table["FILTER_gatk"][-1] == ["LowQual"]
+        assert table["FILTER_gatk"][3] is None
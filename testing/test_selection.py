@@ -0,0 +1,95 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from genomegenie.selection import Selection, TakeView, select
+
+
+@pytest.fixture(scope="module")
+def variants():
+    nrows = 100
+    rng = np.random.RandomState(42)
+    return pa.Table.from_arrays(
+        [
+            pa.array(["1"] * 50 + ["2"] * 50),
+            pa.array(np.tile(np.arange(1, 51) * 100, 2), type=pa.int32()),
+            pa.array(rng.randint(0, 60, nrows), type=pa.int8()),
+            pa.array([None if i % 7 == 0 else i for i in range(nrows)], pa.int32()),
+            pa.array([["PASS"] if i % 3 else ["LowQual", "q10"] for i in range(nrows)]),
+            pa.array([[0, i % 2, 1] for i in range(nrows)], pa.list_(pa.int8())),
+        ],
+        names=["CHROM", "POS", "QUAL", "INFO_DP", "FILTER", "GT_s1"],
+    )
+
+
+@pytest.mark.parametrize(
+    "expr, query",
+    [
+        ('CHROM == "1" and POS > 2500', "CHROM == '1' and POS > 2500"),
+        ("1000 <= POS < 2000 or QUAL >= 50", "(1000 <= POS < 2000) or QUAL >= 50"),
+        ("INFO.DP > 90", "INFO_DP > 90"),  # nulls are not selected
+        ("not POS in [100, 200]", "POS not in [100, 200]"),
+        ('CHROM in ["2"] and 30 < QUAL', "CHROM == '2' and QUAL > 30"),
+    ],
+)
+def test_selection(variants, expr, query):
+    df = variants.drop(["FILTER", "GT_s1"]).to_pandas()
+    expected = df.query(query).index.values
+    sel = Selection(expr)
+    assert list(sel.indices(variants).to_numpy()) == list(expected)
+
+
+def test_selection_list_column(variants):
+    sel = Selection('"PASS" in FILTER and POS <= 500')
+    assert sel.columns == ["FILTER", "POS"]
+    assert sel.indices(variants).to_pylist() == [1, 2, 4, 50, 52, 53]
+    assert Selection('"q10" not in FILTER').mask(variants).to_pylist()[:3] == [
+        False,
+        True,
+        True,
+    ]
+
+
+@pytest.mark.parametrize(
+    "expr", ["POS > QUAL", "POS + 1 > 2", "len(CHROM) == 1", "CHROM == foo()"]
+)
+def test_selection_unsupported(expr):
+    with pytest.raises(ValueError):
+        Selection(expr)
+
+
+def test_select_batches(variants):
+    views = list(select(variants.to_batches(max_chunksize=30), "QUAL > 30"))
+    expected = sum(i > 30 for i in variants["QUAL"].to_pylist())
+    assert sum(len(i) for i in views) == expected
+    view = views[0]
+    assert isinstance(view, TakeView)
+    assert all(i > 30 for i in view["QUAL"].to_pylist())
+    assert view.to_table().schema == variants.schema
+
+
+def test_select_parquet(variants, tmp_path):
+    path = tmp_path / "variants.parquet"
+    pq.write_table(variants, path, row_group_size=25)
+
+    reads = []
+    pf = pq.ParquetFile(path)
+    read_row_group = pf.read_row_group
+
+    def _read(i, columns=None, **kwargs):
+        reads.append((i, tuple(columns)))
+        return read_row_group(i, columns=columns, **kwargs)
+
+    pf.read_row_group = _read
+    # row groups 0 & 1 are on chromosome 1, the statistics skip them
+    views = list(select(pf, 'CHROM == "2" and POS >= 2000'))
+    assert reads == [(2, ("CHROM", "POS")), (3, ("CHROM", "POS"))]
+    assert [len(i) for i in views] == [6, 25]
+
+    # wide columns are read when accessed
+    gt = views[0]["GT_s1"]
+    assert reads[-1] == (2, ("GT_s1",))
+    assert gt.to_pylist() == variants["GT_s1"].to_pylist()[69:75]
+    table = views[1].to_table()
+    assert table.num_rows == 25 and table.column_names == variants.column_names
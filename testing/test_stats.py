@@ -0,0 +1,102 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from genomegenie.stats import (
+    cohort_stats,
+    genotypes,
+    hwe_chi2,
+    sample_counts,
+    variant_stats,
+)
+
+_gt_t_ = pa.list_(pa.int8())
+
+
+@pytest.fixture(scope="module")
+def cohort():
+    # 4 variants x 3 samples: [phased, allele 1, allele 2]
+    gts = {
+        "GT_s1": [[0, 0, 0], [1, 0, 1], [0, 1, 1], [0, None, None]],
+        "GT_s2": [[0, 0, 1], [1, 1, 1], [0, 0, 2], [0, 0, 0]],
+        "GT_s3": [[0, 0, 0], None, [0, 1, 0], [0, 0, 1]],
+    }
+    cols = dict((k, pa.array(v, _gt_t_)) for k, v in gts.items())
+    return pa.table(
+        {
+            "CHROM": pa.array(["1"] * 4),
+            "POS": pa.array([100, 200, 300, 400], pa.int32()),
+            **cols,
+        }
+    )
+
+
+def test_genotypes(cohort):
+    alleles = genotypes(cohort)
+    assert alleles.shape == (4, 3, 2)
+    assert alleles[1, 2].tolist() == [-1, -1]  # missing genotype
+    assert alleles[3, 0].tolist() == [-1, -1]  # missing alleles
+    assert alleles[2, 1].tolist() == [0, 2]
+    # sliced blocks
+    assert (genotypes(cohort.slice(1, 2)) == alleles[1:3]).all()
+
+
+def test_variant_stats(cohort):
+    df = variant_stats(cohort)
+    assert list(df.columns[:2]) == ["CHROM", "POS"]
+    assert df.an.tolist() == [6, 4, 6, 4]
+    assert df.ac.tolist() == [1, 3, 4, 1]
+    assert df.call_rate.tolist() == pytest.approx([1, 2 / 3, 1, 2 / 3])
+    assert df.het.tolist() == pytest.approx([1 / 3, 1 / 2, 2 / 3, 1 / 2])
+    assert df.af[0] == pytest.approx(1 / 6)
+
+
+def test_hwe():
+    # 1000 samples, p = 0.5, excess of heterozygotes
+    chi2, p = hwe_chi2(
+        np.array([200, 250, 0]), np.array([600, 500, 0]), np.array([200, 250, 1000])
+    )
+    assert chi2[0] == pytest.approx(40)
+    assert chi2[1] == pytest.approx(0)
+    assert p[0] == pytest.approx(2.539e-10, rel=1e-3)
+    assert p[1] == pytest.approx(1)
+    assert np.isnan(chi2[2])  # monomorphic
+
+
+def test_multiallelic():
+    # reference vs any alternate allele: 1/2 is homozygous alternate
+    gts = {"GT_s1": [[0, 1, 2]], "GT_s2": [[0, 0, 1]], "GT_s3": [[0, 0, 0]]}
+    table = pa.table(dict((k, pa.array(v, _gt_t_)) for k, v in gts.items()))
+    df = variant_stats(table)
+    assert df.ac.tolist() == [3]
+    assert df.het.tolist() == pytest.approx([1 / 3])
+    chi2, _ = hwe_chi2(np.array([1]), np.array([1]), np.array([1]))
+    assert df.hwe_chi2.tolist() == pytest.approx(chi2.tolist())
+    counts = sample_counts(table)
+    assert counts.n_het.tolist() == [0, 1, 0]
+    assert counts.n_hom_alt.tolist() == [1, 0, 0]
+
+
+def test_sample_counts(cohort):
+    counts = sample_counts(cohort)
+    assert list(counts.index) == ["s1", "s2", "s3"]
+    assert counts.n_called.tolist() == [3, 4, 3]
+    assert counts.n_het.tolist() == [1, 2, 2]
+    assert counts.n_hom_alt.tolist() == [1, 1, 0]
+
+
+def test_cohort_stats(cohort, tmp_path):
+    paths = [str(tmp_path / f"part{i}.parquet") for i in range(2)]
+    for path in paths:
+        pq.write_table(cohort, path, row_group_size=1)
+    variants, samples = cohort_stats(paths, nthreads=4)
+    expected = variant_stats(cohort)
+    assert len(variants) == 2 * len(cohort)
+    assert variants.ac.tolist() == 2 * expected.ac.tolist()
+    assert samples.n_variants.tolist() == [8] * 3
+    assert samples.call_rate.tolist() == pytest.approx([3 / 4, 1, 3 / 4])
+
+    variants, samples = cohort_stats(paths[0], samples=["s2"])
+    assert list(samples.index) == ["s2"]
+    assert variants.an.tolist() == [2] * 4
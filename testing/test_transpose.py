@@ -0,0 +1,89 @@
+import numpy as np
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from genomegenie.transpose import SampleStore, to_sample_major
+
+nvariants, nsamples = 50, 7
+
+
+@pytest.fixture(scope="module")
+def variant_major(tmp_path_factory):
+    rng = np.random.RandomState(7)
+    gt = rng.randint(-1, 3, size=(nsamples, nvariants, 2))
+    phase = rng.randint(0, 2, size=(nsamples, nvariants))
+    columns = {
+        "CHROM": ["1"] * 30 + ["2"] * 20,
+        "POS": list(range(100, 130)) + list(range(10, 30)),
+        "ID": [None] * nvariants,
+        "REF": ["A"] * nvariants,
+        "ALTS": [["C", "G"]] * nvariants,
+    }
+    for s in range(nsamples):
+        columns[f"GT_s{s}"] = pa.array(
+            [
+                [int(p), None if a < 0 else int(a), None if b < 0 else int(b)]
+                for p, (a, b) in zip(phase[s], gt[s])
+            ],
+            pa.list_(pa.int8()),
+        )
+    # a missing genotype
+    columns["GT_s0"] = pa.array(
+        [None] + columns["GT_s0"].to_pylist()[1:], pa.list_(pa.int8())
+    )
+    table = pa.table(columns)
+    path = tmp_path_factory.mktemp("vm") / "variants.parquet"
+    pq.write_table(table, str(path), row_group_size=20)
+    return str(path), table
+
+
+@pytest.mark.parametrize("encoding", ["int8", "bits"])
+def test_sample_major(variant_major, tmp_path, encoding):
+    source, table = variant_major
+    store = to_sample_major(source, tmp_path / "store", block_size=3, encoding=encoding)
+    assert store.chunks == [20, 20, 10]
+    assert len(list((tmp_path / "store").glob("block-*.arrow"))) == 3
+    assert store.variants.column("POS").equals(table.column("POS"))
+
+    for sample in ["s0", "s4", "s6"]:
+        expected = table.column(f"GT_{sample}").to_pylist()
+        if encoding == "bits":  # reference vs alternate
+            expected = [
+                gt[:1] + [None if a is None else min(a, 1) for a in gt[1:]]
+                if gt is not None
+                else None
+                for gt in expected
+            ]
+        res = store.genotypes(sample)
+        assert res.column(f"GT_{sample}").to_pylist() == expected
+        assert res.column("VIDX").to_pylist() == list(range(nvariants))
+        if sample == "s0":  # missing genotype
+            assert res.column("GT_s0")[0].as_py() is None
+
+        # region spanning chunks
+        res = SampleStore(store.path).genotypes(sample, ("1", 115, 125))
+        assert res.column("POS").to_pylist() == list(range(116, 126))
+        rows = res.column("VIDX").to_pylist()
+        assert res.column(f"GT_{sample}").to_pylist() == [expected[i] for i in rows]
+
+        # from a position to the end of the chromosome
+        res = store.genotypes(sample, ("1", 125))
+        assert res.column("POS").to_pylist() == list(range(126, 130))
+
+        res = store.genotypes(sample, ("2",), alt_only=True)
+        assert all(row[0] == "2" for row in zip(res.column("CHROM").to_pylist()))
+        assert all(
+            any(a is not None and a > 0 for a in gt[1:])
+            for gt in res.column(f"GT_{sample}").to_pylist()
+        )
+
+
+def test_sample_major_errors(variant_major, tmp_path):
+    source, _ = variant_major
+    with pytest.raises(ValueError):
+        to_sample_major(source, tmp_path / "store", encoding="float")
+    store = to_sample_major(source, tmp_path / "store", compression="zstd")
+    with pytest.raises(KeyError):
+        store.genotypes("nobody")
+    assert store.genotypes("s1", ("3",)).num_rows == 0
@@ -3,7 +3,7 @@ from uuid import uuid4
 import pytest
 import numpy.random as random
 
-from genomegenie.utils import contents
+from genomegenie.utils import contents, tail, LogIndex
 
 
 def test_contents(tmp_path):
@@ -14,3 +14,30 @@ def test_contents(tmp_path):
     dummy.write_text(file_contents)
 
     assert file_contents == contents(jobid, tmp_path)
+
+
+@pytest.mark.parametrize("nbytes", [8, 4096])
+def test_tail(tmp_path, nbytes):
+    lines = [f"line {i}: {uuid4()}" for i in range(100)]
+    log = tmp_path / "job.o1"
+    log.write_text("\n".join(lines) + "\n")
+
+    res = tail(log, nbytes).splitlines()
+    assert res and res[-1] == lines[-1]
+    assert res == lines[-len(res) :]
+
+    log.write_text("single line")
+    assert tail(log, 4) == "single line"
+
+
+def test_logindex(tmp_path):
+    for jobid, status in [(1, "finished"), (2, "failed"), ("3.1", "finished")]:
+        log = tmp_path / f"{uuid4()}.o{jobid}"
+        log.write_text(f"blabla\nPipeline job {status}: {jobid}\n")
+    (tmp_path / "job.o4").write_text("still running")
+    (tmp_path / "unrelated.txt").write_text("")
+
+    index = LogIndex(tmp_path)
+    assert 4 == len(index)
+    assert 1 in index and "3.1" in index and 5 not in index
+    assert index.status([1, 2, "3.1", 4, 5]) == [True, False, True, None, None]